@@ -4,10 +4,23 @@ See SIHNPY documentation for more information on the functions of the script.
 
 """
 import os
+import re
+import json
+import hashlib
+import fnmatch
+import itertools
+import struct
+import zipfile
+import tempfile
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
-from scipy import stats
+from scipy import stats, sparse
+from scipy.io import loadmat
+from scipy.spatial.distance import cdist
+from sklearn.utils.extmath import randomized_svd
 
 def import_fingerprint_ids(id_list):
     """Function importing the list of IDs to analyze. We assume that the list of IDs are stored
@@ -44,64 +57,1316 @@ def import_fingerprint_ids(id_list):
 
     return id_ls
 
+def iter_matrix_files(path, pattern=None, recursive=False):
+    """Function lazily listing the files of a folder, for example the connectivity matrices of
+    a cohort. Folders are read with `os.scandir`, which in most file systems tells apart files
+    and folders without an extra system call per file. Files are yielded as they are found.
+
+    Parameters
+    ----------
+    path : str
+        Path to the folder to search.
+    pattern : str, optional
+        Glob pattern the files must match, relative to `path`. Folders are separated with "/"
+        and "**" matches any number of folders (e.g., `sub-*/ses-*/func/*_connectome.tsv`).
+        By default None (all files)
+    recursive : bool, optional
+        Whether or not to also search the sub-folders when the pattern doesn't specify the
+        folders (e.g., `*.txt` is then searched as `**/*.txt`), by default False
+
+    Yields
+    ------
+    str
+        Path of each file, relative to `path` (e.g., `sub-01/ses-1/matrix.txt`).
+    """
+    if pattern is None:
+        pattern = "*"
+    segments = pattern.split("/")
+    if recursive is True and len(segments) == 1:
+        segments = ["**"] + segments
+
+    yield from _iter_pattern(path, segments, "")
+
+def _iter_pattern(path, segments, rel_path):
+    """Internal function walking a folder one level at a time and only descending in the
+    sub-folders matching the next segment of the pattern.
+
+    Parameters
+    ----------
+    path : str
+        Path to the root folder.
+    segments : list of str
+        Remaining segments of the glob pattern.
+    rel_path : str
+        Path of the current folder, relative to `path`.
+
+    Yields
+    ------
+    str
+        Path of each file matching the pattern, relative to `path`.
+    """
+    #List the folder, then close it before descending so only one folder is open at a time
+    with os.scandir(f"{path}/{rel_path}" if rel_path else path) as entries:
+        entries = list(entries)
+
+    if segments[0] == "**":
+        #"**" matches the current folder...
+        yield from _iter_pattern(path, segments[1:], rel_path)
+        #...and any of its sub-folders
+        for entry in entries:
+            if entry.is_dir():
+                yield from _iter_pattern(path, segments, f"{rel_path}{entry.name}/")
+        return
+
+    for entry in entries:
+        if fnmatch.fnmatchcase(entry.name, segments[0]) is False:
+            continue
+        if len(segments) == 1:
+            if entry.is_file():
+                yield f"{rel_path}{entry.name}"
+        elif entry.is_dir():
+            yield from _iter_pattern(path, segments[1:], f"{rel_path}{entry.name}/")
+
+def _match_files(id_ls, filenames, pattern=None):
+    """Internal function building an index of which files belong to which participant ID.
+
+    By default, an ID matches a file if the ID is found anywhere in the file name (e.g., ID
+    6745 matches `part6745_rest.txt`). Instead of testing every ID against every file, we look
+    up every substring of the file name that has the length of an ID in a set of the IDs, so
+    the cost grows with the number of files rather than with IDs x files. If a regular
+    expression is given, the ID is instead extracted from the file name (named group `id`,
+    else the first group, else the whole match) and looked up directly.
+
+    Parameters
+    ----------
+    id_ls : list of str
+        List of participant IDs.
+    filenames : list of str
+        List of file names.
+    pattern : str, optional
+        Regular expression extracting the ID from the file names (e.g., `sub-(?P<id>\\d+)_`),
+        by default None
+
+    Returns
+    -------
+    dict, dict
+        Returns a dictionary where the keys are the IDs and the values the list of files matched
+        to the ID (in the order of `filenames`) and a dictionary of the files matched by more
+        than one ID (e.g., `6745.txt` is matched by both IDs `674` and `6745`) where the values
+        are the list of IDs.
+    """
+    id_set = set(id_ls)
+    id_lengths = sorted({len(subject) for subject in id_set})
+    regex = re.compile(pattern) if pattern is not None else None
+
+    file_index = {}
+    collisions = {}
+    for filename in filenames:
+        if regex is not None:
+            match = regex.search(filename)
+            if match is None:
+                continue
+            if "id" in regex.groupindex:
+                found = {match.group("id")}
+            else:
+                found = {match.group(1) if regex.groups else match.group(0)}
+            found &= id_set
+        else:
+            found = {filename[start:start + length] for length in id_lengths
+                for start in range(len(filename) - length + 1)} & id_set
+
+        for subject in found:
+            file_index.setdefault(subject, []).append(filename)
+        if len(found) > 1:
+            collisions[filename] = sorted(found)
+
+    return file_index, collisions
+
+def _check_matches(file_index, collisions, retained):
+    """Internal function checking that every participant retained can be attributed exactly
+    one file. A file matched by more than one ID (e.g., `6745.txt` by `674` and `6745`) can't be
+    attributed as soon as one of these IDs is retained, even if the other ID is missing from
+    the other modality, and a participant matched to more than one file would shift the files
+    of the participants coming after them.
+
+    Parameters
+    ----------
+    file_index : dict
+        Dictionary of the files matched to every ID (see `_match_files`).
+    collisions : dict
+        Dictionary of the files matched by more than one ID (see `_match_files`).
+    retained : list of str
+        List of the participants retained.
+
+    Raises
+    ------
+    SystemExit
+        If a file of a participant retained is matched by more than one ID, exit.
+    SystemExit
+        If a participant retained is matched to more than one file, exit.
+    """
+    retained = set(retained)
+    collisions = {filename: subjects for filename, subjects in collisions.items()
+        if len(set(subjects) & retained) != 0}
+    if len(collisions) != 0:
+        raise SystemExit("ERROR: Some files are matched by more than one ID: " +
+            "; ".join(f"{filename} ({', '.join(subjects)})"
+                for filename, subjects in collisions.items()) +
+            ". Use the `pattern` argument to extract the IDs from the file names.")
+
+    multiple = {subject: file_index[subject] for subject in sorted(retained)
+        if len(file_index[subject]) > 1}
+    if len(multiple) != 0:
+        raise SystemExit("ERROR: Some IDs are matched to more than one file: " +
+            "; ".join(f"{subject} ({', '.join(filenames)})"
+                for subject, filenames in multiple.items()) +
+            ". Use the `pattern` argument to extract the IDs from the file names.")
+
+def _parse_node_set(name, node_set):
+    """Internal function reading a set of nodes of `fingerprint_mats_batch`: either a sequence
+    of nodes (within-network, also as a tuple) or a tuple of two sequences of nodes
+    (between-network, `(nodes_index_within, nodes_index_between)`).
+
+    Parameters
+    ----------
+    name : str
+        Name of the set of nodes, for the error message.
+    node_set : list or tuple
+        Set of nodes.
+
+    Returns
+    -------
+    tuple
+        Returns the set of nodes as `(nodes_index_within, nodes_index_between)`, with None as
+        `nodes_index_between` for a within-network set.
+
+    Raises
+    ------
+    SystemExit
+        If the set of nodes is neither a sequence of nodes nor a pair of sequences of nodes.
+    """
+    if isinstance(node_set, tuple) and len(node_set) == 2\
+        and np.ndim(node_set[0]) == 1 and (node_set[1] is None or np.ndim(node_set[1]) == 1):
+        return node_set
+    if not isinstance(node_set, str) and np.ndim(node_set) == 1\
+        and all(np.ndim(node) == 0 for node in node_set):
+        return (node_set, None)
+
+    raise SystemExit(f"ERROR: The set of nodes {name} should be a list of nodes \
+    (within-network) or a tuple of two lists of nodes (between-network).")
+
 def _slice_matrix(matrix_file, nodes_index_within, nodes_index_between=None):
     """Internal function slicing matrices and returning "flattened" vectors.
 
     Parameters
     ----------
-    matrix_file : numpy.array
-        Array for a given participant comprising all the functional connectivity nodes.
-    nodes_index_between : list
-        List of nodes to include in the fingerprinting calculation. If not interested in looking
-        at between-network, the function defaults to calculating within-network. Defaults to None.
-    nodes_index_within : list
-        List of nodes to include in the fingerprinting calculation.
+    matrix_file : numpy.array
+        Array for a given participant comprising all the functional connectivity nodes.
+    nodes_index_between : list
+        List of nodes to include in the fingerprinting calculation. If not interested in looking
+        at between-network, the function defaults to calculating within-network. Defaults to None.
+    nodes_index_within : list
+        List of nodes to include in the fingerprinting calculation.
+
+    Returns
+    -------
+    numpy.array
+        Returns a flattened array of the functional connectivity data. If the matrix is a
+        `scipy.sparse` matrix, returns a sparse row (1, edges) instead.
+    """
+
+    if sparse.issparse(matrix_file):
+        return _slice_sparse_matrix(matrix_file, nodes_index_within, nodes_index_between)
+
+    r_flat = _apply_edge_plan(matrix_file,
+        _compile_edge_plan([(nodes_index_within, nodes_index_between)]))[0]
+
+    return r_flat
+
+def _compile_edge_plan(node_sets):
+    """Internal function compiling, once for all the participants, which cells of the
+    matrices are kept for every set of nodes. The plan holds the rows needed by any set of
+    nodes and, for every set, the (row, column) of each edge within these rows, in the order
+    of the flattened vector returned by `_slice_matrix`:
+
+    - Within-network: upper triangle of the sub-matrix (without the diagonal). The
+      within-network matrix is symmetric, so including the bottom half would over-estimate
+      the correlation.
+    - Between-network: every cell of the sub-matrix, row by row.
+
+    Parameters
+    ----------
+    node_sets : list of tuple
+        List of `(nodes_index_within, nodes_index_between)` pairs. `nodes_index_between` is None
+        for within-network fingerprinting.
+
+    Returns
+    -------
+    dict
+        Returns the plan: the rows needed (`rows`), the position of the row and the column of
+        every edge of every set (`edges`) and the flat indices already computed for a given
+        number of columns (`flat`, filled by `_apply_edge_plan`).
+    """
+    rows = np.unique(np.concatenate([np.asarray(nodes_within, dtype=int)
+        for nodes_within, _ in node_sets]))
+
+    edges = []
+    for nodes_within, nodes_between in node_sets:
+        row_pos = np.searchsorted(rows, np.asarray(nodes_within, dtype=int))
+        if nodes_between:
+            nodes_between = np.asarray(nodes_between, dtype=int)
+            edges.append((np.repeat(row_pos, len(nodes_between)),
+                np.tile(nodes_between, len(row_pos))))
+        else:
+            upper_rows, upper_cols = np.triu_indices(len(row_pos), k=1)
+            edges.append((row_pos[upper_rows], np.asarray(nodes_within, dtype=int)[upper_cols]))
+
+    return {"rows": rows, "edges": edges, "flat": {}}
+
+def _apply_edge_plan(matrix_file, plan):
+    """Internal function extracting the edges of a matrix with a plan from
+    `_compile_edge_plan`. Only the rows needed are read (a slice if they are contiguous, so a
+    memory-mapped matrix is only read where needed), then the edges of every set of nodes are
+    gathered with a single `numpy.take`.
+
+    Parameters
+    ----------
+    matrix_file : numpy.array
+        Array (or memory-map) for a given participant comprising all the nodes.
+    plan : dict
+        Edge-selection plan from `_compile_edge_plan`.
+
+    Returns
+    -------
+    list of numpy.array
+        Returns the flattened edges for every set of nodes.
+    """
+    rows = plan["rows"]
+    n_cols = np.shape(matrix_file)[1]
+    if len(rows) == rows[-1] - rows[0] + 1:
+        block = matrix_file[rows[0]:rows[-1] + 1]
+    else:
+        block = matrix_file[rows]
+
+    #Flat indices only depend on the number of columns, so they are computed once
+    if n_cols not in plan["flat"]:
+        plan["flat"][n_cols] = [row_pos * n_cols + cols for row_pos, cols in plan["edges"]]
+
+    block = np.ascontiguousarray(block)
+    return [np.take(block, flat_index) for flat_index in plan["flat"][n_cols]]
+
+def _slice_sparse_matrix(matrix_file, nodes_index_within, nodes_index_between=None):
+    """Internal function slicing a sparse matrix. Only the stored (nonzero) cells are looked
+    at: each is mapped to its position in the flattened vector returned by `_slice_matrix`
+    for a dense matrix, so the cost depends on the number of nonzero edges.
+
+    Parameters
+    ----------
+    matrix_file : scipy.sparse matrix
+        Sparse matrix for a given participant comprising all the functional connectivity nodes.
+    nodes_index_within : list
+        List of nodes to include in the fingerprinting calculation.
+    nodes_index_between : list, optional
+        List of nodes to use as columns for between-network fingerprinting, by default None
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Returns a sparse row of shape (1, edges).
+    """
+    coo = matrix_file.tocoo()
+    n_within = len(nodes_index_within)
+
+    #Position of each node in the list of nodes (-1 if the node is not selected)
+    pos_within = np.full(coo.shape[0], -1)
+    pos_within[nodes_index_within] = np.arange(n_within)
+    row_pos = pos_within[coo.row]
+
+    if nodes_index_between:
+        pos_between = np.full(coo.shape[1], -1)
+        pos_between[nodes_index_between] = np.arange(len(nodes_index_between))
+        col_pos = pos_between[coo.col]
+        keep = (row_pos >= 0) & (col_pos >= 0)
+        edge_index = row_pos * len(nodes_index_between) + col_pos
+        n_edges = n_within * len(nodes_index_between)
+    else:
+        col_pos = pos_within[coo.col]
+        #Upper triangle of the sub-matrix only, like np.triu_indices(k=1)
+        keep = (row_pos >= 0) & (col_pos >= 0) & (row_pos < col_pos)
+        edge_index = row_pos * n_within - row_pos * (row_pos + 1) // 2 + col_pos - row_pos - 1
+        n_edges = n_within * (n_within - 1) // 2
+
+    return sparse.csr_matrix(
+        (coo.data[keep], (np.zeros(keep.sum(), dtype=int), edge_index[keep])),
+        shape=(1, n_edges))
+
+def _norm_data(array_to_norm, norm=True):
+    """Internal function normalizing (if necessary) the arrays before fingeprinting. If normalizing, we change the cells that are calculated as Infinity to be missing.
+
+    Parameters
+    ----------
+    array_to_norm : numpy.array
+        Raw sliced array to normalize.
+    norm : bool, optional
+        Whether or not the normalization should be applied, by default True
+
+    Returns
+    -------
+    numpy.array
+        Array with the chosen normalization applied to. Returns a copy of the array if no
+        normalization is applied.
+    """
+
+    if sparse.issparse(array_to_norm):
+        #The Fisher transformation keeps zeros at zero, so only the stored values change
+        z1_norm = array_to_norm.copy()
+        if norm is True:
+            with np.errstate(all='ignore'):
+                z1_norm.data = np.arctanh(z1_norm.data)
+            z1_norm.data[np.isinf(z1_norm.data)] = 0
+            z1_norm.eliminate_zeros()
+        return z1_norm
+
+    if norm is True:
+        #By default, we apply a Fisher normalization.
+        np.seterr(all='ignore') #Ignore "division by Zero Warning."
+        z1_transf = np.arctanh(array_to_norm)
+        z1_norm = np.where(np.isinf(z1_transf), 0, z1_transf)
+    else:
+        z1_norm = array_to_norm.copy()
+
+    return z1_norm
+
+def _detect_format(matrix_path):
+    """Internal function detecting the format of a matrix file. Binary formats are recognized
+    from their extension or their first bytes. For text files, the delimiter is sniffed from
+    the first line of data (comment and blank lines are skipped), so the file only needs to be
+    parsed once. Tab-separated files are read as whitespace-separated, which also accepts
+    trailing tabs.
+
+    Parameters
+    ----------
+    matrix_path : str
+        Path to the matrix file.
+
+    Returns
+    -------
+    str
+        Returns the format of the file, one of the keys of `_MATRIX_READERS`.
+    """
+    extension = os.path.splitext(matrix_path)[1].lower().lstrip('.')
+    if extension in ["npy", "npz", "mat"]:
+        return extension
+
+    with open(matrix_path, 'rb') as file:
+        first_line = file.readline()
+        if first_line.startswith(b'\x93NUMPY'):
+            return "npy"
+        if first_line.startswith(b'PK'):
+            return "npz"
+        if first_line.startswith(b'MATLAB'):
+            return "mat"
+        #Comments are skipped by `numpy.loadtxt`, so they shouldn't decide the delimiter
+        while first_line and (first_line.lstrip().startswith(b'#') or not first_line.strip()):
+            first_line = file.readline()
+    if b',' in first_line:
+        return "csv"
+
+    return "whitespace"
+
+def _read_text_matrix(matrix_path, delimiter=None):
+    """Internal function parsing a connectivity matrix stored as text. The delimiter is known
+    beforehand (see `_detect_format`), so the file is parsed once. The C parser of
+    `numpy.loadtxt` is used: on wide, square matrices, it is faster than `pandas.read_csv`
+    which has an overhead for every column.
+
+    Parameters
+    ----------
+    matrix_path : str
+        Path to the matrix file.
+    delimiter : str, optional
+        Delimiter of the values, by default None (any whitespace)
+
+    Returns
+    -------
+    numpy.array
+        Returns a numpy array containing the matrix.
+    """
+    return np.loadtxt(matrix_path, delimiter=delimiter, dtype=np.double, ndmin=2)
+
+def _read_npz_matrix(matrix_path):
+    """Internal function importing a matrix saved in a `.npz` file, either a sparse matrix
+    (`scipy.sparse.save_npz`) or the first array of the archive (`numpy.savez`).
+
+    Parameters
+    ----------
+    matrix_path : str
+        Path to the matrix file.
+
+    Returns
+    -------
+    numpy.array or scipy.sparse.csr_matrix
+        Returns the matrix.
+    """
+    with np.load(matrix_path) as archive:
+        if {"format", "shape", "data"} <= set(archive.files):
+            return sparse.load_npz(matrix_path).tocsr()
+        return archive[archive.files[0]]
+
+def _read_mat_matrix(matrix_path):
+    """Internal function importing a matrix saved in a MATLAB `.mat` file. The first
+    2D variable of the file is used.
+
+    Parameters
+    ----------
+    matrix_path : str
+        Path to the matrix file.
+
+    Returns
+    -------
+    numpy.array or scipy.sparse.csr_matrix
+        Returns the matrix (sparse if it is stored as a sparse MATLAB matrix).
+
+    Raises
+    ------
+    SystemExit
+        If the file doesn't contain any 2D variable.
+    """
+    for variable, value in loadmat(matrix_path).items():
+        if not variable.startswith('__') and np.ndim(value) == 2:
+            return value.tocsr() if sparse.issparse(value) else np.asarray(value, dtype=np.double)
+
+    raise SystemExit(f"ERROR: No matrix found in {matrix_path}.")
+
+#Readers of the matrix files, by format (see `_detect_format`)
+_MATRIX_READERS = {
+    "npy": lambda matrix_path: np.load(matrix_path, mmap_mode='r'),
+    "npz": _read_npz_matrix,
+    "mat": _read_mat_matrix,
+    "csv": lambda matrix_path: _read_text_matrix(matrix_path, delimiter=','),
+    "whitespace": lambda matrix_path: _read_text_matrix(matrix_path)}
+
+def _cache_path(matrix_path, cache_dir):
+    """Internal function returning where the binary copy of a matrix file is stored in the cache.
+    The name of the cached file is keyed on the absolute path, the size and the modification
+    time of the original file, so an edited file never reuses an outdated copy.
+
+    Parameters
+    ----------
+    matrix_path : str
+        Path to the original matrix file.
+    cache_dir : str
+        Directory where the cached matrices are stored.
+
+    Returns
+    -------
+    str
+        Path to the cached `.npy` file.
+    """
+    file_stat = os.stat(matrix_path)
+    key = hashlib.sha1(
+        f"{os.path.abspath(matrix_path)}|{file_stat.st_size}|{file_stat.st_mtime_ns}".encode()
+    ).hexdigest()
+    file_name = os.path.splitext(os.path.basename(matrix_path))[0]
+
+    return f"{cache_dir}/{file_name}_{key}.npy"
+
+def _load_matrix(matrix_path, cache_dir=None, as_sparse=False, file_format=None):
+    """Internal function importing a connectivity matrix with the reader of its format
+    (text, `.npy`, `.npz` or `.mat`). If a cache directory is given, text and `.mat` files
+    are only parsed the first time: they are then stored as a `.npy` file which is
+    memory-mapped on later imports. Sparse matrices (e.g., saved with
+    `scipy.sparse.save_npz`) are kept sparse.
+
+    Parameters
+    ----------
+    matrix_path : str
+        Path to the matrix file.
+    cache_dir : str, optional
+        Directory where the binary copies of the matrices are stored, by default None (no cache)
+    as_sparse : bool, optional
+        Whether to return the matrix as a `scipy.sparse.csr_matrix`, by default False
+    file_format : str, optional
+        Format of the file (see `_detect_format`), by default None (detected from the file)
+
+    Returns
+    -------
+    numpy.array
+        Returns a numpy array (or a read-only memory-map) containing the matrix. If the file
+        holds a sparse matrix or `as_sparse` is True, returns a sparse matrix.
+    """
+    if file_format is None:
+        file_format = _detect_format(matrix_path)
+    reader = _MATRIX_READERS[file_format]
+
+    if as_sparse is True:
+        matrix_file = _load_matrix(matrix_path, cache_dir, file_format=file_format)
+        return matrix_file if sparse.issparse(matrix_file) else sparse.csr_matrix(matrix_file)
+
+    #Binary numpy files are already fast to load, they are never cached
+    if cache_dir is None or file_format in ["npy", "npz"]:
+        return reader(matrix_path)
+
+    cached_file = _cache_path(matrix_path, cache_dir)
+    if os.path.exists(cached_file):
+        return np.load(cached_file, mmap_mode='r')
+
+    matrix_file = reader(matrix_path)
+    if sparse.issparse(matrix_file):
+        return matrix_file
+
+    if os.path.exists(cache_dir) is False:
+        os.makedirs(cache_dir, exist_ok=True)
+    #Write to a temporary file first so an interrupted run never leaves a partial cache file
+    tmp_file = f"{cached_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        np.save(f, matrix_file)
+    os.replace(tmp_file, cached_file)
+
+    return matrix_file
+
+def _timeseries_connectivity(timeseries, node_sets, connectivity="correlation"):
+    """Internal function computing the connectivity matrix of a participant from its regional
+    time series. For the correlation, only the nodes used by the sets of nodes are correlated.
+    The partial correlation is conditioned on every node, so it is computed from the
+    precision (inverse covariance) matrix of all the nodes, then restricted to the nodes used.
+
+    Parameters
+    ----------
+    timeseries : numpy.array
+        2D array of shape (time points, nodes).
+    node_sets : list of tuple
+        List of `(nodes_index_within, nodes_index_between)` pairs.
+    connectivity : str, optional
+        Connectivity measure, by default "correlation". Options include: ["correlation",
+        "partial correlation"]
+
+    Returns
+    -------
+    numpy.array, list of tuple
+        Returns the connectivity matrix between the nodes used and the sets of nodes indexed
+        within this matrix.
+
+    Raises
+    ------
+    SystemExit
+        If the connectivity measure is not supported.
+    """
+    if connectivity not in ["correlation", "partial correlation"]:
+        raise SystemExit(f"ERROR: Connectivity {connectivity} is not supported. Use \
+        'correlation' or 'partial correlation'.")
+
+    timeseries = np.asarray(timeseries, dtype=np.double)
+    nodes_used = sorted({node for nodes_within, nodes_between in node_sets
+        for node in list(nodes_within) + list(nodes_between or [])})
+    position = {node: i for i, node in enumerate(nodes_used)}
+
+    if connectivity == "correlation":
+        conn_matrix = np.corrcoef(timeseries[:, nodes_used], rowvar=False)
+    else:
+        precision = np.linalg.pinv(np.cov(timeseries, rowvar=False))[np.ix_(nodes_used,
+            nodes_used)]
+        scale = np.sqrt(np.diag(precision))
+        conn_matrix = -precision / np.outer(scale, scale)
+        np.fill_diagonal(conn_matrix, 1)
+
+    node_sets = [([position[node] for node in nodes_within],
+        [position[node] for node in nodes_between] if nodes_between else None)
+        for nodes_within, nodes_between in node_sets]
+
+    return conn_matrix, node_sets
+
+def _matrix_features(matrix_path, node_sets, norm=True, cache_dir=None, as_sparse=False,
+    connectivity=None, file_format=None, plan=None):
+    """Internal function importing a single matrix and slicing and normalizing it for every
+    requested set of nodes. This is the unit of work sent to the workers when the matrices
+    are imported in parallel.
+
+    Parameters
+    ----------
+    matrix_path : str
+        Path to the matrix file.
+    node_sets : list of tuple
+        List of `(nodes_index_within, nodes_index_between)` pairs. `nodes_index_between` is None
+        for within-network fingerprinting.
+    norm : bool, optional
+        Whether or not to Fisher normalize the data, by default True
+    cache_dir : str, optional
+        Directory where the binary copies of the matrices are stored, by default None
+    as_sparse : bool, optional
+        Whether to keep the matrix and the features sparse, by default False
+    connectivity : str, optional
+        If given, the file contains time series (time points x nodes) and the connectivity is
+        computed with this measure (see `_timeseries_connectivity`), by default None
+    file_format : str, optional
+        Format of the file (see `_detect_format`), by default None (detected from the file)
+    plan : dict, optional
+        Edge-selection plan of `node_sets` (see `_compile_edge_plan`), by default None
+        (compiled for this matrix)
+
+    Returns
+    -------
+    list of numpy.array
+        Flattened and normalized connectivity of the participant, for every set of nodes
+        (sparse rows if the matrix is sparse).
+    """
+    if connectivity is not None:
+        #The connectivity only lives in memory, for the nodes needed
+        matrix_file, node_sets = _timeseries_connectivity(_load_matrix(matrix_path, cache_dir,
+            file_format=file_format), node_sets, connectivity)
+        #The nodes are indexed within the connectivity matrix, so the plan changes
+        plan = None
+        if as_sparse is True:
+            matrix_file = sparse.csr_matrix(matrix_file)
+    else:
+        matrix_file = _load_matrix(matrix_path, cache_dir, as_sparse, file_format)
+
+    #Removes the lower triangle and diagonal if using within-network nodes as it will be
+    # symetric and the diagonal will be "1"
+    if sparse.issparse(matrix_file):
+        r_flats = [_slice_sparse_matrix(matrix_file, nodes_within, nodes_between)
+            for nodes_within, nodes_between in node_sets]
+    else:
+        r_flats = _apply_edge_plan(matrix_file, plan or _compile_edge_plan(node_sets))
+
+    return [_norm_data(r_flat, norm=norm) for r_flat in r_flats]
+
+def _allocate_array(shape, dtype=np.double, memmap_path=None):
+    """Internal function creating an empty array, either in memory or as a `.npy` file
+    memory-mapped from the disk.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the array.
+    dtype : numpy.dtype, optional
+        Type of the values stored in the array, by default np.double
+    memmap_path : str, optional
+        Path to the `.npy` file backing the array, by default None (array in memory)
+
+    Returns
+    -------
+    numpy.array
+        Returns the empty array (or a writable memory-map).
+    """
+    if memmap_path is None:
+        return np.empty(shape, dtype=dtype)
+
+    memmap_dir = os.path.dirname(memmap_path)
+    if memmap_dir and os.path.exists(memmap_dir) is False:
+        os.makedirs(memmap_dir, exist_ok=True)
+
+    return np.lib.format.open_memmap(memmap_path, mode='w+', dtype=dtype, shape=shape)
+
+def _unique_memmap_path(memmap_dir, name):
+    """Internal function reserving a new `.npy` file in a directory, so every run writes its
+    memory-maps to its own files (e.g., `features_m1_k2x9a.npy`). Reusing a fixed name would
+    overwrite the arrays returned by a previous run into the same directory.
+
+    Parameters
+    ----------
+    memmap_dir : str
+        Directory of the memory-maps. It is created if needed.
+    name : str
+        Beginning of the file name.
+
+    Returns
+    -------
+    str
+        Returns the path to the new (empty) file.
+    """
+    if memmap_dir and os.path.exists(memmap_dir) is False:
+        os.makedirs(memmap_dir, exist_ok=True)
+
+    handle, memmap_path = tempfile.mkstemp(prefix=f"{name}_", suffix=".npy", dir=memmap_dir)
+    os.close(handle)
+
+    return memmap_path
+
+def _block_size_from_memory(n_edges, itemsize, memory_limit):
+    """Internal function finding how many participants can be loaded per block so that a tile
+    of the similarity computation fits in the memory budget. A tile holds two blocks of
+    features, their standardized copies and the block of the similarity matrix, so we solve
+    `itemsize * (4 * n_edges * b + b ** 2) = memory_limit` for `b`.
+
+    Parameters
+    ----------
+    n_edges : int
+        Number of edges per participant.
+    itemsize : int
+        Number of bytes per value (8 for float64, 4 for float32).
+    memory_limit : int
+        Memory budget in bytes.
+
+    Returns
+    -------
+    int
+        Returns the number of participants per block (at least 1).
+    """
+    n_values = memory_limit / itemsize
+    block_size = -2 * n_edges + np.sqrt(4 * n_edges ** 2 + n_values)
+
+    return max(1, int(block_size))
+
+def _row_stats(features, block_size=1024, center=True):
+    """Internal function computing, block by block, the mean and the norm of the centered
+    values of every row of a feature array. This way, each row only needs to be summarized
+    once, even if the array is on the disk and never fully loaded in memory.
+
+    Parameters
+    ----------
+    features : numpy.array
+        2D array of shape (participants, edges).
+    block_size : int, optional
+        Number of rows loaded at once, by default 1024
+    center : bool, optional
+        Whether the rows are centered. If False, the means are set to 0 so the standardized
+        rows give the cosine similarity, by default True
+
+    Returns
+    -------
+    numpy.array, numpy.array, bool
+        Returns the mean and the norm of every row, and whether the array has missing values.
+    """
+    n_rows, n_edges = np.shape(features)
+    means = np.empty(n_rows)
+    norms = np.empty(n_rows)
+    has_nan = False
+
+    for start in range(0, n_rows, block_size):
+        if sparse.issparse(features):
+            #Sparse rows are summarized from their sums, without filling in the zeros
+            block = features[start:start + block_size]
+            row_means = np.asarray(block.sum(axis=1)).ravel() / n_edges
+            means[start:start + block_size] = row_means if center is True else 0
+            sq_sums = np.asarray(block.multiply(block).sum(axis=1)).ravel()
+            norms[start:start + block_size] = np.sqrt(np.maximum(
+                sq_sums - n_edges * means[start:start + block_size] ** 2, 0))
+            has_nan = has_nan or bool(np.isnan(block.data).any())
+            continue
+
+        block = np.asarray(features[start:start + block_size], dtype=np.double)
+        means[start:start + block_size] = block.mean(axis=1) if center is True else 0
+        norms[start:start + block_size] = np.linalg.norm(
+            block - means[start:start + block_size, None], axis=1)
+        has_nan = has_nan or bool(np.isnan(block).any())
+
+    return means, norms, has_nan
+
+def _dense_rows(features, dtype=np.double):
+    """Internal function returning a block of feature rows as a dense array, whether the
+    features are a numpy array, a memory-map or a sparse matrix.
+
+    Parameters
+    ----------
+    features : numpy.array or scipy.sparse matrix
+        2D block of features of shape (participants, edges).
+    dtype : numpy.dtype, optional
+        Type of the values returned, by default np.double
+
+    Returns
+    -------
+    numpy.array
+        Dense array of the same shape.
+    """
+    if sparse.issparse(features):
+        return features.toarray().astype(dtype, copy=False)
+    return np.asarray(features, dtype=dtype)
+
+def _sparse_pearson(block_1, block_2, stats_1, stats_2, n_edges, dtype=np.double):
+    """Internal function computing the Pearson correlation between the rows of two sparse
+    blocks. The product of the raw rows only goes through the nonzero edges, and the
+    centering is applied afterwards: sum((x - mx) * (y - my)) = x.y - n * mx * my.
+
+    Parameters
+    ----------
+    block_1 : scipy.sparse matrix
+        Sparse block of shape (participants_1, edges).
+    block_2 : scipy.sparse matrix
+        Sparse block of shape (participants_2, edges).
+    stats_1 : tuple of numpy.array
+        Means and norms of the rows of `block_1`, from `_row_stats`.
+    stats_2 : tuple of numpy.array
+        Means and norms of the rows of `block_2`, from `_row_stats`.
+    n_edges : int
+        Number of edges (columns) of the blocks.
+    dtype : numpy.dtype, optional
+        Type of the values returned, by default np.double
+
+    Returns
+    -------
+    numpy.array
+        Dense array of shape (participants_1, participants_2) with the correlations.
+    """
+    (means_1, norms_1), (means_2, norms_2) = stats_1, stats_2
+    products = (block_1 @ block_2.T).toarray()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tile = (products - n_edges * np.outer(means_1, means_2)) / np.outer(norms_1, norms_2)
+
+    return tile.astype(dtype, copy=False)
+
+def _stack_rows(features_1, features_2):
+    """Internal function stacking the rows of two feature arrays. The result is sparse if
+    either array is sparse.
+
+    Parameters
+    ----------
+    features_1 : numpy.array or scipy.sparse matrix
+        2D array of shape (participants_1, edges).
+    features_2 : numpy.array or scipy.sparse matrix
+        2D array of shape (participants_2, edges).
+
+    Returns
+    -------
+    numpy.array or scipy.sparse.csr_matrix
+        Array of shape (participants_1 + participants_2, edges).
+    """
+    if sparse.issparse(features_1) or sparse.issparse(features_2):
+        return sparse.vstack([sparse.csr_matrix(features_1), sparse.csr_matrix(features_2)],
+            format='csr')
+    return np.concatenate([features_1, features_2])
+
+def _zscore_rows(features, means, norms, dtype=np.double):
+    """Internal function standardizing every row of a feature array so that the dot product
+    of two rows is their Pearson correlation (i.e., rows are centered and scaled to unit norm).
+
+    Parameters
+    ----------
+    features : numpy.array
+        2D array of shape (participants, edges).
+    means : numpy.array
+        Mean of every row, from `_row_stats`.
+    norms : numpy.array
+        Norm of every centered row, from `_row_stats`.
+    dtype : numpy.dtype, optional
+        Type of the values returned, by default np.double
+
+    Returns
+    -------
+    numpy.array
+        Array of the same shape where each row has a mean of 0 and a norm of 1. Rows with no
+        variance are returned as missing values, like `scipy.stats.pearsonr` would.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_rows = (_dense_rows(features, dtype) - means[:, None].astype(dtype))\
+            / norms[:, None].astype(dtype)
+
+    return z_rows
+
+def _masked_pearson(features_1, features_2):
+    """Internal function computing the Pearson correlation between every row of two feature
+    arrays containing missing values. Like the original pairwise computation, the edges missing
+    in either participant are dropped for that pair only. The sums needed for each pair are
+    computed with matrix products over the masks of observed values.
+
+    Parameters
+    ----------
+    features_1 : numpy.array
+        2D array of shape (participants_1, edges).
+    features_2 : numpy.array
+        2D array of shape (participants_2, edges).
+
+    Returns
+    -------
+    numpy.array
+        Array of shape (participants_1, participants_2) with the correlations.
+    """
+    mask_1 = (~np.isnan(features_1)).astype(float)
+    mask_2 = (~np.isnan(features_2)).astype(float)
+    x_1 = np.where(mask_1 == 1, features_1, 0)
+    x_2 = np.where(mask_2 == 1, features_2, 0)
+
+    n_obs = mask_1 @ mask_2.T #Number of edges observed in both participants
+    sum_1 = x_1 @ mask_2.T
+    sum_2 = mask_1 @ x_2.T
+    sum_sq_1 = (x_1 ** 2) @ mask_2.T
+    sum_sq_2 = mask_1 @ (x_2 ** 2).T
+    sum_prod = x_1 @ x_2.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n_obs * sum_prod - sum_1 * sum_2
+        var_1 = n_obs * sum_sq_1 - sum_1 ** 2
+        var_2 = n_obs * sum_sq_2 - sum_2 ** 2
+        corr = cov / np.sqrt(var_1 * var_2)
+
+    return corr
+
+#Maximum number of pairs of edges used to compute the Kendall correlation. Above this, a random
+# subset of pairs (the same for every participant) is used.
+_KENDALL_MAX_PAIRS = 20000
+
+def _sample_pairs(n_edges, n_pairs, seed=0):
+    """Internal function drawing a random subset of pairs of edges `(i, j)` with `i < j`,
+    without listing all the pairs (their number grows with the square of the number of edges).
+    Pairs are drawn with replacement and duplicates are dropped until enough are left.
+
+    Parameters
+    ----------
+    n_edges : int
+        Number of edges.
+    n_pairs : int
+        Number of pairs to draw (less than the number of pairs of edges).
+    seed : int, optional
+        Seed of the random generator, by default 0
+
+    Returns
+    -------
+    tuple of numpy.array
+        Returns the first and the second edges of the pairs, sorted.
+    """
+    rng = np.random.default_rng(seed)
+    keys = np.empty(0, dtype=np.int64)
+    while len(keys) < n_pairs:
+        draws = rng.integers(0, n_edges, size=(2 * n_pairs, 2), dtype=np.int64)
+        draws = np.sort(draws[draws[:, 0] != draws[:, 1]], axis=1)
+        keys = np.concatenate([keys, draws[:, 0] * n_edges + draws[:, 1]])
+        #Keep the first draw of every pair, in the order drawn, so the subset stays random
+        _, first = np.unique(keys, return_index=True)
+        keys = keys[np.sort(first)]
+
+    keys = np.sort(keys[:n_pairs])
+    return keys // n_edges, keys % n_edges
+
+def _rank_features(features, corr_type="Pearson", block_size=1024):
+    """Internal function transforming the features once before the similarity computation, so
+    rank-based correlations can use the same matrix products as the Pearson correlation.
+
+    - Spearman: every row is replaced by its ranks (ties get the average rank). The Pearson
+      correlation of the ranks is the Spearman correlation.
+    - Kendall: every row is replaced by the signs of the differences between pairs of edges.
+      The cosine similarity of the signs is the Kendall tau-b. If there are more than
+      `_KENDALL_MAX_PAIRS` pairs of edges, the same random subset of pairs is used for every
+      participant, which gives an estimate of the tau-b.
+
+    Missing values stay missing for the Spearman correlation (ranks are computed on the
+    observed edges) and are counted as ties for the Kendall correlation. The transformed
+    features are stored with the precision of the features, and memory-mapped next to them
+    when the features are memory-mapped (see `memmap_dir` of `fingerprint_mats`).
+
+    Parameters
+    ----------
+    features : numpy.array
+        2D array of shape (participants, edges).
+    corr_type : str, optional
+        Which correlation measure to use, by default "Pearson"
+    block_size : int, optional
+        Number of rows transformed at once, by default 1024
+
+    Returns
+    -------
+    numpy.array
+        Returns the transformed features (the features themselves for the other measures).
+    """
+    if corr_type not in ["Spearman", "Kendall"]:
+        return features
+
+    n_edges = np.shape(features)[1]
+    dtype = features.dtype if np.issubdtype(features.dtype, np.floating) else np.double
+    memmap_path = None
+    #Only a memory-map of the whole file (not a slice of it, whose base is the memory-map) is
+    # transformed on the disk
+    if isinstance(features, np.memmap) and features.filename is not None\
+        and not isinstance(features.base, np.ndarray):
+        memmap_path = _unique_memmap_path(os.path.dirname(features.filename),
+            f"{os.path.splitext(os.path.basename(features.filename))[0]}_{corr_type.lower()}")
+
+    if corr_type == "Kendall":
+        if n_edges * (n_edges - 1) // 2 > _KENDALL_MAX_PAIRS:
+            pairs = _sample_pairs(n_edges, _KENDALL_MAX_PAIRS)
+        else:
+            pairs = np.triu_indices(n_edges, k=1)
+        transformed = _allocate_array((np.shape(features)[0], len(pairs[0])), dtype=dtype,
+            memmap_path=memmap_path)
+    else:
+        transformed = _allocate_array(np.shape(features), dtype=dtype, memmap_path=memmap_path)
+
+    for start in range(0, np.shape(features)[0], block_size):
+        block = _dense_rows(features[start:start + block_size])
+        if corr_type == "Spearman":
+            #Missing values are ranked last, then put back as missing
+            missing = np.isnan(block)
+            ranks = stats.rankdata(np.where(missing, np.inf, block), axis=1)
+            transformed[start:start + block_size] = np.where(missing, np.nan, ranks)
+        else:
+            transformed[start:start + block_size] = np.nan_to_num(
+                np.sign(block[:, pairs[0]] - block[:, pairs[1]]))
+
+    return transformed
+
+#Measures of similarity between fingerprints. For the distances, a lower value is a better match
+_CORRELATION_METRICS = ["Pearson", "Spearman", "Kendall", "Cosine"]
+_DISTANCE_METRICS = ["Euclidean", "Manhattan", "Geodesic"]
+
+def _greater_is_better(corr_type, greater_is_better=None):
+    """Internal function returning whether a higher value of a similarity measure is a better
+    match (correlations) or a lower one (distances).
+
+    Parameters
+    ----------
+    corr_type : str or callable
+        Similarity measure (see `_similarity_matrix`).
+    greater_is_better : bool, optional
+        If given, it is returned as is (e.g., for a callable), by default None
+
+    Returns
+    -------
+    bool
+        Returns whether a higher value is a better match.
+    """
+    if greater_is_better is not None:
+        return greater_is_better
+
+    return not (isinstance(corr_type, str) and corr_type in _DISTANCE_METRICS)
+
+def _similarity_matrix(features_1, features_2, corr_type="Pearson", block_size=1024,
+    dtype=np.double, out=None, symmetric=False):
+    """Internal function computing the similarity between every row of two feature arrays.
+    The summary statistics of each row are computed once, and the similarity matrix is then
+    filled tile by tile (blocks of rows against blocks of columns) with a matrix product, so
+    the heavy lifting is done by BLAS instead of a Python loop. Since only two blocks of
+    features are loaded at a time, the feature arrays and the output can be memory-maps
+    larger than the memory.
+
+    Besides the correlations, the measure can be the cosine similarity, or a distance (a lower
+    value is a better match):
+
+    - Euclidean: computed from the matrix product, `|x - y|^2 = |x|^2 + |y|^2 - 2 x.y`. For
+      nearly identical rows, the cancellation leaves an error of about the square root of the
+      machine precision times the norm of the rows.
+    - Manhattan: computed tile by tile with `scipy.spatial.distance.cdist`.
+    - Geodesic: angle between the standardized rows (`arccos` of the Pearson correlation),
+      i.e., the distance on the sphere where the standardized fingerprints lie.
+
+    A callable `corr_type(block_1, block_2)` can also be given: it receives two dense blocks of
+    rows and returns the array of similarities between them.
+
+    If `symmetric` is True, only the tiles on or above the diagonal are computed (about half
+    of the work) and the lower triangle is filled with the transpose of the upper triangle.
+
+    Parameters
+    ----------
+    features_1 : numpy.array
+        2D array of shape (participants_1, edges) for the first modality.
+    features_2 : numpy.array
+        2D array of shape (participants_2, edges) for the second modality.
+    corr_type : str or callable, optional
+        Which similarity measure to use, by default "Pearson". Options include: ["Pearson",
+        "Spearman", "Kendall", "Cosine", "Euclidean", "Manhattan", "Geodesic"] (see
+        `_rank_features` for the rank-based correlations) or a callable
+    block_size : int, optional
+        Number of participants per block, by default 1024
+    dtype : numpy.dtype, optional
+        Precision used for the computation and the output, by default np.double
+    out : numpy.array, optional
+        Array (or memory-map) of shape (participants_1, participants_2) where the similarity
+        is written, by default None (a new array is created)
+    symmetric : bool, optional
+        Whether to only compute the upper triangle and mirror it (square matrices only), by
+        default False
 
     Returns
     -------
     numpy.array
-        Returns a flattened array of the functional connectivity data.
+        Array of shape (participants_1, participants_2) with the similarity between the rows.
+
+    Raises
+    ------
+    SystemExit
+        If the correlation type is not supported.
+    SystemExit
+        If a symmetric matrix is requested for a different number of rows and columns.
+    SystemExit
+        If the features have missing values and the measure is not a correlation.
     """
+    if symmetric is True and np.shape(features_1)[0] != np.shape(features_2)[0]:
+        raise SystemExit("ERROR: A symmetric similarity matrix needs the same participants \
+        in both modalities.")
 
-    if nodes_index_between:
-        submatrix = matrix_file[nodes_index_within][:, nodes_index_between]
-        #If between network, we force numpy to flatten the array to match the within-network input
-        r_flat = submatrix.flatten()
-    else:
-        submatrix = matrix_file[nodes_index_within][:, nodes_index_within]
-        #In the within-network, using np.triu_indices return by default a flat array.
-        #We use triu_indices because the within-network matrix is symmetric. Including
-        #the bottom half of the matrix would cause over-estimation of the correlation.
-        r_flat = submatrix[np.triu_indices(len(submatrix), k=1)]
+    if out is None:
+        out = np.empty((np.shape(features_1)[0], np.shape(features_2)[0]), dtype=dtype)
 
-    return r_flat
+    prepared = _prepare_similarity(features_1, features_2, corr_type, block_size)
+    for row in range(0, np.shape(features_1)[0], block_size):
+        rows = slice(row, row + block_size)
+        block_1 = _similarity_rows(prepared, rows, corr_type, dtype)
+        #In the symmetric mode, the tiles below the diagonal are skipped
+        for col in range(row if symmetric else 0, np.shape(features_2)[0], block_size):
+            cols = slice(col, col + block_size)
+            out[rows, cols] = _similarity_tile(prepared, block_1, rows, cols, corr_type, dtype)
 
-def _norm_data(array_to_norm, norm=True):
-    """Internal function normalizing (if necessary) the arrays before fingeprinting. If normalizing, we change the cells that are calculated as Infinity to be missing.
+    if symmetric is True:
+        _mirror_upper(out, block_size)
+
+    return out
+
+def _prepare_similarity(features_1, features_2, corr_type="Pearson", block_size=1024):
+    """Internal function doing, once for all the tiles, the work the similarity needs for
+    every row: the rank (or sign) transform of the rank-based correlations and the summary
+    statistics of the rows (see `_similarity_matrix`).
 
     Parameters
     ----------
-    array_to_norm : numpy.array
-        Raw sliced array to normalize.
-    norm : bool, optional
-        Whether or not the normalization should be applied, by default True
+    features_1 : numpy.array
+        2D array of shape (participants_1, edges) for the first modality.
+    features_2 : numpy.array
+        2D array of shape (participants_2, edges) for the second modality.
+    corr_type : str or callable, optional
+        Which similarity measure to use, by default "Pearson"
+    block_size : int, optional
+        Number of rows processed at once, by default 1024
+
+    Returns
+    -------
+    dict
+        Returns the (transformed) features, the means and norms of their rows, and how the
+        tiles are computed (`masked`, `use_sparse`, `tile_function`).
+
+    Raises
+    ------
+    SystemExit
+        If the correlation type is not supported.
+    SystemExit
+        If the features have missing values and the measure is not a correlation.
+    """
+    if not callable(corr_type) and corr_type not in _CORRELATION_METRICS + _DISTANCE_METRICS:
+        raise SystemExit(f"ERROR: Correlation type {corr_type} is not supported.")
+
+    #Measures computed on dense blocks of raw features, without summary statistics
+    if callable(corr_type) or corr_type == "Manhattan":
+        tile_function = corr_type if callable(corr_type) else partial(cdist, metric='cityblock')
+        return {"features_1": features_1, "features_2": features_2,
+            "tile_function": tile_function}
+
+    #Ranks (or signs) are computed once per participant
+    features_1 = _rank_features(features_1, corr_type, block_size)
+    features_2 = _rank_features(features_2, corr_type, block_size)
+
+    center = corr_type in ["Pearson", "Spearman", "Geodesic"]
+    means_1, norms_1, nan_1 = _row_stats(features_1, block_size, center=center)
+    means_2, norms_2, nan_2 = _row_stats(features_2, block_size, center=center)
+    #Missing values need to be dropped pair by pair, which requires the masked computation
+    masked = nan_1 or nan_2
+    if masked and not center:
+        raise SystemExit(f"ERROR: Missing values are not supported with {corr_type}.")
+    #Sparse features stay sparse in the matrix products (rank transforms are already dense)
+    use_sparse = sparse.issparse(features_1) and sparse.issparse(features_2) and not masked
+
+    return {"features_1": features_1, "features_2": features_2, "means_1": means_1,
+        "norms_1": norms_1, "means_2": means_2, "norms_2": norms_2, "masked": masked,
+        "use_sparse": use_sparse, "tile_function": None}
+
+def _similarity_rows(prepared, rows, corr_type="Pearson", dtype=np.double):
+    """Internal function returning a block of rows of the first modality, ready to be compared
+    to blocks of the second modality with `_similarity_tile`.
+
+    Parameters
+    ----------
+    prepared : dict
+        Output of `_prepare_similarity`.
+    rows : slice
+        Rows of the first modality.
+    corr_type : str or callable, optional
+        Which similarity measure to use, by default "Pearson"
+    dtype : numpy.dtype, optional
+        Precision used for the computation, by default np.double
 
     Returns
     -------
     numpy.array
-        Array with the chosen normalization applied to. Returns a copy of the array if no
-        normalization is applied.
+        Returns the block of rows (standardized for the correlations).
     """
+    features_1 = prepared["features_1"]
+    if prepared["tile_function"] is not None or prepared["masked"]:
+        return _dense_rows(features_1[rows])
+    if prepared["use_sparse"]:
+        return features_1[rows]
+    if corr_type == "Euclidean":
+        return _dense_rows(features_1[rows], dtype)
 
-    if norm is True:
-        #By default, we apply a Fisher normalization.
-        np.seterr(all='ignore') #Ignore "division by Zero Warning."
-        z1_transf = np.arctanh(array_to_norm)
-        z1_norm = np.where(np.isinf(z1_transf), 0, z1_transf)
+    return _zscore_rows(features_1[rows], prepared["means_1"][rows], prepared["norms_1"][rows],
+        dtype)
+
+def _similarity_tile(prepared, block_1, rows, cols, corr_type="Pearson", dtype=np.double):
+    """Internal function computing the similarity between a block of rows of the first
+    modality (from `_similarity_rows`) and a block of rows of the second modality.
+
+    Parameters
+    ----------
+    prepared : dict
+        Output of `_prepare_similarity`.
+    block_1 : numpy.array
+        Block of rows of the first modality, from `_similarity_rows`.
+    rows : slice
+        Rows of the first modality.
+    cols : slice
+        Rows of the second modality.
+    corr_type : str or callable, optional
+        Which similarity measure to use, by default "Pearson"
+    dtype : numpy.dtype, optional
+        Precision used for the computation, by default np.double
+
+    Returns
+    -------
+    numpy.array
+        Returns the tile of the similarity matrix.
+    """
+    features_2 = prepared["features_2"]
+    if prepared["tile_function"] is not None:
+        return prepared["tile_function"](block_1, _dense_rows(features_2[cols]))
+
+    if corr_type == "Euclidean":
+        #Squared distances from the products, bounded at 0 for floating point errors
+        products = block_1 @ features_2[cols].T if prepared["use_sparse"]\
+            else block_1 @ _dense_rows(features_2[cols], dtype).T
+        products = products.toarray() if sparse.issparse(products) else products
+        return np.sqrt(np.maximum(prepared["norms_1"][rows, None] ** 2
+            + prepared["norms_2"][None, cols] ** 2 - 2 * products, 0))
+
+    if prepared["use_sparse"]:
+        tile = _sparse_pearson(block_1, features_2[cols], (prepared["means_1"][rows],
+            prepared["norms_1"][rows]), (prepared["means_2"][cols], prepared["norms_2"][cols]),
+            np.shape(features_2)[1], dtype)
+    elif prepared["masked"]:
+        tile = _masked_pearson(block_1, _dense_rows(features_2[cols]))
     else:
-        z1_norm = array_to_norm.copy()
+        tile = block_1 @ _zscore_rows(features_2[cols], prepared["means_2"][cols],
+            prepared["norms_2"][cols], dtype).T
 
-    return z1_norm
+    #Same as Scipy, we bound the correlations to [-1, 1] to remove floating point errors
+    tile = np.clip(tile, -1, 1)
+
+    return np.arccos(tile) if corr_type == "Geodesic" else tile
+
+def _mirror_upper(similar_matrix, block_size=1024):
+    """Internal function copying, in place, the upper triangle of a square similarity matrix
+    to its lower triangle. This is done by blocks so it also works on memory-maps.
+
+    Parameters
+    ----------
+    similar_matrix : numpy.array
+        Square similarity matrix.
+    block_size : int, optional
+        Number of rows copied at once, by default 1024
+
+    Returns
+    -------
+    numpy.array
+        Returns the (modified) similarity matrix.
+    """
+    for row in range(0, len(similar_matrix), block_size):
+        rows = slice(row, row + block_size)
+        #Blocks strictly below the diagonal are the transpose of blocks above the diagonal
+        for col in range(0, row, block_size):
+            cols = slice(col, col + block_size)
+            similar_matrix[rows, cols] = similar_matrix[cols, rows].T
+
+        #On the diagonal block, only the cells below the diagonal are replaced
+        block = np.array(similar_matrix[rows, rows])
+        lower = np.tril_indices(len(block), k=-1)
+        block[lower] = block.T[lower]
+        similar_matrix[rows, rows] = block
+
+    return similar_matrix
 
 class FingerprintMats:
     """Class object used to store information for the fingerprinting and to output
@@ -109,7 +1374,8 @@ class FingerprintMats:
     input data is folders with 1 matrix per subject.
     """
 
-    def __init__(self, id_ls, path_m1, path_m2):
+    def __init__(self, id_ls, path_m1, path_m2, cache_dir=None, as_sparse=False,
+    connectivity=None):
         """Creates a FingerprintMats object made up of a list of ids, and the path to the data.
 
         Parameters
@@ -120,21 +1386,59 @@ class FingerprintMats:
             Path (string) to the folder containing the participants
         path_m2 : _type_
             _description_
+        cache_dir : str, optional
+            Directory where a binary (`.npy`) copy of every imported matrix is stored. Later
+            runs reuse the copies instead of parsing the text files again. By default None
+            (no cache)
+        as_sparse : bool, optional
+            Whether to keep the matrices and the features as `scipy.sparse` matrices, which
+            saves memory and time for thresholded matrices where most edges are 0. Matrices
+            saved with `scipy.sparse.save_npz` are always kept sparse. By default False
+        connectivity : str, optional
+            If given, the files contain regional time series (time points x nodes) instead of
+            matrices, and the connectivity is computed during the import with this measure:
+            "correlation" or "partial correlation". Only the edges of the selected nodes are
+            kept. By default None (the files contain connectivity matrices)
         """
 
         self.id_ls = id_ls #Final list of IDs to fingerprint
         self.path_m1 = path_m1 #Location of the first set of matrices (first modality)
         self.path_m2 = path_m2 #Location of the second set of matrices (second modality)
+        self.cache_dir = cache_dir #Location of the binary copies of the matrices
+        self.as_sparse = as_sparse #Whether the matrices are kept sparse
+        self.connectivity = connectivity #Connectivity computed from time series (if any)
 
         #Empty variables to store further computation.
         self.sub_final = None
         self.final_m1 = None
         self.final_m2 = None
-
-    def fetch_matrix_file_names(self):
+        #Features, similarity matrix and parameters of the last fingerprinting (for updates)
+        self.features_m1 = None
+        self.features_m2 = None
+        self.similar_matrix = None
+        self.fp_params = None
+        #How the files and the IDs were matched, so `fingerprint_update` matches them the same way
+        self.selection_params = {"file_pattern": None, "recursive": False, "id_pattern": None}
+
+    def fetch_matrix_file_names(self, pattern=None, recursive=False):
         """Simple function importing the matrices as input for the fingerprinting computation.
-        Does not require any argument (will use the path variables from the FingerprintMats
-        objects).
+        Uses the path variables from the FingerprintMats objects. By default, only the files
+        directly in the folders are listed; nested layouts (e.g., `sub-*/ses-*`) can be searched
+        with `pattern` and `recursive` (see `iter_matrix_files`).
+
+        Parameters
+        ----------
+        pattern : str, optional
+            Glob pattern the files must match, relative to the folders of the modalities
+            (e.g., `sub-*/ses-*/*.txt`), by default None (all files)
+        recursive : bool, optional
+            Whether or not to also search the sub-folders, by default False
+
+        Returns
+        -------
+        list
+            Returns two lists of files (one per modality), relative to the folders of the
+            modalities.
 
         Raises
         ------
@@ -142,27 +1446,24 @@ class FingerprintMats:
             Checks whether the path exists and is able to import the file.
         """
 
-        files_m1 = []
-        files_m2 = []
         #First, find all the files in directories and store in a list
         try:
-            for filename in os.listdir(self.path_m1):
-                if os.path.isfile(f"{self.path_m1}/{filename}"):
-                    files_m1.append(filename)
-
-            for filename in os.listdir(self.path_m2):
-                if os.path.isfile(f"{self.path_m2}/{filename}"):
-                    files_m2.append(filename)
+            files_m1 = list(iter_matrix_files(self.path_m1, pattern=pattern, recursive=recursive))
+            files_m2 = list(iter_matrix_files(self.path_m2, pattern=pattern, recursive=recursive))
         except OSError:
             raise OSError("ERROR: Path given as input doesn't exist.")
 
+        self.selection_params.update({"file_pattern": pattern, "recursive": recursive})
+
         return files_m1, files_m2
 
-    def subject_selection(self, files_m1, files_m2, verbose=True):
+    def subject_selection(self, files_m1, files_m2, verbose=True, pattern=None):
         """Select participant files that are present in both modalities (i.e., intersection).
         The function assumes that the ID in the ID list will match in some way the file name
         in the folder (e.g., ID 6745 would match a matrix file named `6745.txt` or
-        `part6745_rest.txt` or `6745`, but it will not match `674.txt`).
+        `part6745_rest.txt` or `6745`). If an ID is part of another ID (e.g., `674` and `6745`),
+        the file `6745.txt` is matched by both IDs: such collisions are reported and the
+        function exits, unless a `pattern` is given to extract the IDs from the file names.
 
         Parameters
         ----------
@@ -173,6 +1474,10 @@ class FingerprintMats:
         verbose : bool, optional
             Whether or not we want an explicit description of participants included, 
             by default True
+        pattern : str, optional
+            Regular expression extracting the ID from the file names. Use a named group `id`
+            (e.g., `sub-(?P<id>\\d+)_ses`) or a single group. By default None (an ID matches
+            any file name containing it)
 
         Returns
         -------
@@ -184,6 +1489,9 @@ class FingerprintMats:
         ------
         SystemExit
             If no subject ID is matched to any files, exit.
+        SystemExit
+            If a file of a participant retained is matched by more than one ID, or a
+            participant retained is matched to more than one file, exit.
         SystemExit
             If files are duplicated after matching with subject list, exit.
         SystemExit
@@ -192,20 +1500,20 @@ class FingerprintMats:
         if verbose is True:
             print(f'We have {len(self.id_ls)} subjects in the list.')
 
-        #Figure out which participants we have files for
-        sub_1 = [subject for subject in self.id_ls
-            for filename in files_m1 if subject in filename]
-        sub_2 = [subject for subject in self.id_ls
-            for filename in files_m2 if subject in filename]
+        #Index which files belong to which participants
+        index_m1, collisions_m1 = _match_files(self.id_ls, files_m1, pattern=pattern)
+        index_m2, collisions_m2 = _match_files(self.id_ls, files_m2, pattern=pattern)
 
         #Figure out which participants intersect and sort them in order
-        sub_final = sorted(list(set(sub_1) & set(sub_2)))
+        sub_final = sorted(set(index_m1) & set(index_m2))
 
         #Figure out which files we have for the participants in both modalities
-        final_m1 = [filename for subject in sub_final
-            for filename in files_m1 if subject in filename]
-        final_m2 = [filename for subject in sub_final
-            for filename in files_m2 if subject in filename]
+        final_m1 = [filename for subject in sub_final for filename in index_m1[subject]]
+        final_m2 = [filename for subject in sub_final for filename in index_m2[subject]]
+
+        #Every retained ID must be attributed exactly one file in each modality
+        _check_matches(index_m1, collisions_m1, sub_final)
+        _check_matches(index_m2, collisions_m2, sub_final)
 
         #Check user input to make sure it is ok.
         if ((len(final_m1) == 0) | (len(final_m2) == 0)):
@@ -216,8 +1524,8 @@ class FingerprintMats:
             raise SystemExit("ERROR: Files of modality 2 are duplicated")
 
         if verbose is True:
-            print(f"We have in total {len(sub_1)} participants in modality 1 & {len(sub_2)} " +
-            "participants in modality 2.")
+            print(f"We have in total {len(index_m1)} participants in modality 1 & " +
+            f"{len(index_m2)} participants in modality 2.")
             print(f"A total of {len(sub_final)} have both modalities. Only these are used.")
             print(sub_final)
 
@@ -225,6 +1533,7 @@ class FingerprintMats:
         self.sub_final = sub_final
         self.final_m1 = final_m1
         self.final_m2 = final_m2
+        self.selection_params["id_pattern"] = pattern
 
         return sub_final, final_m1, final_m2
 
@@ -246,25 +1555,172 @@ class FingerprintMats:
             Returns a numpy array containing the matrix of interest
         """
         if mod == 1:
-            try:
-                matrix_file = np.loadtxt(f'{self.path_m1}/{self.final_m1[i]}', dtype=np.double)
-            except ValueError:
-                matrix_file = np.loadtxt(f'{self.path_m1}/{self.final_m1[i]}',
-                    delimiter=',', dtype=np.double)
+            matrix_file = _load_matrix(f'{self.path_m1}/{self.final_m1[i]}', self.cache_dir)
         elif mod == 2:
-            try:
-                matrix_file = np.loadtxt(f'{self.path_m2}/{self.final_m2[i]}', dtype=np.double)
-            except ValueError:
-                matrix_file = np.loadtxt(f'{self.path_m2}/{self.final_m2[i]}',
-                    delimiter=',', dtype=np.double)
+            matrix_file = _load_matrix(f'{self.path_m2}/{self.final_m2[i]}', self.cache_dir)
 
         return matrix_file
 
+    def _extract_features(self, mod, node_sets, norm=True, verbose=True, n_jobs=1,
+    backend="threads", dtype=np.double, memmap_paths=None):
+        """Internal function importing, slicing and normalizing the matrix of every participant
+        of a modality. Each file is read only once, so the cost of the file import grows
+        linearly with the number of participants, whatever the number of sets of nodes.
+        The files can be imported by a pool of workers; the results are always stored in the
+        order of `sub_final`.
+
+        Parameters
+        ----------
+        mod : int
+            Integer (1 or 2) indicating which modality to extract the features from
+        node_sets : list of tuple
+            List of `(nodes_index_within, nodes_index_between)` pairs. `nodes_index_between` is
+            None for within-network fingerprinting.
+        norm : bool, optional
+            Whether or not to Fisher normalize the data, by default True
+        verbose : bool, optional
+            Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices. Use -1 to use all the CPUs, by default 1
+        backend : str, optional
+            Type of workers to use, either "threads" or "processes", by default "threads"
+        dtype : numpy.dtype, optional
+            Precision used to store the features, by default np.double
+        memmap_paths : list of str, optional
+            Paths to the `.npy` files where the features of each set of nodes are stored
+            instead of the memory, by default None
+
+        Returns
+        -------
+        list of numpy.array
+            Returns, for every set of nodes, a 2D array of shape (participants, edges) where
+            each row is the flattened and normalized connectivity of a participant, in the
+            order of `sub_final`. If the matrices are sparse, returns `scipy.sparse.csr_matrix`
+            arrays instead.
+
+        Raises
+        ------
+        SystemExit
+            If the backend is not supported.
+        SystemExit
+            If sparse matrices are stored in memory-maps.
+        """
+        if mod == 1:
+            matrix_paths = [f'{self.path_m1}/{filename}' for filename in self.final_m1]
+        elif mod == 2:
+            matrix_paths = [f'{self.path_m2}/{filename}' for filename in self.final_m2]
+
+        if memmap_paths is None:
+            memmap_paths = [None] * len(node_sets)
+
+        n_subjects = len(self.sub_final)
+        #The format is detected once per modality, from the first file
+        file_format = _detect_format(matrix_paths[0]) if len(matrix_paths) != 0 else None
+        #The cells kept are the same for every participant, so they are only computed once
+        args = (node_sets, norm, self.cache_dir, self.as_sparse, self.connectivity, file_format,
+            _compile_edge_plan(node_sets))
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+
+        if n_jobs == 1:
+            flat_data = (_matrix_features(matrix_path, *args) for matrix_path in matrix_paths)
+            executor = None
+        elif backend == "threads":
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+        elif backend == "processes":
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+        else:
+            raise SystemExit(f"ERROR: Backend {backend} is not supported. Use 'threads' or \
+            'processes'.")
+
+        if executor is not None:
+            #`map` returns the results in the order of the input, whichever worker finishes first.
+            # The chunks reduce the communication overhead of processes (ignored by threads).
+            flat_data = executor.map(_matrix_features, matrix_paths,
+                *[[arg] * n_subjects for arg in args], chunksize=max(1, n_subjects // (4 * n_jobs)))
+
+        features = None
+        try:
+            for i, z_sets in enumerate(flat_data):
+                if verbose is True:
+                    print(f"Importing modality {mod} for participant {i + 1}: {self.sub_final[i]}")
+
+                #The number of edges is only known once the first matrix is sliced
+                if features is None and sparse.issparse(z_sets[0]):
+                    if any(memmap_path is not None for memmap_path in memmap_paths):
+                        raise SystemExit("ERROR: Sparse matrices cannot be stored in \
+                        memory-maps. Use memmap_dir=None.")
+                    #Sparse rows are stacked once all the participants are imported
+                    features = [[] for _ in z_sets]
+                elif features is None:
+                    features = [_allocate_array((n_subjects, len(z_data)), dtype, memmap_path)
+                        for z_data, memmap_path in zip(z_sets, memmap_paths)]
+                for features_set, z_data in zip(features, z_sets):
+                    if isinstance(features_set, list):
+                        features_set.append(sparse.csr_matrix(z_data, dtype=dtype))
+                    else:
+                        features_set[i] = _dense_rows(z_data, dtype).ravel()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return [sparse.vstack(features_set, format='csr') if isinstance(features_set, list)
+            else features_set for features_set in features]
+
+    def _fingerprint_features(self, features_m1, features_m2, corr_type="Pearson",
+    block_size=1024, dtype=np.double, memmap_path=None, symmetric=True):
+        """Internal function computing the similarity matrix from the feature arrays of the
+        two modalities. In the symmetric mode, only the upper triangle is computed and the lower
+        triangle is filled with the upper triangle for symmetry.
+
+        Parameters
+        ----------
+        features_m1 : numpy.array
+            Features of the first modality, from `_extract_features`.
+        features_m2 : numpy.array
+            Features of the second modality, from `_extract_features`.
+        corr_type : str, optional
+            Which correlation measure to use, by default "Pearson"
+        block_size : int, optional
+            Number of participants per block of the similarity computation, by default 1024
+        dtype : numpy.dtype, optional
+            Precision of the similarity matrix, by default np.double
+        memmap_path : str, optional
+            Path to a `.npy` file where the similarity matrix is stored, by default None
+        symmetric : bool, optional
+            Whether to mirror the upper triangle (True) or keep both directions (False), by
+            default True
+
+        Returns
+        -------
+        numpy.array
+            Returns the similarity matrix.
+        """
+        #Correlate the array of every participant in modality 1 to the array of every
+        # participant in modality 2, tile by tile
+        similar_matrix = _allocate_array((np.shape(features_m1)[0], np.shape(features_m2)[0]),
+            dtype, memmap_path)
+        _similarity_matrix(features_m1, features_m2, corr_type=corr_type,
+            block_size=block_size, dtype=dtype, out=similar_matrix, symmetric=symmetric)
+
+        if memmap_path is not None:
+            similar_matrix.flush()
+
+        return similar_matrix
+
     def fingerprint_mats(self, nodes_index_within, nodes_index_between=None,
-    norm=True, corr_type="Pearson", verbose=True):
+    norm=True, corr_type="Pearson", verbose=True, n_jobs=1, backend="threads",
+    block_size=1024, memory_limit=None, dtype=np.double, memmap_dir=None, symmetric=True,
+    greater_is_better=None):
         """Core fingerprinting function. Takes every pair of matrices from modality 1 and 2
         and applies the fingerprint methodology between them.
 
+        By default, the similarity matrix is symmetric: only the correlations of modality 1 of
+        a participant with modality 2 of the participants coming after them are computed
+        (upper triangle) and mirrored. With `symmetric=False`, both directions are computed
+        and kept (row `i`, column `j` is modality 1 of `i` with modality 2 of `j`).
+
         Parameters
         ----------
         nodes_index_within : list of int
@@ -275,11 +1731,41 @@ class FingerprintMats:
             when wanting to do between-network fingerprinting, by default None
         norm : bool, optional
             Whether or not to Fisher normalize the data before fingerprinting, by default True
-        corr_type : str, optional
-            Which correlation measure to use for generating fingerprinting, by default "Pearson".
-            Options include: ["Pearson"]
+        corr_type : str or callable, optional
+            Which similarity measure to use for generating fingerprinting, by default "Pearson".
+            Options include: ["Pearson", "Spearman", "Kendall", "Cosine"] (similarities) and
+            ["Euclidean", "Manhattan", "Geodesic"] (distances), or a callable taking two blocks
+            of features (participants x edges) and returning the array of similarities between
+            their rows
         verbose : bool, optional
             Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices. Use -1 to use all the CPUs, by default 1
+        backend : str, optional
+            Type of workers importing the matrices, either "threads" or "processes", by
+            default "threads"
+        block_size : int, optional
+            Number of participants per block when computing the similarity matrix tile by tile,
+            by default 1024
+        memory_limit : int, optional
+            Memory budget (in bytes) for a tile of the similarity computation. If given, it
+            overrides `block_size`, by default None
+        dtype : numpy.dtype, optional
+            Precision of the features and of the similarity matrix. Use np.float32 to halve the
+            memory needed, by default np.double
+        memmap_dir : str, optional
+            Directory where the features (`features_m1_*.npy`, `features_m2_*.npy`) and the
+            similarity matrix (`similarity_matrix_*.npy`) are stored as memory-maps. Every run
+            writes new files, so earlier results in the same directory are kept. The similarity
+            matrix is then returned as a memory-map and the cohort size is only limited by the
+            disk. By default None (everything is kept in memory)
+        symmetric : bool, optional
+            Whether to compute the upper triangle only and mirror it (True) or to keep the
+            asymmetric matrix (False), by default True
+        greater_is_better : bool, optional
+            Whether the best match is the highest value or the lowest. It is stored and used by
+            `fp_metrics_calc`. By default None (True for the correlations and a callable, False
+            for the distances)
 
         Returns
         -------
@@ -289,52 +1775,511 @@ class FingerprintMats:
         Raises
         ------
         SystemExit
-            If the FingerprintMats step was skipped, we fail this function.
+            If the FingerprintMats step was skipped, we fail this function.
+        """
+        if self.sub_final is None:
+            raise SystemExit("ERROR: Did you instantiate the FingerprintMats class and/or \
+            run the fetch_matrix_file_names and subject_selection functions first?")
+
+        #Every matrix is imported, sliced and normalized once per modality. The similarity
+        # is then computed between the rows of the two feature arrays.
+        memmap_paths = {"m1": None, "m2": None, "similarity": None}
+        if memmap_dir is not None:
+            memmap_paths = {"m1": [_unique_memmap_path(memmap_dir, "features_m1")],
+                "m2": [_unique_memmap_path(memmap_dir, "features_m2")],
+                "similarity": _unique_memmap_path(memmap_dir, "similarity_matrix")}
+
+        node_sets = [(nodes_index_within, nodes_index_between)]
+        features_m1 = self._extract_features(1, node_sets, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype, memmap_paths=memmap_paths["m1"])[0]
+        features_m2 = self._extract_features(2, node_sets, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype, memmap_paths=memmap_paths["m2"])[0]
+
+        if memory_limit is not None:
+            block_size = _block_size_from_memory(features_m1.shape[1],
+                np.dtype(dtype).itemsize, memory_limit)
+
+        similar_matrix = self._fingerprint_features(features_m1, features_m2,
+            corr_type=corr_type, block_size=block_size, dtype=dtype,
+            memmap_path=memmap_paths["similarity"], symmetric=symmetric)
+
+        #Keep what is needed to add participants later without recomputing everything
+        self.features_m1 = features_m1
+        self.features_m2 = features_m2
+        self.similar_matrix = similar_matrix
+        self.fp_params = {"nodes_index_within": np.asarray(nodes_index_within, dtype=int).tolist(),
+            "nodes_index_between": np.asarray(nodes_index_between, dtype=int).tolist()
+                if nodes_index_between is not None and len(nodes_index_between) != 0 else None,
+            "norm": norm, "corr_type": corr_type, "symmetric": symmetric,
+            "greater_is_better": _greater_is_better(corr_type, greater_is_better),
+            **self.selection_params}
+
+        return similar_matrix
+
+    def fingerprint_mats_batch(self, node_sets, norm=True, corr_type="Pearson", verbose=True,
+    n_jobs=1, backend="threads", block_size=1024, dtype=np.double, symmetric=True,
+    greater_is_better=None):
+        """Fingerprinting function running many sets of nodes in one pass (e.g., within-network
+        fingerprinting of every network and between-network fingerprinting of every pair of
+        networks). The matrix of each participant is imported once and sliced for every set of
+        nodes, instead of importing every matrix once per set of nodes.
+
+        Parameters
+        ----------
+        node_sets : dict
+            Dictionary where the keys are the names of the sets of nodes and the values are either
+            a list of nodes (within-network) or a tuple of two lists of nodes (between-network,
+            in the order `(nodes_index_within, nodes_index_between)`).
+        norm : bool, optional
+            Whether or not to Fisher normalize the data before fingerprinting, by default True
+        corr_type : str or callable, optional
+            Which similarity measure to use for generating fingerprinting, by default "Pearson"
+            (see `fingerprint_mats`)
+        verbose : bool, optional
+            Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices. Use -1 to use all the CPUs, by default 1
+        backend : str, optional
+            Type of workers importing the matrices, either "threads" or "processes", by
+            default "threads"
+        block_size : int, optional
+            Number of participants per block when computing the similarity matrices, by
+            default 1024
+        dtype : numpy.dtype, optional
+            Precision of the features and of the similarity matrices, by default np.double
+        symmetric : bool, optional
+            Whether to compute the upper triangle only and mirror it (True) or to keep the
+            asymmetric matrices (False), by default True
+        greater_is_better : bool, optional
+            Whether the best match is the highest value or the lowest, by default None (True
+            for the correlations, False for the distances, see `fingerprint_mats`)
+
+        Returns
+        -------
+        dict, dict
+            Returns two dictionaries with the same keys as `node_sets`: one with the similarity
+            matrices and one with the fingerprint metrics (see `fp_metrics_calc`, the name of
+            the set of nodes is used as `name`).
+
+        Raises
+        ------
+        SystemExit
+            If the FingerprintMats step was skipped, we fail this function.
+        SystemExit
+            If a set of nodes is neither a list of nodes nor a pair of lists of nodes.
+        """
+        if self.sub_final is None:
+            raise SystemExit("ERROR: Did you instantiate the FingerprintMats class and/or \
+            run the fetch_matrix_file_names and subject_selection functions first?")
+
+        names = list(node_sets.keys())
+        nodes = [_parse_node_set(name, node_sets[name]) for name in names]
+
+        features_m1 = self._extract_features(1, nodes, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype)
+        features_m2 = self._extract_features(2, nodes, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype)
+
+        similar_matrices = {}
+        coef_data = {}
+        for name, features_set_m1, features_set_m2 in zip(names, features_m1, features_m2):
+            if verbose is True:
+                print(f"Fingerprinting set of nodes: {name}")
+            similar_matrices[name] = self._fingerprint_features(features_set_m1,
+                features_set_m2, corr_type=corr_type, block_size=block_size, dtype=dtype,
+                symmetric=symmetric)
+            coef_data[name] = self.fp_metrics_calc(similar_matrices[name], name,
+                greater_is_better=_greater_is_better(corr_type, greater_is_better))
+
+        return similar_matrices, coef_data
+
+    def fingerprint_update(self, id_ls_new, name, files_m1=None, files_m2=None, verbose=True,
+    n_jobs=1, backend="threads", block_size=1024, pattern=None, recursive=None, id_pattern=None):
+        """Adds participants to a fingerprinting analysis that was already computed (with
+        `fingerprint_mats` or imported with `fp_state_import`). Only the matrices of the new
+        participants are imported and only the similarity between the new participants and
+        everyone else is computed. The result is the same as running `fingerprint_mats` on
+        the whole cohort.
+
+        Parameters
+        ----------
+        id_ls_new : list
+            List of the participants to add. Participants already fingerprinted are skipped.
+        name : str
+            String to add to the variables of the fingerprint metrics (see `fp_metrics_calc`).
+        files_m1 : list of str, optional
+            List of files for the first modality, by default None (uses
+            `fetch_matrix_file_names`)
+        files_m2 : list of str, optional
+            List of files for the second modality, by default None (uses
+            `fetch_matrix_file_names`)
+        verbose : bool, optional
+            Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices. Use -1 to use all the CPUs, by default 1
+        backend : str, optional
+            Type of workers importing the matrices, either "threads" or "processes", by
+            default "threads"
+        block_size : int, optional
+            Number of participants per block of the similarity computation, by default 1024
+        pattern : str, optional
+            Glob pattern of the files (see `fetch_matrix_file_names`), by default None (the one
+            used to select the cohort)
+        recursive : bool, optional
+            Whether or not to also search the sub-folders (see `fetch_matrix_file_names`), by
+            default None (as when the cohort was selected)
+        id_pattern : str, optional
+            Regular expression extracting the ID from the file names (`pattern` of
+            `subject_selection`), by default None (the one used to select the cohort)
+
+        Returns
+        -------
+        numpy.array, pandas.DataFrame
+            Returns the updated similarity matrix and the updated fingerprint metrics. If all
+            the participants are already fingerprinted, they are returned unchanged.
+
+        Raises
+        ------
+        SystemExit
+            If no fingerprinting was computed before, we fail this function.
+        """
+        if self.features_m1 is None:
+            raise SystemExit("ERROR: Run fingerprint_mats or fp_state_import before adding \
+            participants.")
+        if self.similar_matrix is None:
+            raise SystemExit("ERROR: The last fingerprinting kept no \
+            similarity matrix to update (fingerprint_stream or fingerprint_approx). Run \
+            fingerprint_mats first.")
+
+        id_ls_new = [subject for subject in id_ls_new if subject not in self.sub_final]
+        if len(id_ls_new) == 0:
+            return self.similar_matrix, self.fp_metrics_calc(self.similar_matrix, name)
+
+        #The files and IDs are matched as when the cohort was selected, unless specified
+        if pattern is None:
+            pattern = self.fp_params.get("file_pattern")
+        if recursive is None:
+            recursive = self.fp_params.get("recursive", False)
+        if id_pattern is None:
+            id_pattern = self.fp_params.get("id_pattern")
+
+        #Select and import the new participants only
+        fp_new = FingerprintMats(id_ls=id_ls_new, path_m1=self.path_m1, path_m2=self.path_m2,
+            cache_dir=self.cache_dir, as_sparse=self.as_sparse, connectivity=self.connectivity)
+        if files_m1 is None or files_m2 is None:
+            files_m1, files_m2 = fp_new.fetch_matrix_file_names(pattern=pattern,
+                recursive=recursive)
+        fp_new.subject_selection(files_m1, files_m2, verbose=verbose, pattern=id_pattern)
+
+        node_sets = [(self.fp_params["nodes_index_within"], self.fp_params["nodes_index_between"])]
+        new_m1 = fp_new._extract_features(1, node_sets, norm=self.fp_params["norm"],
+            verbose=verbose, n_jobs=n_jobs, backend=backend,
+            dtype=self.features_m1.dtype)[0]
+        new_m2 = fp_new._extract_features(2, node_sets, norm=self.fp_params["norm"],
+            verbose=verbose, n_jobs=n_jobs, backend=backend,
+            dtype=self.features_m2.dtype)[0]
+
+        #Only the rows and columns of the new participants are computed
+        kwargs = {"corr_type": self.fp_params["corr_type"], "block_size": block_size,
+            "dtype": self.similar_matrix.dtype}
+        old_new = _similarity_matrix(self.features_m1, new_m2, **kwargs)
+        new_old = _similarity_matrix(new_m1, self.features_m2, **kwargs)
+        new_new = _similarity_matrix(new_m1, new_m2, **kwargs)
+
+        #Participants are kept sorted, so the new participants are interleaved with the others
+        n_old = len(self.sub_final)
+        sub_all = list(self.sub_final) + fp_new.sub_final
+        order = np.argsort(sub_all, kind='stable')
+        position = np.empty(len(order), dtype=int)
+        position[order] = np.arange(len(order))
+        pos_old = position[:n_old]
+        pos_new = position[n_old:]
+
+        #In the symmetric mode, as in `fingerprint_mats`, the similarity between two participants
+        # is the one computed with the participant coming first (upper triangle) in modality 1
+        if self.fp_params.get("symmetric", True) is True:
+            new_first = pos_new[:, None] < pos_old[None, :]
+            new_old = np.where(new_first, new_old, old_new.T)
+            old_new = new_old.T
+            new_new = np.where(pos_new[:, None] <= pos_new[None, :], new_new, new_new.T)
+
+        similar_matrix = np.empty((len(sub_all), len(sub_all)), dtype=self.similar_matrix.dtype)
+        similar_matrix[np.ix_(pos_old, pos_old)] = self.similar_matrix
+        similar_matrix[np.ix_(pos_new, pos_old)] = new_old
+        similar_matrix[np.ix_(pos_old, pos_new)] = old_new
+        similar_matrix[np.ix_(pos_new, pos_new)] = new_new
+
+        #Store the updated cohort
+        self.id_ls = list(self.id_ls) + [subject for subject in id_ls_new
+            if subject not in self.id_ls]
+        self.sub_final = [sub_all[i] for i in order]
+        self.final_m1 = [(list(self.final_m1) + fp_new.final_m1)[i] for i in order]
+        self.final_m2 = [(list(self.final_m2) + fp_new.final_m2)[i] for i in order]
+        self.features_m1 = _stack_rows(self.features_m1, new_m1)[order]
+        self.features_m2 = _stack_rows(self.features_m2, new_m2)[order]
+        self.similar_matrix = similar_matrix
+
+        return similar_matrix, self.fp_metrics_calc(similar_matrix, name)
+
+    def fp_edgewise_calc(self, chunk_size=10000):
+        """Method computing, for every edge of the last fingerprinting, its test-retest
+        reliability (ICC) and its contribution to the differential identifiability. See
+        `edgewise_identifiability`.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            Number of edges processed at once, by default 10000
+
+        Returns
+        -------
+        pandas.DataFrame
+            Returns a dataframe with one row per edge (indexed by the pair of nodes) and the
+            columns `icc` and `di_contribution`.
+
+        Raises
+        ------
+        SystemExit
+            If no fingerprinting was computed before, we fail this function.
+        """
+        if self.features_m1 is None:
+            raise SystemExit("ERROR: Run fingerprint_mats before computing the edgewise \
+            identifiability.")
+
+        labels = edge_labels(self.fp_params["nodes_index_within"],
+            self.fp_params["nodes_index_between"])
+
+        return edgewise_identifiability(self.features_m1, self.features_m2, labels=labels,
+            chunk_size=chunk_size)
+
+    def fingerprint_approx(self, nodes_index_within, nodes_index_between=None, norm=True,
+    top_k=1, verbose=True, n_jobs=1, backend="threads", dtype=np.double, memmap_dir=None,
+    **kwargs):
+        """Identification of the participants for cohorts too large for the similarity matrix.
+        The features are imported as in `fingerprint_mats`, then the best matches are searched
+        with `approximate_identification`, without computing the full similarity matrix.
+
+        Parameters
+        ----------
+        nodes_index_within : list of int
+            List of nodes to include in the fingerprinting (see `fingerprint_mats`).
+        nodes_index_between : list of int, optional
+            List of nodes to use as columns for between-network fingerprinting, by default None
+        norm : bool, optional
+            Whether or not to Fisher normalize the data before fingerprinting, by default True
+        top_k : int, optional
+            Number of best matches returned for every participant, by default 1
+        verbose : bool, optional
+            Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices. Use -1 to use all the CPUs, by default 1
+        backend : str, optional
+            Type of workers importing the matrices, either "threads" or "processes", by
+            default "threads"
+        dtype : numpy.dtype, optional
+            Precision of the features, by default np.double
+        memmap_dir : str, optional
+            Directory where the features are stored as memory-maps (new files for every run),
+            by default None
+        **kwargs
+            Other arguments of `approximate_identification` (e.g., `n_projections`,
+            `n_candidates`, `n_check`, `seed`).
+
+        Returns
+        -------
+        pandas.DataFrame, float
+            Returns the identification of every participant (indexed by ID, the best matches
+            given as IDs) and the recall of the approximate search on a subsample.
+
+        Raises
+        ------
+        SystemExit
+            If the FingerprintMats step was skipped, we fail this function.
+        """
+        if self.sub_final is None:
+            raise SystemExit("ERROR: Did you instantiate the FingerprintMats class and/or \
+            run the fetch_matrix_file_names and subject_selection functions first?")
+
+        node_sets = [(nodes_index_within, nodes_index_between)]
+        memmap_paths = {"m1": None, "m2": None}
+        if memmap_dir is not None:
+            memmap_paths = {"m1": [_unique_memmap_path(memmap_dir, "features_m1")],
+                "m2": [_unique_memmap_path(memmap_dir, "features_m2")]}
+        self.features_m1 = self._extract_features(1, node_sets, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype, memmap_paths=memmap_paths["m1"])[0]
+        self.features_m2 = self._extract_features(2, node_sets, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype, memmap_paths=memmap_paths["m2"])[0]
+        #The state matches the new features, and no similarity matrix is kept
+        self.similar_matrix = None
+        self.fp_params = {"nodes_index_within": np.asarray(nodes_index_within, dtype=int).tolist(),
+            "nodes_index_between": np.asarray(nodes_index_between, dtype=int).tolist()
+                if nodes_index_between is not None and len(nodes_index_between) != 0 else None,
+            "norm": norm, "corr_type": "Pearson", "symmetric": False, "greater_is_better": True,
+            **self.selection_params}
+
+        coef_data, recall = approximate_identification(self.features_m1, self.features_m2,
+            top_k=top_k, **kwargs)
+        coef_data.index = pd.Index(self.sub_final, name="ID")
+        for j in range(top_k):
+            coef_data[f"match_{j + 1}"] = np.asarray(self.sub_final)[coef_data[f"match_{j + 1}"]]
+
+        return coef_data, recall
+
+    def fingerprint_stream(self, name, nodes_index_within, nodes_index_between=None, norm=True,
+    corr_type="Pearson", top_k=None, keep_top=None, verbose=True, n_jobs=1, backend="threads",
+    block_size=1024, dtype=np.double, memmap_dir=None, symmetric=True, greater_is_better=None):
+        """Fingerprinting function computing the fingerprint metrics directly, without storing
+        the similarity matrix. The features are imported as in `fingerprint_mats`, then the
+        similarity matrix is computed by tiles of `block_size` x `block_size` participants and
+        every tile is reduced (diagonal, sums of the rows, best match and rank of the correct
+        match) before the next one is computed. The memory used is then linear in the number of
+        participants, instead of quadratic. The metrics are the same as `fp_metrics_calc` on the
+        output of `fingerprint_mats` with the same parameters.
+
+        Parameters
+        ----------
+        name : str
+            String to add to the variables (see `fp_metrics_calc`).
+        nodes_index_within : list of int
+            List of nodes to include in the fingerprinting (see `fingerprint_mats`).
+        nodes_index_between : list of int, optional
+            List of nodes to use as columns for between-network fingerprinting, by default None
+        norm : bool, optional
+            Whether or not to Fisher normalize the data before fingerprinting, by default True
+        corr_type : str or callable, optional
+            Which similarity measure to use for generating fingerprinting, by default "Pearson"
+            (see `fingerprint_mats`)
+        top_k : int or list of int, optional
+            If given, also computes the rank-based metrics (see `fp_metrics_calc`), by default None
+        keep_top : int, optional
+            If given, also returns the `keep_top` best matches of every participant, by
+            default None
+        verbose : bool, optional
+            Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices. Use -1 to use all the CPUs, by default 1
+        backend : str, optional
+            Type of workers importing the matrices, either "threads" or "processes", by
+            default "threads"
+        block_size : int, optional
+            Number of participants per tile of the similarity matrix, by default 1024
+        dtype : numpy.dtype, optional
+            Precision of the features and of the similarity, by default np.double
+        memmap_dir : str, optional
+            Directory where the features are stored as memory-maps (new files for every run),
+            by default None
+        symmetric : bool, optional
+            Whether the similarity matrix is made symmetric (see `fingerprint_mats`), by
+            default True
+        greater_is_better : bool, optional
+            Whether the best match is the highest value (similarity) or the lowest (distance),
+            by default None (taken from the similarity measure)
+
+        Returns
+        -------
+        pandas.DataFrame
+            Returns the fingerprint metrics, as `fp_metrics_calc`. If `keep_top` is given, also
+            returns a pandas.DataFrame with the best matches (`match_j`, as IDs) and their
+            similarity (`similarity_j`) for every participant.
+
+        Raises
+        ------
+        SystemExit
+            If the FingerprintMats step was skipped, we fail this function.
+        SystemExit
+            If some participants have missing values.
+        """
+        if self.sub_final is None:
+            raise SystemExit("ERROR: Did you instantiate the FingerprintMats class and/or \
+            run the fetch_matrix_file_names and subject_selection functions first?")
+
+        node_sets = [(nodes_index_within, nodes_index_between)]
+        memmap_paths = {"m1": None, "m2": None}
+        if memmap_dir is not None:
+            memmap_paths = {"m1": [_unique_memmap_path(memmap_dir, "features_m1")],
+                "m2": [_unique_memmap_path(memmap_dir, "features_m2")]}
+        self.features_m1 = self._extract_features(1, node_sets, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype, memmap_paths=memmap_paths["m1"])[0]
+        self.features_m2 = self._extract_features(2, node_sets, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype, memmap_paths=memmap_paths["m2"])[0]
+        #No similarity matrix is kept, so `fingerprint_update` can't be used after this
+        self.similar_matrix = None
+        greater_is_better = _greater_is_better(corr_type, greater_is_better)
+        self.fp_params = {"nodes_index_within": np.asarray(nodes_index_within, dtype=int).tolist(),
+            "nodes_index_between": np.asarray(nodes_index_between, dtype=int).tolist()
+                if nodes_index_between is not None and len(nodes_index_between) != 0 else None,
+            "norm": norm, "corr_type": corr_type, "symmetric": symmetric,
+            "greater_is_better": greater_is_better, **self.selection_params}
+
+        reductions = _stream_reductions(self.features_m1, self.features_m2, corr_type=corr_type,
+            block_size=block_size, dtype=dtype, symmetric=symmetric,
+            greater_is_better=greater_is_better, keep_top=keep_top)
+
+        si_coef = reductions["diag"]
+        oi_coef = (reductions["row_sums"] - si_coef) / (len(si_coef) - 1)
+        fia_coef = (reductions["best"] == np.arange(len(si_coef))).astype(float)
+        if greater_is_better is True:
+            diff_identif_coef = _identif_calculator(si_coef, oi_coef)
+        else:
+            diff_identif_coef = _identif_calculator(oi_coef, si_coef)
+
+        coef_data = pd.DataFrame(data={
+            'ID':self.sub_final,
+            f"si_{name}":si_coef,
+            f"oi_{name}":oi_coef,
+            f"fia_{name}":fia_coef,
+            f"di_{name}":diff_identif_coef})\
+                .set_index('ID')
+
+        if top_k is not None:
+            for col, values in _rank_metrics(None, name, top_k,
+                rank=reductions["rank"]).items():
+                coef_data[col] = values
+
+        if coef_data[f"si_{name}"].isnull().sum() != 0:
+            raise SystemExit("ERROR: Some participants have missing values from final dataframe")
+
+        if keep_top is None:
+            return coef_data
+
+        sub_final = np.asarray(self.sub_final)
+        top_data = pd.DataFrame(index=pd.Index(self.sub_final, name="ID"))
+        for j in range(reductions["top_index"].shape[1]):
+            top_data[f"match_{j + 1}"] = sub_final[reductions["top_index"][:, j]]
+            top_data[f"similarity_{j + 1}"] = reductions["top_values"][:, j]
+
+        return coef_data, top_data
+
+    def fp_pca_calc(self, n_components=None, seed=None):
+        """Method optimizing the differential identifiability of the last fingerprinting with
+        a PCA reconstruction of the features. See `pca_identifiability`.
+
+        Parameters
+        ----------
+        n_components : int, optional
+            Maximum number of components, by default None (all the components)
+        seed : int, optional
+            Seed of the randomized SVD, for reproducibility, by default None
+
+        Returns
+        -------
+        pandas.Series, numpy.array
+            Returns the average differential identifiability for every number of components
+            and the similarity matrix of the best reconstruction.
+
+        Raises
+        ------
+        SystemExit
+            If no fingerprinting was computed before, we fail this function.
         """
-        if self.sub_final is None:
-            raise SystemExit("ERROR: Did you instantiate the FingerprintMats class and/or \
-            run the fetch_matrix_file_names and subject_selection functions first?")
-
-        similar_matrix = np.empty((len(self.sub_final), len(self.sub_final)))
-
-        #For every participant, we need to correlate to every other participant.
-        # We do this using a nested loop
-        for i, sub in enumerate(self.sub_final):
-            if verbose is True:
-                print(f"Working on participant {i + 1}: {sub}")
-
-            #Imports the matrix for participant i (depending of where we are in loop)
-            matrix_file_m1 = self._import_matrix(1, i)
-            #Slice and return the flat array of values to correlate
-            #Removes the lower triangle and diagonal if using within-network nodes as it will be
-            # symetric and the diagonal will be "1"
-            r1_flat = _slice_matrix(matrix_file_m1, nodes_index_within, nodes_index_between)
-            #If necessary, we normalize the data using Fisher's transformation
-            z1_data = _norm_data(r1_flat, norm=norm)
-
-            #For every participant "i", repeat the operations for participant "j" 
-            # (i.e., every participant) included
-            for j in range(0, len(self.sub_final)):
-                matrix_file_m2 = self._import_matrix(2, j)
-                r2_flat = _slice_matrix(matrix_file_m2, nodes_index_within, nodes_index_between)
-                z2_data = _norm_data(r2_flat, norm=norm)
-
-                #In case of missing value because of the normalization in "i" or "j", 
-                # we remove missing cells, otherwise Scipy will throw an error
-                missing_removed = ~np.logical_or(np.isnan(z1_data), np.isnan(z2_data))
-                z1_clean = np.compress(missing_removed, z1_data)
-                z2_clean = np.compress(missing_removed, z2_data)
-
-                #Correlate the array from the first subject to the array of the second subject
-                if corr_type == "Pearson":
-                    similar_matrix[i,j] = stats.pearsonr(z1_clean, z2_clean)[0] #Extract just the correlation
-
-        #Fill lower triangle of the matrix for symmetry
-        similar_matrix = np.triu(similar_matrix, k=0) + np.triu(similar_matrix, k=1).T
+        if self.features_m1 is None:
+            raise SystemExit("ERROR: Run fingerprint_mats before optimizing the \
+            identifiability.")
 
-        return similar_matrix
+        return pca_identifiability(self.features_m1, self.features_m2,
+            n_components=n_components, seed=seed)
 
-    def _fia_calculator(self, similar_matrix):
+    def _fia_calculator(self, similar_matrix, greater_is_better=True):
         """Internal function computing the fingerprint identification accuracy,
         (number of correct identifications).
 
@@ -342,6 +2287,9 @@ class FingerprintMats:
         -------
         similar_matrix : numpy.array
             Similarity matrix from `fingerprint_mats` function
+        greater_is_better : bool, optional
+            Whether the best match is the highest value (similarity) or the lowest (distance),
+            by default True
 
         Returns
         -------
@@ -350,17 +2298,7 @@ class FingerprintMats:
             within the cohort and a 0 indicates incorrect identification.
         """
 
-        fia_coef = np.empty(shape=len(self.sub_final))
-
-        #For every row in the similarity matrix, if the maximum is achieved at the diagonal,
-        # attribute a 1, otherwise a 0.
-        for i in range(0, len(self.sub_final)):
-            if np.argmax(similar_matrix[i, :]) == i:
-                fia_coef[i] = 1
-            else:
-                fia_coef[i] = 0
-
-        return fia_coef
+        return _fia_calculator(similar_matrix, greater_is_better=greater_is_better)
 
     def _si_calculator(self, similar_matrix):
         """Internal function computing the self-identifiability (within-individual correlation).
@@ -395,10 +2333,8 @@ class FingerprintMats:
         numpy.array
             Returns an array containing the others-identifiability.
         """
-        oi_coef = (similar_matrix.sum(1)-np.diag(similar_matrix))\
-        /(similar_matrix.shape[1]-1)
 
-        return oi_coef
+        return _oi_calculator(similar_matrix)
 
     def _identif_calculator(self, si_coef, oi_coef):
         """Internal function computing the differential identifiability metric 
@@ -422,7 +2358,8 @@ class FingerprintMats:
 
         return diff_ident
 
-    def fp_metrics_calc(self, similar_matrix, name):
+    def fp_metrics_calc(self, similar_matrix, name, top_k=None, n_boot=None, ci=0.95,
+    seed=None, greater_is_better=None):
         """Method computing the different fingerprint metrics and stores them in a dataframe
         for export. Each metric is computed and stored in a numpy.array which are then used
         to populate the dataframe.
@@ -434,18 +2371,42 @@ class FingerprintMats:
         name : str
             String to add to the variables. This is so the user can differentiate the different
             runs of the fingerprinting if multiple are used.
+        top_k : int or list of int, optional
+            If given, also computes the rank of the correct match (`rank`), its percentile rank
+            (`prank`, 1 is best) and whether the correct match is within the k best matches
+            (`topk`, for every k given), by default None
+        n_boot : int, optional
+            If given, also computes bootstrap confidence intervals of the group-level metrics
+            (average FIA, SI, OI and DI) from `n_boot` samples of participants, by default None
+        ci : float, optional
+            Coverage of the bootstrap confidence intervals, by default 0.95
+        seed : int, optional
+            Seed of the bootstrap, for reproducibility, by default None
+        greater_is_better : bool, optional
+            Whether the best match is the highest value (similarity) or the lowest (distance).
+            For a distance, the differential identifiability is OI - SI. By default None (taken
+            from the measure used by the last `fingerprint_mats`, True otherwise)
 
         Returns
         -------
         pandas.DataFrame
-            Returns a pandas.DataFrame containing 5 columns: the ID and each of the four metrics.
+            Returns a pandas.DataFrame containing 5 columns: the ID and each of the four metrics
+            (plus the rank-based metrics if `top_k` is given). If `n_boot` is given, also
+            returns a pandas.DataFrame with the confidence intervals of the group-level metrics.
         """
+        if greater_is_better is None:
+            greater_is_better = (self.fp_params or {}).get("greater_is_better", True)
 
         #Compute the different metrics
-        fia_coef = self._fia_calculator(similar_matrix=similar_matrix)
+        fia_coef = self._fia_calculator(similar_matrix=similar_matrix,
+            greater_is_better=greater_is_better)
         si_coef = self._si_calculator(similar_matrix=similar_matrix)
         oi_coef = self._oi_calculator(similar_matrix=similar_matrix)
-        diff_identif_coef = self._identif_calculator(si_coef, oi_coef)
+        #For a distance, the participant is identifiable if their own distance is below the others
+        if greater_is_better is True:
+            diff_identif_coef = self._identif_calculator(si_coef, oi_coef)
+        else:
+            diff_identif_coef = self._identif_calculator(oi_coef, si_coef)
 
         #Create a dictionary and store the measures
         coef_data = pd.DataFrame(data={
@@ -456,12 +2417,22 @@ class FingerprintMats:
             f"di_{name}":diff_identif_coef})\
                 .set_index('ID')
 
+        if top_k is not None:
+            for col, values in _rank_metrics(similar_matrix, name, top_k,
+                greater_is_better).items():
+                coef_data[col] = values
+
         if coef_data[f"si_{name}"].isnull().sum() != 0:
             raise SystemExit("ERROR: Some participants have missing values from final dataframe")
 
+        if n_boot is not None:
+            return coef_data, _bootstrap_metrics(similar_matrix, name, n_boot=n_boot, ci=ci,
+                seed=seed, greater_is_better=greater_is_better)
+
         return coef_data
 
-    def fp_mat_export(self, output_path, coef_data, similar_matrix, name, out_full=True, dir_struct=True):
+    def fp_mat_export(self, output_path, coef_data, similar_matrix, name, out_full=True, dir_struct=True,
+    out_format="csv"):
         """Export the fingerprinting output to file. What is outputted and how is user
         dependant. By default, exports the similarity matrix, the subject list and the
         computed fingerprint metrics, and creates separate dictories for the similarity
@@ -482,6 +2453,10 @@ class FingerprintMats:
         dir_struct : bool, optional
             Whether we want similarity matrix and subject list to have their own directory, by
             default True
+        out_format : str, optional
+            Format of the similarity matrix, by default "csv" (text rounded to 3 decimals).
+            Options include: ["csv", "npy", "npz"]. The binary formats are lossless and can be
+            opened lazily with `import_similarity_matrix`; "npz" also stores the participant IDs.
         """
 
         path_fp_final = f'{output_path}/{name}'
@@ -505,16 +2480,337 @@ class FingerprintMats:
                 if not os.path.exists(dir_sub):
                     os.makedirs(dir_sub)
 
-                np.savetxt(f"{dir_sym}/similarity_matrix_{name}.csv", similar_matrix,
-                    delimiter=",", fmt='%1.3f')
+                _save_similarity_matrix(f"{dir_sym}/similarity_matrix_{name}", similar_matrix,
+                    self.sub_final, out_format)
                 np.savetxt(f"{dir_sub}/subject_list_{name}.csv", self.id_ls,
                     delimiter="\n", fmt="%s")
             else:
-                np.savetxt(f"{path_fp_final}/similarity_matrix_{name}.csv", similar_matrix,
-                    delimiter=",", fmt='%1.3f')
+                _save_similarity_matrix(f"{path_fp_final}/similarity_matrix_{name}",
+                    similar_matrix, self.sub_final, out_format)
                 np.savetxt(f"{path_fp_final}/subject_list_{name}.csv", self.id_ls,
                     delimiter="\n", fmt="%s")
 
+    def fp_state_export(self, state_path):
+        """Saves the features, the similarity matrix and the parameters of the last
+        fingerprinting to a `.npz` file, so participants can be added in a later session
+        with `fp_state_import` and `fingerprint_update`. Sparse features are saved as dense
+        arrays. After `fingerprint_stream` or `fingerprint_approx`, there is no similarity
+        matrix and only the features and the parameters are saved.
+
+        Parameters
+        ----------
+        state_path : str
+            Path of the `.npz` file to create.
+
+        Raises
+        ------
+        SystemExit
+            If no fingerprinting was computed before, we fail this function.
+        SystemExit
+            If the similarity measure is a callable, which can't be saved.
+        """
+        if self.features_m1 is None:
+            raise SystemExit("ERROR: Run fingerprint_mats before exporting the state.")
+        if callable(self.fp_params["corr_type"]):
+            raise SystemExit("ERROR: The state of a fingerprinting using a callable similarity \
+            measure can't be exported.")
+
+        state_dir = os.path.dirname(state_path)
+        if state_dir and os.path.exists(state_dir) is False:
+            os.makedirs(state_dir)
+
+        #A missing matrix is left out, since None would be saved as a (pickled) object array
+        state = {} if self.similar_matrix is None else {"similar_matrix": self.similar_matrix}
+        np.savez(state_path, features_m1=_dense_rows(self.features_m1, self.features_m1.dtype),
+            features_m2=_dense_rows(self.features_m2, self.features_m2.dtype),
+            **state, sub_final=np.array(self.sub_final, dtype=str),
+            final_m1=np.array(self.final_m1, dtype=str), final_m2=np.array(self.final_m2, dtype=str),
+            id_ls=np.array(self.id_ls, dtype=str), fp_params=np.array(json.dumps(self.fp_params)))
+
+    def fp_state_import(self, state_path):
+        """Loads the features, the similarity matrix and the parameters saved with
+        `fp_state_export` in the FingerprintMats object.
+
+        Parameters
+        ----------
+        state_path : str
+            Path to the `.npz` file.
+
+        Returns
+        -------
+        numpy.array
+            Returns the similarity matrix (None if the state was saved without one).
+        """
+        with np.load(state_path) as state:
+            self.features_m1 = state["features_m1"]
+            self.features_m2 = state["features_m2"]
+            self.similar_matrix = state["similar_matrix"] if "similar_matrix" in state\
+                else None
+            self.sub_final = state["sub_final"].tolist()
+            self.final_m1 = state["final_m1"].tolist()
+            self.final_m2 = state["final_m2"].tolist()
+            self.id_ls = state["id_ls"].tolist()
+            self.fp_params = json.loads(str(state["fp_params"]))
+
+        return self.similar_matrix
+
+class FingerprintMulti:
+    """Class object used to fingerprint more than two sessions (or modalities) at once. The
+    matrices of every session are imported once, and the feature arrays are shared by all the
+    pairs of sessions compared, instead of importing them again for each pair as separate
+    FingerprintMats objects would.
+    """
+
+    def __init__(self, id_ls, paths, cache_dir=None, as_sparse=False, connectivity=None):
+        """Creates a FingerprintMulti object made up of a list of ids, and the paths to the data.
+
+        Parameters
+        ----------
+        id_ls : list
+            List of participants to fingerprint
+        paths : dict
+            Dictionary with the name of every session as keys and the path to the folder
+            containing its matrices as values. Nested dictionaries (e.g., visits, then
+            modalities, like the paths returned by `datasets.pad_fp_input`) are flattened and
+            their keys are joined with an underscore (e.g., `BL00_rest_run1`).
+        cache_dir : str, optional
+            Directory where a binary (`.npy`) copy of every imported matrix is stored (see
+            `FingerprintMats`), by default None (no cache)
+        as_sparse : bool, optional
+            Whether to keep the matrices and the features as `scipy.sparse` matrices (see
+            `FingerprintMats`), by default False
+        connectivity : str, optional
+            If given, the files contain regional time series and the connectivity is computed
+            during the import (see `FingerprintMats`), by default None
+        """
+
+        self.id_ls = id_ls #Final list of IDs to fingerprint
+        self.paths = _flatten_paths(paths) #Location of the matrices of every session
+        self.cache_dir = cache_dir #Location of the binary copies of the matrices
+        self.as_sparse = as_sparse #Whether the matrices are kept sparse
+        self.connectivity = connectivity #Connectivity computed from time series (if any)
+
+        #Empty variables to store further computation.
+        self.sub_final = None #Participants retained in every session
+        self.final_files = None #Files of the participants retained in every session
+        self.features = None #Features of every session imported
+
+    def subject_selection(self, files=None, verbose=True, pattern=None, recursive=False):
+        """Select the participant files of every session. Participants don't need to have all
+        the sessions: each pair of sessions is fingerprinted with the participants who have
+        both sessions.
+
+        Parameters
+        ----------
+        files : dict, optional
+            Dictionary with the list of files of every session, by default None (the files are
+            listed with `iter_matrix_files`)
+        verbose : bool, optional
+            Whether or not we want an explicit description of participants included,
+            by default True
+        pattern : str, optional
+            Regular expression extracting the ID from the file names (see
+            `FingerprintMats.subject_selection`), by default None
+        recursive : bool, optional
+            Whether or not to also search the sub-folders when listing the files, by default False
+
+        Returns
+        -------
+        dict, dict
+            Returns the participants retained and the list of their filenames for every session.
+
+        Raises
+        ------
+        SystemExit
+            If no subject ID is matched to any file of a session, exit.
+        SystemExit
+            If a file of a participant retained is matched by more than one ID, or a
+            participant retained is matched to more than one file, exit.
+        SystemExit
+            If files are duplicated after matching with subject list, exit.
+        """
+        if files is None:
+            files = {session: list(iter_matrix_files(path, recursive=recursive))
+                for session, path in self.paths.items()}
+
+        self.sub_final = {}
+        self.final_files = {}
+        for session in self.paths:
+            file_index, collisions = _match_files(self.id_ls, files[session], pattern=pattern)
+            #Same checks as `FingerprintMats.subject_selection`, for every session
+            _check_matches(file_index, collisions, file_index)
+
+            self.sub_final[session] = sorted(file_index)
+            self.final_files[session] = [filename for subject in self.sub_final[session]
+                for filename in file_index[subject]]
+
+            if len(self.final_files[session]) == 0:
+                raise SystemExit(f"ERROR: Could not match subject IDs from the list to any \
+                file of session {session}.")
+            if len(self.final_files[session]) != len(set(self.final_files[session])):
+                raise SystemExit(f"ERROR: Files of session {session} are duplicated")
+
+            if verbose is True:
+                print(f"We have {len(self.sub_final[session])} participants in session {session}.")
+
+        return self.sub_final, self.final_files
+
+    def _session_features(self, session, node_sets, norm=True, verbose=True, n_jobs=1,
+    backend="threads", dtype=np.double):
+        """Internal function importing the features of a session (see
+        `FingerprintMats._extract_features`).
+
+        Parameters
+        ----------
+        session : str
+            Name of the session.
+        node_sets : list of tuple
+            List of `(nodes_index_within, nodes_index_between)` pairs.
+        norm : bool, optional
+            Whether or not to Fisher normalize the data, by default True
+        verbose : bool, optional
+            Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices, by default 1
+        backend : str, optional
+            Type of workers to use, either "threads" or "processes", by default "threads"
+        dtype : numpy.dtype, optional
+            Precision used to store the features, by default np.double
+
+        Returns
+        -------
+        list of numpy.array
+            Returns, for every set of nodes, the features of the participants of the session.
+        """
+        fp_session = FingerprintMats(id_ls=self.id_ls, path_m1=self.paths[session],
+            path_m2=self.paths[session], cache_dir=self.cache_dir, as_sparse=self.as_sparse,
+            connectivity=self.connectivity)
+        fp_session.sub_final = self.sub_final[session]
+        fp_session.final_m1 = self.final_files[session]
+
+        if verbose is True:
+            print(f"Importing session {session}")
+
+        return fp_session._extract_features(1, node_sets, norm=norm, verbose=verbose,
+            n_jobs=n_jobs, backend=backend, dtype=dtype)
+
+    def fingerprint_multi(self, nodes_index_within, nodes_index_between=None, pairs=None,
+    norm=True, corr_type="Pearson", verbose=True, n_jobs=1, backend="threads", block_size=1024,
+    dtype=np.double, symmetric=True, greater_is_better=None):
+        """Fingerprints every requested pair of sessions. The matrices of each session are
+        imported once, then the similarity matrix and the fingerprint metrics of every pair are
+        computed from the shared feature arrays, with the participants having both sessions.
+
+        Parameters
+        ----------
+        nodes_index_within : list of int
+            List of nodes to include in the fingerprinting (see `FingerprintMats.fingerprint_mats`).
+        nodes_index_between : list of int, optional
+            List of nodes to use as columns for between-network fingerprinting, by default None
+        pairs : list of tuple, optional
+            Pairs of sessions to fingerprint, as `(session_1, session_2)`, by default None (every
+            pair of sessions)
+        norm : bool, optional
+            Whether or not to Fisher normalize the data before fingerprinting, by default True
+        corr_type : str or callable, optional
+            Which similarity measure to use, by default "Pearson" (see
+            `FingerprintMats.fingerprint_mats`)
+        verbose : bool, optional
+            Whether or not to print a message of which participants we are doing, by default True
+        n_jobs : int, optional
+            Number of workers importing the matrices. Use -1 to use all the CPUs, by default 1
+        backend : str, optional
+            Type of workers importing the matrices, either "threads" or "processes", by
+            default "threads"
+        block_size : int, optional
+            Number of participants per block of the similarity computation, by default 1024
+        dtype : numpy.dtype, optional
+            Precision of the features and of the similarity matrices, by default np.double
+        symmetric : bool, optional
+            Whether to compute the upper triangle only and mirror it (True) or to keep the
+            asymmetric matrices (False), by default True
+        greater_is_better : bool, optional
+            Whether the best match is the highest value or the lowest, by default None (True
+            for the correlations, False for the distances)
+
+        Returns
+        -------
+        dict, dict
+            Returns two dictionaries with the pairs of sessions as keys: the similarity matrices
+            and the fingerprint metrics (named `{metric}_{session_1}_{session_2}`, indexed by
+            the participants having both sessions).
+
+        Raises
+        ------
+        SystemExit
+            If the subject selection was skipped, we fail this function.
+        SystemExit
+            If a pair includes a session that doesn't exist.
+        """
+        if self.sub_final is None:
+            raise SystemExit("ERROR: Did you instantiate the FingerprintMulti class and/or \
+            run the subject_selection function first?")
+
+        if pairs is None:
+            pairs = list(itertools.combinations(self.paths, 2))
+        unknown = {session for pair in pairs for session in pair} - set(self.paths)
+        if len(unknown) != 0:
+            raise SystemExit(f"ERROR: Sessions {sorted(unknown)} are not in the paths given.")
+
+        #Every session used is imported once, whatever the number of pairs it is part of
+        node_sets = [(nodes_index_within, nodes_index_between)]
+        self.features = {}
+        for session in dict.fromkeys(session for pair in pairs for session in pair):
+            self.features[session] = self._session_features(session, node_sets, norm=norm,
+                verbose=verbose, n_jobs=n_jobs, backend=backend, dtype=dtype)[0]
+
+        similar_matrices = {}
+        coef_data = {}
+        for session_1, session_2 in pairs:
+            #Only the participants with both sessions are compared
+            sub_pair = sorted(set(self.sub_final[session_1]) & set(self.sub_final[session_2]))
+            rows_1 = np.searchsorted(self.sub_final[session_1], sub_pair)
+            rows_2 = np.searchsorted(self.sub_final[session_2], sub_pair)
+
+            if verbose is True:
+                print(f"Fingerprinting {session_1} with {session_2}: {len(sub_pair)} participants")
+
+            similar_matrix = _similarity_matrix(self.features[session_1][rows_1],
+                self.features[session_2][rows_2], corr_type=corr_type, block_size=block_size,
+                dtype=dtype, symmetric=symmetric)
+            similar_matrices[(session_1, session_2)] = similar_matrix
+            coef_data[(session_1, session_2)] = tab_metrics_calc(pd.DataFrame(index=sub_pair),
+                similar_matrix, f"{session_1}_{session_2}",
+                greater_is_better=_greater_is_better(corr_type, greater_is_better))\
+                    .rename_axis("ID")
+
+        return similar_matrices, coef_data
+
+def _flatten_paths(paths, prefix=""):
+    """Internal function flattening a nested dictionary of paths, joining the keys with an
+    underscore (e.g., `{"BL00": {"rest_run1": path}}` becomes `{"BL00_rest_run1": path}`).
+
+    Parameters
+    ----------
+    paths : dict
+        Dictionary of paths, possibly nested.
+    prefix : str, optional
+        Prefix of the keys, used by the recursion, by default ""
+
+    Returns
+    -------
+    dict
+        Returns a flat dictionary of paths.
+    """
+    flat_paths = {}
+    for key, value in paths.items():
+        if isinstance(value, dict):
+            flat_paths.update(_flatten_paths(value, f"{prefix}{key}_"))
+        else:
+            flat_paths[f"{prefix}{key}"] = value
+
+    return flat_paths
+
 ##########
 
 def import_fingerprint_data(data, var):
@@ -552,9 +2848,20 @@ def import_fingerprint_data(data, var):
 
     return data_first, data_last
 
-def fingerprint_tabs(data1, data2, pref):
+def fingerprint_tabs(data1, data2, pref, symmetric=True, corr_type="Pearson"):
     """ Main function computing fingerprinting for tabular data. It assumes that the variables to
     use for fingerprinting start with naming convention (e.g., "ctx").
+
+    By default, the similarity matrix is symmetric: only the correlations of the first visit of
+    a participant with the second visit of the participants coming after them are computed
+    (upper triangle) and mirrored. With `symmetric=False`, both directions are kept (row `i`,
+    column `j` is visit 1 of `i` with visit 2 of `j`).
+
+    `corr_type` can be "Pearson" (default), "Spearman" or "Kendall" (tau-b). Ranks are
+    computed once per participant and all correlations use the same matrix products. It can
+    also be "Cosine", a distance ("Euclidean", "Manhattan" or "Geodesic") or a callable (see
+    `FingerprintMats.fingerprint_mats`). For the distances, use `greater_is_better=False` in
+    `tab_metrics_calc`.
     """
 
     data1_final = data1.filter(like=pref) #Restrict columns to the ones we need only
@@ -566,23 +2873,15 @@ def fingerprint_tabs(data1, data2, pref):
     if data1_final.columns.values.all() != data2_final.columns.values.all():
         return "ERROR: Columns of the two datasets do not match. Can't fingerprint."
 
-    #Create similarity matrix to store the data
-    similar_matrix = np.empty((len(data1_final), len(data2_final)))
+    #Fingerprinting: correlate every participant of the first visit to every participant
+    # of the second visit
+    similar_matrix = _similarity_matrix(data1_final.to_numpy(dtype=np.double),
+        data2_final.to_numpy(dtype=np.double), corr_type=corr_type, symmetric=symmetric)
 
-    #Fingerprinting
-    ## For each participant...
-    for i, col in enumerate(data1_final.T): #We transpose the dataframe to leverage vectorized ops
-        print(f"Participant {i+1} / {len(data1_final)}")
-        data1_array = data1_final.T[col].to_numpy() #Transform column to numpy array
-        for j, col in enumerate(data2_final.T):
-            data2_array = data2_final.T[col].to_numpy()
+    return similar_matrix
 
-            similar_matrix[i,j] = stats.pearsonr(data1_array, data2_array)[0]
-
-    #Clean the similarity matrix and return
-    return np.triu(similar_matrix, k=0) + np.triu(similar_matrix, k=1).T
-
-def tab_metrics_calc(data, similar_matrix, name):
+def tab_metrics_calc(data, similar_matrix, name, top_k=None, n_boot=None, ci=0.95, seed=None,
+    greater_is_better=True):
     """ Function computing the different fingerprint metrics and stores them in a dataframe
         for export. Each metric is computed and stored in a numpy.array which are then used
         to populate the dataframe.
@@ -597,17 +2896,38 @@ def tab_metrics_calc(data, similar_matrix, name):
         name : str
             String to add to the variables. This is so the user can differentiate the different
             runs of the fingerprinting if multiple are used.
+        top_k : int or list of int, optional
+            If given, also computes the rank of the correct match (`rank`), its percentile rank
+            (`prank`, 1 is best) and whether the correct match is within the k best matches
+            (`topk`, for every k given), by default None
+        n_boot : int, optional
+            If given, also computes bootstrap confidence intervals of the group-level metrics
+            (average FIA, SI, OI and DI) from `n_boot` samples of participants, by default None
+        ci : float, optional
+            Coverage of the bootstrap confidence intervals, by default 0.95
+        seed : int, optional
+            Seed of the bootstrap, for reproducibility, by default None
+        greater_is_better : bool, optional
+            Whether the best match is the highest value (similarity) or the lowest (distance,
+            e.g., `corr_type="Euclidean"` in `fingerprint_tabs`). For a distance, the
+            differential identifiability is OI - SI, by default True
 
         Returns
         -------
         pandas.DataFrame
-            Returns a pandas.DataFrame containing 5 columns: the ID and each of the four metrics.
+            Returns a pandas.DataFrame containing 5 columns: the ID and each of the four metrics
+            (plus the rank-based metrics if `top_k` is given). If `n_boot` is given, also
+            returns a pandas.DataFrame with the confidence intervals of the group-level metrics.
     """
     #Compute the different metrics
-    fia_coef = _fia_calculator(similar_matrix=similar_matrix)
+    fia_coef = _fia_calculator(similar_matrix=similar_matrix, greater_is_better=greater_is_better)
     si_coef = _si_calculator(similar_matrix=similar_matrix)
     oi_coef = _oi_calculator(similar_matrix=similar_matrix)
-    diff_identif_coef = _identif_calculator(si_coef, oi_coef)
+    #For a distance, the participant is identifiable if their own distance is below the others
+    if greater_is_better is True:
+        diff_identif_coef = _identif_calculator(si_coef, oi_coef)
+    else:
+        diff_identif_coef = _identif_calculator(oi_coef, si_coef)
 
     #Create a dictionary and store the measures
     fp_metrics = pd.DataFrame(data={
@@ -618,35 +2938,725 @@ def tab_metrics_calc(data, similar_matrix, name):
         f"di_{name}":diff_identif_coef})\
             .set_index('participant_id')
 
+    if top_k is not None:
+        for col, values in _rank_metrics(similar_matrix, name, top_k,
+            greater_is_better).items():
+            fp_metrics[col] = values
+
     if fp_metrics[f"si_{name}"].isnull().sum() != 0:
         raise SystemExit("ERROR: Some participants have missing values from final dataframe")
 
+    if n_boot is not None:
+        return fp_metrics, _bootstrap_metrics(similar_matrix, name, n_boot=n_boot, ci=ci,
+            seed=seed, greater_is_better=greater_is_better)
+
     return fp_metrics
 
-def tab_export(outpath, data1, data2, similar_matrix, fp_metrics, name):
+def tab_export(outpath, data1, data2, similar_matrix, fp_metrics, name, out_format="csv"):
     """ Simple wrapper function exporting the data for both visits of participants fingerprinted,
-    the similarity matrix, the fingerprint metrics and the name given by the user.
+    the similarity matrix, the fingerprint metrics and the name given by the user. The
+    similarity matrix can also be saved in a binary format (`out_format="npy"` or `"npz"`, see
+    `FingerprintMats.fp_mat_export`).
     """
 
     data1.to_csv(f"{outpath}/fp_data_first_session_{name}.csv")
     data2.to_csv(f"{outpath}/fp_data_second_session_{name}.csv")
 
-    sim_matrix_df = pd.DataFrame(data=similar_matrix, 
-        index=data1.index.values, columns=data1.index.values)\
-        .to_csv(f"{outpath}/similarity_matrix_{name}.csv")
+    if out_format == "csv":
+        sim_matrix_df = pd.DataFrame(data=similar_matrix, 
+            index=data1.index.values, columns=data1.index.values)\
+            .to_csv(f"{outpath}/similarity_matrix_{name}.csv")
+    else:
+        _save_similarity_matrix(f"{outpath}/similarity_matrix_{name}", similar_matrix,
+            data1.index.values, out_format)
 
     fp_metrics.to_csv(f"{outpath}/fp_metrics_{name}.csv")
 
+def _save_similarity_matrix(path, similar_matrix, ids, out_format="csv"):
+    """Internal function saving a similarity matrix in text or binary format.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to create, without the extension.
+    similar_matrix : numpy.array
+        Similarity matrix to save.
+    ids : list
+        IDs of the participants (rows) of the similarity matrix. Only stored in the "npz" format.
+    out_format : str, optional
+        Format of the file, by default "csv". Options include: ["csv", "npy", "npz"]
+
+    Raises
+    ------
+    SystemExit
+        If the format is not supported.
+    """
+    if out_format == "csv":
+        np.savetxt(f"{path}.csv", similar_matrix, delimiter=",", fmt='%1.3f')
+    elif out_format == "npy":
+        np.save(f"{path}.npy", similar_matrix)
+    elif out_format == "npz":
+        #The archive is not compressed so the matrix can be memory-mapped from it
+        np.savez(f"{path}.npz", similar_matrix=similar_matrix, ids=np.array(ids, dtype=str))
+    else:
+        raise SystemExit(f"ERROR: Format {out_format} is not supported. Use 'csv', 'npy' or \
+        'npz'.")
+
+def import_similarity_matrix(path):
+    """Function opening a similarity matrix saved in a binary format by `fp_mat_export` or
+    `tab_export`. The matrix is memory-mapped (read-only), so only the parts used are read from
+    the disk. It can be passed as is to the fingerprint metrics (e.g., `fp_metrics_calc`),
+    which process it by blocks of rows.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.npy` or `.npz` file.
+
+    Returns
+    -------
+    numpy.memmap, list
+        Returns the similarity matrix and the IDs of the participants (None for `.npy` files).
+
+    Raises
+    ------
+    SystemExit
+        If the file is not a `.npy` or a `.npz` file.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode='r'), None
+    if not path.endswith(".npz"):
+        raise SystemExit("ERROR: Only .npy and .npz similarity matrices can be imported.")
+
+    with zipfile.ZipFile(path) as archive:
+        ids = np.load(path)["ids"].tolist()
+        info = archive.getinfo("similar_matrix.npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            #Compressed archives can't be mapped, so the matrix is loaded in memory
+            with archive.open(info) as member:
+                return np.lib.format.read_array(member), ids
+
+    with open(path, 'rb') as file:
+        #The member starts after its local header (30 bytes, the file name and the extra field)
+        file.seek(info.header_offset + 26)
+        name_len, extra_len = struct.unpack('<HH', file.read(4))
+        file.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+
+    similar_matrix = np.memmap(path, dtype=dtype, mode='r', shape=shape, offset=offset,
+        order='F' if fortran_order else 'C')
+
+    return similar_matrix, ids
+
+def edge_labels(nodes_index_within, nodes_index_between=None):
+    """Function returning which pair of nodes each edge of the feature arrays comes from, in
+    the same order as the edges returned by the slicing of the matrices.
+
+    Parameters
+    ----------
+    nodes_index_within : list of int
+        List of nodes used for the fingerprinting.
+    nodes_index_between : list of int, optional
+        List of nodes used as columns for between-network fingerprinting, by default None
+
+    Returns
+    -------
+    pandas.MultiIndex
+        Returns an index with two levels (`node_1` and `node_2`), one entry per edge.
+    """
+    nodes_within = np.asarray(nodes_index_within)
+    if nodes_index_between:
+        nodes_between = np.asarray(nodes_index_between)
+        node_1 = np.repeat(nodes_within, len(nodes_between))
+        node_2 = np.tile(nodes_between, len(nodes_within))
+    else:
+        rows, cols = np.triu_indices(len(nodes_within), k=1)
+        node_1 = nodes_within[rows]
+        node_2 = nodes_within[cols]
+
+    return pd.MultiIndex.from_arrays([node_1, node_2], names=["node_1", "node_2"])
+
+def edgewise_identifiability(features_m1, features_m2, labels=None, chunk_size=10000):
+    """Function computing which edges drive the identification of the participants. For every
+    edge, two measures are computed:
+
+    - `icc`: test-retest reliability of the edge between the two modalities, as the one-way
+      random effects intra-class correlation ICC(1,1).
+    - `di_contribution`: contribution of the edge to the group-level differential
+      identifiability (average SI minus average OI) of the Pearson similarity matrix (both
+      directions kept, i.e. `symmetric=False`). The contributions of all edges sum to the
+      group-level differential identifiability.
+
+    The rows of the features are summarized once, then the edges are processed by chunks of
+    columns, so no Python loop runs over the edges.
+
+    Parameters
+    ----------
+    features_m1 : numpy.array
+        Features of the first modality, of shape (participants, edges) (e.g., the
+        `features_m1` attribute of a FingerprintMats object after `fingerprint_mats`).
+    features_m2 : numpy.array
+        Features of the second modality, same shape and participants as `features_m1`.
+    labels : pandas.Index, optional
+        Labels of the edges (see `edge_labels`), by default None (edges are numbered)
+    chunk_size : int, optional
+        Number of edges processed at once, by default 10000
+
+    Returns
+    -------
+    pandas.DataFrame
+        Returns a dataframe with one row per edge and the columns `icc` and `di_contribution`.
+    """
+    n_subjects, n_edges = np.shape(features_m1)
+    means_1, norms_1, _ = _row_stats(features_m1)
+    means_2, norms_2, _ = _row_stats(features_m2)
+
+    icc = np.empty(n_edges)
+    di_contribution = np.empty(n_edges)
+
+    for start in range(0, n_edges, chunk_size):
+        edges = slice(start, start + chunk_size)
+        x_1 = _dense_rows(features_m1[:, edges])
+        x_2 = _dense_rows(features_m2[:, edges])
+
+        #ICC(1,1) with two measurements per participant
+        subject_means = (x_1 + x_2) / 2
+        ms_between = 2 * ((subject_means - subject_means.mean(axis=0)) ** 2).sum(axis=0)\
+            / (n_subjects - 1)
+        ms_within = (((x_1 - subject_means) ** 2) + ((x_2 - subject_means) ** 2)).sum(axis=0)\
+            / n_subjects
+        with np.errstate(divide='ignore', invalid='ignore'):
+            icc[edges] = (ms_between - ms_within) / (ms_between + ms_within)
+
+        #Each cell of the similarity matrix is a sum over the edges of the products of the
+        # standardized rows, so the average SI and OI can be split edge by edge
+        z_1 = _zscore_rows(x_1, means_1, norms_1)
+        z_2 = _zscore_rows(x_2, means_2, norms_2)
+        self_sum = (z_1 * z_2).sum(axis=0)
+        others_sum = z_1.sum(axis=0) * z_2.sum(axis=0) - self_sum
+        di_contribution[edges] = self_sum / n_subjects\
+            - others_sum / (n_subjects * (n_subjects - 1))
+
+    if labels is None:
+        labels = pd.RangeIndex(n_edges, name="edge")
+
+    return pd.DataFrame(data={"icc": icc, "di_contribution": di_contribution}, index=labels)
+
+def pca_identifiability(features_m1, features_m2, n_components=None, seed=None):
+    """Function maximizing the differential identifiability by reconstructing the features
+    from their principal components (Amico & Goni, 2018). As in the original method (PCA of
+    the edges x fingerprints matrix), the fingerprints of both sessions are stacked, each
+    fingerprint (row) is centered and the result is decomposed once (SVD). The fingerprints
+    are then reconstructed with the first 1, 2, ... components (plus their mean), and the
+    differential identifiability of the Pearson similarity matrix (both directions kept) is
+    computed for each number of components.
+
+    The reconstructions are never built: adding a component to the reconstruction is a
+    rank-one update of the products and the squared norms of the reconstructed rows, which
+    only depend on the scores of the participants. The reconstructed rows stay centered (the
+    components are orthogonal to a constant row) and the Pearson correlation ignores the mean
+    added back, so the correlation only needs these products and norms. Each number of
+    components then costs one update of a participants x participants matrix.
+
+    Parameters
+    ----------
+    features_m1 : numpy.array
+        Features of the first session, of shape (participants, edges) (e.g., the
+        `features_m1` attribute of a FingerprintMats object after `fingerprint_mats`).
+    features_m2 : numpy.array
+        Features of the second session, same shape and participants as `features_m1`.
+    n_components : int, optional
+        Maximum number of components. If given, a randomized SVD computes these components
+        only, which is faster for large cohorts. By default None (full SVD, all components)
+    seed : int, optional
+        Seed of the randomized SVD, for reproducibility, by default None
+
+    Returns
+    -------
+    pandas.Series, numpy.array
+        Returns the average differential identifiability for every number of components and
+        the similarity matrix of the reconstruction with the highest one.
+    """
+    n_subjects = np.shape(features_m1)[0]
+    features = np.vstack([_dense_rows(features_m1), _dense_rows(features_m2)])
+    features -= features.mean(axis=1, keepdims=True)
+
+    if n_components is None:
+        left, singular, right = np.linalg.svd(features, full_matrices=False)
+    else:
+        left, singular, right = randomized_svd(features, n_components, random_state=seed)
+    scores = left * singular
+    scores_1, scores_2 = scores[:n_subjects], scores[n_subjects:]
+
+    products = np.zeros((n_subjects, n_subjects))
+    sq_1 = np.zeros(n_subjects)
+    sq_2 = np.zeros(n_subjects)
+
+    di_curve = np.empty(len(singular))
+    best_di, best_matrix = -np.inf, None
+    for comp in range(len(singular)):
+        #Rank-one update: row i of the reconstruction gains scores[i, comp] * right[comp]
+        a_1, a_2 = scores_1[:, comp], scores_2[:, comp]
+        products += np.outer(a_1, a_2)
+        sq_1 += a_1 ** 2
+        sq_2 += a_2 ** 2
+
+        #Pearson correlation of centered rows, from the products and the squared norms
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similar_matrix = np.clip(products / np.sqrt(np.outer(sq_1, sq_2)), -1, 1)
+        di_curve[comp] = _identif_calculator(_si_calculator(similar_matrix),
+            _oi_calculator(similar_matrix)).mean()
+        if di_curve[comp] > best_di:
+            best_di, best_matrix = di_curve[comp], similar_matrix
+
+    di_curve = pd.Series(di_curve, index=pd.RangeIndex(1, len(singular) + 1,
+        name="n_components"), name="di")
+
+    return di_curve, best_matrix
+
+def _stream_reductions(features_1, features_2, corr_type="Pearson", block_size=1024,
+    dtype=np.double, symmetric=True, greater_is_better=True, keep_top=None):
+    """Internal function computing, block of rows by block of rows, everything the fingerprint
+    metrics need from the similarity matrix: its diagonal, the sums of its rows, the best match
+    of every row and the rank of the correct match (and optionally the `keep_top` best
+    matches of every row). Each tile of the similarity matrix is reduced and discarded, so
+    only a block of rows x block of columns is in memory at once.
+
+    The tile with the diagonal is computed first for every block of rows, so the rank of the
+    correct match can be counted in the other tiles. Ties are broken like `numpy.argmax` (the
+    first column wins). In the symmetric mode, the tiles below the diagonal are the transpose
+    of the tiles computed with the sessions swapped, which is the value `_mirror_upper` would
+    have copied there.
+
+    Parameters
+    ----------
+    features_1 : numpy.array
+        2D array of shape (participants, edges) for the first session.
+    features_2 : numpy.array
+        2D array of shape (participants, edges) for the second session.
+    corr_type : str or callable, optional
+        Similarity measure (see `_similarity_matrix`), by default "Pearson"
+    block_size : int, optional
+        Number of participants per block, by default 1024
+    dtype : numpy.dtype, optional
+        Precision used for the computation, by default np.double
+    symmetric : bool, optional
+        Whether the similarity matrix is the symmetric one (see `fingerprint_mats`), by
+        default True
+    greater_is_better : bool, optional
+        Whether the best match is the highest value (similarity) or the lowest (distance), by
+        default True
+    keep_top : int, optional
+        Number of best matches to keep for every row, by default None
+
+    Returns
+    -------
+    dict
+        Returns a dictionary with the diagonal (`diag`), the sums of the rows (`row_sums`), the
+        best match of every row (`best`), the rank of the correct match (`rank`) and, if
+        `keep_top` is given, the best matches (`top_index`) and their values (`top_values`).
+    """
+    n_subjects = np.shape(features_1)[0]
+    sign = 1 if greater_is_better is True else -1
+    diag = np.empty(n_subjects)
+    row_sums = np.zeros(n_subjects)
+    best = np.zeros(n_subjects, dtype=int)
+    best_values = np.full(n_subjects, -np.inf)
+    rank = np.ones(n_subjects, dtype=int)
+    if keep_top is not None:
+        #Empty slots hold the worst possible value, so real matches always replace them
+        n_top = min(keep_top, n_subjects)
+        top_index = np.full((n_subjects, n_top), n_subjects)
+        top_values = np.full((n_subjects, n_top), -np.inf)
+
+    #Ranks and summary statistics of the rows are computed once, not once per tile
+    prepared = _prepare_similarity(features_1, features_2, corr_type, block_size)
+    for row in range(0, n_subjects, block_size):
+        rows = np.arange(row, min(row + block_size, n_subjects))
+        row_slice = slice(row, row + block_size)
+        block_1 = _similarity_rows(prepared, row_slice, corr_type, dtype)
+        col_starts = [row] + [col for col in range(0, n_subjects, block_size) if col != row]
+        for col in col_starts:
+            cols = np.arange(col, min(col + block_size, n_subjects))
+            col_slice = slice(col, col + block_size)
+            if symmetric is True and col < row:
+                tile = _similarity_tile(prepared, _similarity_rows(prepared, col_slice,
+                    corr_type, dtype), col_slice, row_slice, corr_type, dtype).T
+            else:
+                tile = _similarity_tile(prepared, block_1, row_slice, col_slice, corr_type,
+                    dtype)
+            #Same precision as the similarity matrix of `fingerprint_mats`
+            tile = tile.astype(dtype, copy=False)
+            if col == row:
+                if symmetric is True:
+                    lower = np.tril_indices(len(rows), k=-1)
+                    tile[lower] = tile.T[lower]
+                diag[rows] = np.diag(tile)
+
+            row_sums[rows] += tile.sum(axis=1)
+            #Best values are compared on the same scale for similarities and distances
+            scores = sign * tile
+            before = cols[None, :] < rows[:, None]
+            diag_scores = sign * diag[rows, None]
+            rank[rows] += ((scores > diag_scores) | ((scores == diag_scores) & before)).sum(1)
+
+            tile_best = np.argmax(scores, axis=1)
+            tile_best_values = scores[np.arange(len(rows)), tile_best]
+            #Columns come in any order, so ties go to the lowest column explicitly
+            update = (tile_best_values > best_values[rows]) | ((tile_best_values
+                == best_values[rows]) & (cols[tile_best] < best[rows]))
+            best[rows[update]] = cols[tile_best[update]]
+            best_values[rows[update]] = tile_best_values[update]
+
+            if keep_top is not None:
+                merged_index = np.hstack([top_index[rows], np.broadcast_to(cols, tile.shape)])
+                merged_values = np.hstack([top_values[rows], scores])
+                #Sort by value, then by column for the ties
+                order = np.lexsort((merged_index, -merged_values), axis=1)[:, :n_top]
+                top_index[rows] = np.take_along_axis(merged_index, order, axis=1)
+                top_values[rows] = np.take_along_axis(merged_values, order, axis=1)
+
+    reductions = {"diag": diag, "row_sums": row_sums, "best": best, "rank": rank}
+    if keep_top is not None:
+        reductions["top_index"] = top_index
+        reductions["top_values"] = sign * top_values
+
+    return reductions
+
+def approximate_identification(features_m1, features_m2, top_k=1, n_projections=256,
+    n_candidates=50, block_size=1024, n_check=100, seed=None):
+    """Function identifying the participants without computing the full similarity matrix,
+    for cohorts where it would not fit in memory. The standardized features are reduced to
+    short sketches with a random projection, which preserves the Pearson correlations
+    approximately. For every participant of the first session, the `n_candidates` participants
+    of the second session with the most similar sketches are shortlisted, and the exact
+    correlations are only computed with the shortlist.
+
+    The shortlist can miss the true best match. To measure it, the exact similarity is also
+    computed for a random subsample of `n_check` participants, and the recall (proportion of
+    the exact top-k matches found by the approximate search) is returned.
+
+    Parameters
+    ----------
+    features_m1 : numpy.array
+        Features of the first session, of shape (participants, edges).
+    features_m2 : numpy.array
+        Features of the second session, same shape and participants as `features_m1`.
+    top_k : int, optional
+        Number of best matches returned for every participant, by default 1
+    n_projections : int, optional
+        Length of the sketches. Longer sketches give better shortlists, by default 256
+    n_candidates : int, optional
+        Number of participants shortlisted for every participant, by default 50
+    block_size : int, optional
+        Number of participants processed at once, by default 1024
+    n_check : int, optional
+        Number of participants for which the exact matches are computed to estimate the
+        recall, by default 100
+    seed : int, optional
+        Seed of the random projection and of the subsample, for reproducibility, by default None
+
+    Returns
+    -------
+    pandas.DataFrame, float
+        Returns a dataframe with one row per participant: whether they are identified (`fia`),
+        whether the correct match is within the `top_k` matches (`top{k}`, if `top_k` > 1),
+        and the best matches (`match_{j}`, row of the second session) with their correlation
+        (`similarity_{j}`). Also returns the recall on the subsample.
+    """
+    n_subjects, n_edges = np.shape(features_m1)
+    n_candidates = min(max(n_candidates, top_k), np.shape(features_m2)[0])
+    rng = np.random.default_rng(seed)
+    projection = rng.standard_normal((n_edges, n_projections)) / np.sqrt(n_projections)
+
+    means_1, norms_1, _ = _row_stats(features_m1, block_size)
+    means_2, norms_2, _ = _row_stats(features_m2, block_size)
+
+    #Sketches of the second session, the index searched by every participant
+    sketches_2 = np.vstack([_zscore_rows(features_m2[start:start + block_size],
+        means_2[start:start + block_size], norms_2[start:start + block_size]) @ projection
+        for start in range(0, np.shape(features_m2)[0], block_size)])
+
+    #Number of participants reranked at once, so the shortlisted features stay small (~256MB)
+    rerank_size = max(1, 2 ** 25 // (n_candidates * n_edges))
+    matches = np.empty((n_subjects, top_k), dtype=int)
+    similarities = np.empty((n_subjects, top_k))
+    for start in range(0, n_subjects, block_size):
+        rows = slice(start, start + block_size)
+        z_block = _zscore_rows(features_m1[rows], means_1[rows], norms_1[rows])
+        approx = (z_block @ projection) @ sketches_2.T
+        shortlist = np.argpartition(-approx, n_candidates - 1, axis=1)[:, :n_candidates]
+
+        for sub in range(0, len(z_block), rerank_size):
+            candidates = shortlist[sub:sub + rerank_size]
+            raw_candidates = _dense_rows(features_m2[candidates.ravel()])\
+                .reshape(len(candidates), n_candidates, n_edges)
+            #The standardized query sums to 0, so the candidates only need to be scaled
+            exact = np.matmul(raw_candidates, z_block[sub:sub + rerank_size, :, None])[..., 0]\
+                / norms_2[candidates]
+            order = np.argsort(-exact, axis=1, kind='stable')[:, :top_k]
+            matches[start + sub:start + sub + len(candidates)] = np.take_along_axis(
+                candidates, order, axis=1)
+            similarities[start + sub:start + sub + len(candidates)] = np.take_along_axis(
+                exact, order, axis=1)
+
+    #Recall of the approximate top-k against the exact similarity, on a subsample
+    check = np.sort(rng.choice(n_subjects, min(n_check, n_subjects), replace=False))
+    exact_matches = np.argsort(-_similarity_matrix(features_m1[check], features_m2,
+        block_size=block_size), axis=1, kind='stable')[:, :top_k]
+    recall = np.mean([len(set(exact_row) & set(approx_row)) / top_k
+        for exact_row, approx_row in zip(exact_matches, matches[check])])
+
+    identified = matches == np.arange(n_subjects)[:, None]
+    coef_data = pd.DataFrame(data={"fia": identified[:, 0].astype(float)})
+    if top_k > 1:
+        coef_data[f"top{top_k}"] = identified.any(axis=1).astype(float)
+    for j in range(top_k):
+        coef_data[f"match_{j + 1}"] = matches[:, j]
+        coef_data[f"similarity_{j + 1}"] = np.clip(similarities[:, j], -1, 1)
+
+    return coef_data, recall
+
+def _bootstrap_metrics(similar_matrix, name, n_boot=1000, ci=0.95, batch_size=100, seed=None,
+    greater_is_better=True):
+    """Internal function computing bootstrap confidence intervals for the group-level
+    fingerprint metrics (average FIA, SI, OI and DI).
+
+    Each bootstrap sample draws participants with replacement, which is summarized as the number
+    of times each participant is drawn. The metrics of a sample are then weighted sums over the
+    existing similarity matrix, so no correlation is recomputed and a batch of samples is
+    evaluated with a matrix product. A participant is identified in a sample if none of the
+    participants matching better than themselves (their "competitors") were drawn.
+
+    Parameters
+    ----------
+    similar_matrix : numpy.array
+        Similarity matrix.
+    name : str
+        String to add to the names of the metrics.
+    n_boot : int, optional
+        Number of bootstrap samples, by default 1000
+    ci : float, optional
+        Coverage of the confidence intervals, by default 0.95
+    batch_size : int, optional
+        Number of bootstrap samples computed at once, by default 100
+    seed : int, optional
+        Seed of the random number generator, for reproducibility, by default None
+    greater_is_better : bool, optional
+        Whether the best match is the highest value (similarity) or the lowest (distance), by
+        default True
+
+    Returns
+    -------
+    pandas.DataFrame
+        Returns a dataframe with the observed value and the bounds of the confidence interval
+        of each metric.
+    """
+    #Distances are negated so the best match is the highest value; SI and OI are put back in
+    # their units at the end, and the DI becomes OI - SI
+    sign = 1 if greater_is_better is True else -1
+    similar_matrix = sign * np.asarray(similar_matrix, dtype=np.double)
+    n_subjects = len(similar_matrix)
+    diag = np.diag(similar_matrix)
+
+    #Competitors break ties like `numpy.argmax` (the first column wins)
+    cols = np.arange(n_subjects)
+    competitors = (similar_matrix > diag[:, None])\
+        | ((similar_matrix == diag[:, None]) & (cols[None, :] < cols[:, None]))
+    np.fill_diagonal(competitors, False)
+    competitors = competitors.astype(np.double)
+
+    rng = np.random.default_rng(seed)
+    boot = np.empty((n_boot, 4))
+    for start in range(0, n_boot, batch_size):
+        n_batch = min(batch_size, n_boot - start)
+        counts = rng.multinomial(n_subjects, np.full(n_subjects, 1 / n_subjects),
+            size=n_batch).astype(np.double)
+
+        identified = (((counts > 0) @ competitors.T) == 0)
+        weighted_sums = counts @ similar_matrix.T #Sum of the drawn columns, for every row
+
+        si_boot = counts @ diag / n_subjects
+        oi_boot = (counts * (weighted_sums - diag[None, :])).sum(axis=1)\
+            / (n_subjects * (n_subjects - 1))
+        boot[start:start + n_batch] = np.column_stack([
+            (counts * identified).sum(axis=1) / n_subjects, si_boot, oi_boot, si_boot - oi_boot])
+
+    observed_si = diag.mean()
+    observed_oi = _oi_calculator(similar_matrix).mean()
+    boot[:, 1:3] *= sign
+    bounds = np.quantile(boot, [(1 - ci) / 2, (1 + ci) / 2], axis=0)
+
+    return pd.DataFrame(data={
+        "metric": [f"fia_{name}", f"si_{name}", f"oi_{name}", f"di_{name}"],
+        "observed": [_fia_calculator(similar_matrix).mean(), sign * observed_si,
+            sign * observed_oi, observed_si - observed_oi],
+        "ci_low": bounds[0],
+        "ci_high": bounds[1]})\
+            .set_index("metric")
+
+def fp_permutation_test(similar_matrix, n_perm=1000, batch_size=100, n_jobs=1, seed=None,
+    greater_is_better=True):
+    """Function testing whether the group-level fingerprint metrics are higher than expected
+    by chance. The null distributions are built by shuffling which participant of the second
+    session is the correct match of each participant of the first session (i.e., the columns
+    of the similarity matrix).
+
+    Shuffling the columns doesn't change which column is the best match of a row, nor the sum of
+    a row, so these are computed once. Each permutation then only needs to gather one value per
+    row, which is done for a batch of permutations at once.
+
+    Parameters
+    ----------
+    similar_matrix : numpy.array
+        Similarity matrix from `fingerprint_mats` or `fingerprint_tabs`.
+    n_perm : int, optional
+        Number of permutations, by default 1000
+    batch_size : int, optional
+        Number of permutations computed at once, by default 100
+    n_jobs : int, optional
+        Number of processes sharing the permutations. Use -1 to use all the CPUs, by default 1
+    seed : int, optional
+        Seed of the random number generator, for reproducibility, by default None
+    greater_is_better : bool, optional
+        Whether the best match is the highest value (similarity) or the lowest (distance). For
+        a distance, the SI and OI are tested for being lower than expected by chance and the
+        DI is OI - SI, by default True
+
+    Returns
+    -------
+    pandas.DataFrame, pandas.DataFrame
+        Returns a dataframe with the null distribution of each metric (one row per permutation)
+        and a dataframe with the observed value of each metric and its p-value (proportion of
+        permutations with a value at least as high as the observed one).
+    """
+    #Distances are negated so the best match is the highest value (see `_bootstrap_metrics`)
+    sign = 1 if greater_is_better is True else -1
+    similar_matrix = sign * np.asarray(similar_matrix)
+    row_argmax = np.argmax(similar_matrix, axis=1)
+    row_sums = similar_matrix.sum(axis=1)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    #Each process gets its own share of the permutations and its own random generator
+    seeds = np.random.SeedSequence(seed).spawn(n_jobs)
+    shares = [n_perm // n_jobs + (i < n_perm % n_jobs) for i in range(n_jobs)]
+
+    if n_jobs == 1:
+        null_dist = _permutation_batch(similar_matrix, row_argmax, row_sums, n_perm, batch_size,
+            seeds[0])
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            null_dist = np.concatenate(list(executor.map(_permutation_batch,
+                [similar_matrix] * n_jobs, [row_argmax] * n_jobs, [row_sums] * n_jobs, shares,
+                [batch_size] * n_jobs, seeds)))
+
+    metrics = ["fia", "si", "oi", "di"]
+    null_dist = pd.DataFrame(data=null_dist, columns=metrics)
+    observed = _permutation_metrics(similar_matrix, row_argmax, row_sums,
+        np.arange(len(similar_matrix))[None, :])[0]
+
+    p_value = (1 + (null_dist.values >= observed).sum(axis=0)) / (1 + n_perm)
+    null_dist[["si", "oi"]] *= sign
+    observed[1:3] *= sign
+
+    p_values = pd.DataFrame(data={
+        "metric": metrics,
+        "observed": observed,
+        "p_value": p_value})\
+            .set_index("metric")
+
+    return null_dist, p_values
+
+def _permutation_metrics(similar_matrix, row_argmax, row_sums, perms):
+    """Internal function computing the group-level metrics (FIA, SI, OI and DI) for a batch of
+    permutations of the correct matches.
+
+    Parameters
+    ----------
+    similar_matrix : numpy.array
+        Similarity matrix.
+    row_argmax : numpy.array
+        Column of the best match of every row.
+    row_sums : numpy.array
+        Sum of every row.
+    perms : numpy.array
+        Array of shape (permutations, participants) where `perms[p, i]` is the column of the
+        correct match of participant `i` in permutation `p`.
+
+    Returns
+    -------
+    numpy.array
+        Array of shape (permutations, 4) with the average FIA, SI, OI and DI of every permutation.
+    """
+    n_subjects = len(row_sums)
+    si_perm = similar_matrix[np.arange(n_subjects)[None, :], perms]
+    oi_perm = (row_sums[None, :] - si_perm) / (n_subjects - 1)
+
+    return np.column_stack([
+        (row_argmax[None, :] == perms).mean(axis=1),
+        si_perm.mean(axis=1),
+        oi_perm.mean(axis=1),
+        (si_perm - oi_perm).mean(axis=1)])
+
+def _permutation_batch(similar_matrix, row_argmax, row_sums, n_perm, batch_size, seed):
+    """Internal function computing the null distributions of the group-level metrics for
+    `n_perm` permutations, `batch_size` permutations at a time. This is the unit of work sent to
+    the processes.
+
+    Parameters
+    ----------
+    similar_matrix : numpy.array
+        Similarity matrix.
+    row_argmax : numpy.array
+        Column of the best match of every row.
+    row_sums : numpy.array
+        Sum of every row.
+    n_perm : int
+        Number of permutations.
+    batch_size : int
+        Number of permutations computed at once.
+    seed : numpy.random.SeedSequence
+        Seed of the random number generator.
+
+    Returns
+    -------
+    numpy.array
+        Array of shape (n_perm, 4) with the average FIA, SI, OI and DI of every permutation.
+    """
+    rng = np.random.default_rng(seed)
+    null_dist = np.empty((n_perm, 4))
+
+    for start in range(0, n_perm, batch_size):
+        n_batch = min(batch_size, n_perm - start)
+        perms = rng.permuted(np.tile(np.arange(len(row_sums)), (n_batch, 1)), axis=1)
+        null_dist[start:start + n_batch] = _permutation_metrics(similar_matrix, row_argmax,
+            row_sums, perms)
+
+    return null_dist
+
 ##### Utility functions
 
-def _fia_calculator(similar_matrix):
+def _fia_calculator(similar_matrix, block_size=1024, greater_is_better=True):
     """Internal function computing the fingerprint identification accuracy,
-    (number of correct identifications).
+    (number of correct identifications). The rows of the similarity matrix are processed by
+    blocks, so it also works on memory-mapped matrices.
 
     Parameters
     -------
     similar_matrix : numpy.array
         Similarity matrix
+    block_size : int, optional
+        Number of rows processed at once, by default 1024
+    greater_is_better : bool, optional
+        Whether the best match is the highest value (similarity) or the lowest (distance), by
+        default True
 
     Returns
     -------
@@ -657,16 +3667,87 @@ def _fia_calculator(similar_matrix):
 
     fia_coef = np.empty(shape=len(similar_matrix))
 
-    #For every row in the similarity matrix, if the maximum is achieved at the diagonal,
-    # attribute a 1, otherwise a 0.
-    for i in range(0, len(similar_matrix)):
-        if np.argmax(similar_matrix[i, :]) == i:
-            fia_coef[i] = 1
-        else:
-            fia_coef[i] = 0
+    #For every row in the similarity matrix, if the maximum (minimum for a distance) is
+    # achieved at the diagonal, attribute a 1, otherwise a 0.
+    best_match = np.argmax if greater_is_better is True else np.argmin
+    for start in range(0, len(similar_matrix), block_size):
+        block = np.asarray(similar_matrix[start:start + block_size])
+        rows = np.arange(start, start + len(block))
+        fia_coef[rows] = best_match(block, axis=1) == rows
 
     return fia_coef
 
+def _rank_calculator(similar_matrix, block_size=1024, greater_is_better=True):
+    """Internal function computing the rank of the correct match (the diagonal) within each row
+    of the similarity matrix. A rank of 1 is a correct identification. Ties are broken like
+    `numpy.argmax` (the first column wins), so a rank of 1 always matches the identification
+    accuracy. The rows are processed by blocks without a Python loop over the participants.
+
+    Parameters
+    -------
+    similar_matrix : numpy.array
+        Similarity matrix
+    block_size : int, optional
+        Number of rows processed at once, by default 1024
+    greater_is_better : bool, optional
+        Whether the best match is the highest value (similarity) or the lowest (distance), by
+        default True
+
+    Returns
+    -------
+    numpy.array
+        Returns an array containing the rank of the correct match of every participant.
+    """
+    rank = np.empty(shape=len(similar_matrix), dtype=int)
+    cols = np.arange(np.shape(similar_matrix)[1])
+
+    for start in range(0, len(similar_matrix), block_size):
+        block = np.asarray(similar_matrix[start:start + block_size])
+        rows = np.arange(start, start + len(block))
+        diag = block[np.arange(len(block)), rows][:, None]
+        #Count the participants matching better than the participant themselves
+        better = (block > diag) if greater_is_better is True else (block < diag)
+        better |= (block == diag) & (cols[None, :] < rows[:, None])
+        rank[rows] = better.sum(axis=1) + 1
+
+    return rank
+
+def _rank_metrics(similar_matrix, name, top_k, greater_is_better=True, rank=None):
+    """Internal function computing the rank-based identification metrics: the rank of the
+    correct match, its percentile rank and whether the correct match is within the top-k.
+
+    Parameters
+    ----------
+    similar_matrix : numpy.array
+        Similarity matrix
+    name : str
+        String to add to the variables.
+    top_k : int or list of int
+        Numbers of best matches within which an identification is considered correct.
+    greater_is_better : bool, optional
+        Whether the best match is the highest value (similarity) or the lowest (distance), by
+        default True
+    rank : numpy.array, optional
+        Rank of the correct match, if already computed (e.g., by `_stream_reductions`, the
+        similarity matrix is then not used), by default None
+
+    Returns
+    -------
+    dict
+        Returns a dictionary of the metrics, with the names of the columns as keys.
+    """
+    if rank is None:
+        rank = _rank_calculator(similar_matrix, greater_is_better=greater_is_better)
+    n_others = len(rank) - 1
+
+    #The percentile rank is the proportion of the other participants matched worse than the
+    # participant themselves (1 is a perfect identification)
+    metrics = {f"rank_{name}": rank, f"prank_{name}": (n_others - (rank - 1)) / n_others}
+    for k in np.atleast_1d(top_k):
+        metrics[f"top{k}_{name}"] = (rank <= k).astype(float)
+
+    return metrics
+
 def _si_calculator(similar_matrix):
     """Internal function computing the self-identifiability (within-individual correlation).
     This is defined as the diagonal (within-individual correlations) of the similarity matrix.
@@ -685,7 +3766,7 @@ def _si_calculator(similar_matrix):
 
     return si_coef
 
-def _oi_calculator(similar_matrix):
+def _oi_calculator(similar_matrix, block_size=1024):
     """Internal function computing the others-identifiability (between-individual correlation).
     This is defined as the average of the off-diagonal elements (row-wise) of the similarity
     matrix.
@@ -694,13 +3775,17 @@ def _oi_calculator(similar_matrix):
     -------
     similar_matrix : numpy.array
         Similarity matrix
+    block_size : int, optional
+        Number of rows processed at once, by default 1024
 
     Returns
     -------
     numpy.array
         Returns an array containing the others-identifiability.
     """
-    oi_coef = (similar_matrix.sum(1)-np.diag(similar_matrix))\
+    row_sums = np.concatenate([np.asarray(similar_matrix[start:start + block_size]).sum(1)
+        for start in range(0, len(similar_matrix), block_size)])
+    oi_coef = (row_sums-np.diag(similar_matrix))\
     /(similar_matrix.shape[1]-1)
 
     return oi_coef
@@ -3,6 +3,9 @@ import math
 import numpy as np
 import pandas as pd
 import pytest
+from scipy import stats
+from scipy.io import savemat
+from scipy.spatial.distance import cdist
 
 from sihnpy import fingerprinting as s_fp
 from sihnpy import datasets
@@ -51,6 +54,30 @@ def test_fetch_matrix_file_names():
         fp_object.path_m2 = "i/mean/im/not/even/trying"
         fp_object.fetch_matrix_file_names()
 
+def test_iter_matrix_files(tmp_path):
+    """ Testing the discovery of files in nested (BIDS-like) folders.
+    """
+    for sub in ["sub-01", "sub-02"]:
+        for ses in ["ses-1", "ses-2"]:
+            os.makedirs(tmp_path / sub / ses)
+            (tmp_path / sub / ses / f"{sub}_{ses}_matrix.txt").write_text("1")
+            (tmp_path / sub / ses / f"{sub}_{ses}_timeseries.tsv").write_text("1")
+    (tmp_path / "flat_matrix.txt").write_text("1")
+
+    assert list(s_fp.iter_matrix_files(str(tmp_path))) == ["flat_matrix.txt"], "Only files \
+        directly in the folder should be listed by default"
+    assert sorted(s_fp.iter_matrix_files(str(tmp_path), pattern="sub-*/ses-1/*.txt")) == [
+        "sub-01/ses-1/sub-01_ses-1_matrix.txt", "sub-02/ses-1/sub-02_ses-1_matrix.txt"], "\
+        Pattern with folders is not matched properly"
+    assert len(list(s_fp.iter_matrix_files(str(tmp_path), pattern="*.txt", recursive=True)))\
+        == 5, "Recursive search should find the files in all the folders"
+
+    fp_object = s_fp.FingerprintMats(id_ls=["01", "02"], path_m1=str(tmp_path),
+        path_m2=str(tmp_path))
+    files_m1, _ = fp_object.fetch_matrix_file_names(pattern="sub-*/ses-1/*_matrix.txt")
+    sub_final, final_m1, _ = fp_object.subject_selection(files_m1, files_m1, verbose=False)
+    assert sub_final == ["01", "02"], "Subjects should be matched on the relative paths"
+
 def test_subject_selection():
     """ Testing the subject_selection method of the FingerprintMats class
     """
@@ -106,6 +133,40 @@ def test_subject_selection_error_raising():
         fp_object.subject_selection(files_m1=files_m1,
             files_m2=files_m2)
 
+def test_subject_selection_collisions():
+    """ Testing that IDs contained in other IDs are reported, and that a pattern can be used
+    to extract the IDs from the file names.
+    """
+    id_ls = ["674", "6745", "12"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls, path_m1="", path_m2="")
+    files = ["sub-674_rest.txt", "sub-6745_rest.txt", "sub-12_rest.txt"]
+
+    file_index, collisions = s_fp._match_files(id_ls, files)
+    assert file_index["674"] == ["sub-674_rest.txt", "sub-6745_rest.txt"], "Substring matching \
+        should be kept by default"
+    assert collisions == {"sub-6745_rest.txt": ["674", "6745"]}, "Collision is not reported"
+
+    with pytest.raises(SystemExit, match="sub-6745_rest.txt"):
+        fp_object.subject_selection(files_m1=files, files_m2=files, verbose=False)
+
+    sub_final, final_m1, _ = fp_object.subject_selection(files_m1=files, files_m2=files,
+        verbose=False, pattern=r"sub-(?P<id>\d+)_")
+    assert sub_final == ["12", "674", "6745"], "Pattern didn't extract the right IDs"
+    assert final_m1 == ["sub-12_rest.txt", "sub-674_rest.txt", "sub-6745_rest.txt"], "Files are \
+        not matched to the right IDs"
+
+    #6745 is only in modality 1, but its file would still be attributed to 674
+    id_ls = ["674", "6745", "100"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls, path_m1="", path_m2="")
+    with pytest.raises(SystemExit, match="6745.txt"):
+        fp_object.subject_selection(files_m1=["100.txt", "6745.txt", "674.txt"],
+            files_m2=["100.txt", "674.txt"], verbose=False)
+
+    #A participant matched to more than one file
+    with pytest.raises(SystemExit, match="more than one file"):
+        fp_object.subject_selection(files_m1=["100.txt", "100_run2.txt"],
+            files_m2=["100.txt"], verbose=False)
+
 def test_fingerprint_mats_nodes_within():
     """ Testing the fingerprint_mats function, using "within-network" edges. 
     """
@@ -128,6 +189,520 @@ def test_fingerprint_mats_nodes_within():
 
     assert round(similar_matrix[0,0], 1) == pytest.approx(1.0), "Self-identifiability in the matrix should be near perfect (1)."
 
+def test_load_matrix_cache(tmp_path, monkeypatch):
+    """ Testing that the binary cache of the matrices is created, reused and refreshed.
+    """
+    matrix_path = tmp_path / "mat_01a.txt"
+    matrix_path.write_text(open("tests/test_data/fingerprinting/matrices_mod1/mat_01a.txt").read())
+    cache_dir = tmp_path / "cache"
+
+    matrix_file = s_fp._load_matrix(str(matrix_path), cache_dir=str(cache_dir))
+    assert len(os.listdir(cache_dir)) == 1, "The matrix was not stored in the cache"
+
+    #Second import shouldn't parse the text file
+    def fail_parse(matrix_path):
+        raise AssertionError("Text file was parsed again")
+    monkeypatch.setattr(s_fp, "_read_text_matrix", fail_parse)
+
+    cached_matrix = s_fp._load_matrix(str(matrix_path), cache_dir=str(cache_dir))
+    assert isinstance(cached_matrix, np.memmap), "Cached matrix should be memory-mapped"
+    assert np.array_equal(cached_matrix, matrix_file), "Cached matrix doesn't match the text file"
+
+    #Modifying the file changes the key of the cache
+    monkeypatch.undo()
+    np.savetxt(matrix_path, np.eye(3))
+    os.utime(matrix_path, ns=(0, 0))
+    assert np.array_equal(s_fp._load_matrix(str(matrix_path), cache_dir=str(cache_dir)),
+        np.eye(3)), "Modified file should not reuse the outdated cache"
+
+def test_load_matrix_formats(tmp_path):
+    """ Testing that the format of the matrix files is detected and read by the right reader.
+    """
+    matrix = np.loadtxt("tests/test_data/fingerprinting/matrices_mod1/mat_01a.txt")
+    np.savetxt(tmp_path / "mat.csv", matrix, delimiter=",")
+    np.savetxt(tmp_path / "mat.txt", matrix, delimiter="\t")
+    np.savetxt(tmp_path / "mat_space", matrix)
+    np.save(tmp_path / "mat.npy", matrix)
+    os.rename(tmp_path / "mat.npy", tmp_path / "mat_npy") #No extension, sniffed from the bytes
+    np.savez(tmp_path / "mat.npz", matrix)
+    s_fp.sparse.save_npz(tmp_path / "mat_sparse.npz", s_fp.sparse.csr_matrix(matrix))
+    savemat(tmp_path / "mat.mat", {"connectivity": matrix})
+    #Trailing tabs and comments (with a comma) before the data
+    np.savetxt(tmp_path / "mat_trailing.tsv", np.hstack([matrix, np.full((100, 1), np.nan)]),
+        delimiter="\t")
+    with open(tmp_path / "mat_trailing.tsv") as file:
+        content = file.read().replace("\tnan", "\t")
+    with open(tmp_path / "mat_trailing.tsv", "w") as file:
+        file.write(content)
+    np.savetxt(tmp_path / "mat_comment.txt", matrix, header="Nodes: 1, 2, ...\n")
+
+    expected_formats = {"mat.csv": "csv", "mat.txt": "whitespace", "mat_space": "whitespace",
+        "mat_npy": "npy", "mat.npz": "npz", "mat_sparse.npz": "npz", "mat.mat": "mat",
+        "mat_trailing.tsv": "whitespace", "mat_comment.txt": "whitespace"}
+    for filename, file_format in expected_formats.items():
+        assert s_fp._detect_format(str(tmp_path / filename)) == file_format, f"Format of \
+            {filename} is not detected"
+        matrix_file = s_fp._load_matrix(str(tmp_path / filename))
+        if s_fp.sparse.issparse(matrix_file):
+            matrix_file = matrix_file.toarray()
+        assert np.allclose(matrix_file, matrix), f"{filename} is not read properly"
+
+def test_edge_plan(tmp_path):
+    """ Testing that the edge-selection plan extracts the same edges as slicing the sub-matrix,
+    including from a memory-mapped matrix.
+    """
+    matrix = np.random.default_rng(5).normal(size=(30, 30))
+    np.save(tmp_path / "mat.npy", matrix)
+    node_sets = [([7, 3, 12, 4], None), ([20, 21, 22], [1, 5, 9]), ([2, 29], [29, 2])]
+    plan = s_fp._compile_edge_plan(node_sets)
+
+    assert plan["rows"].tolist() == [2, 3, 4, 7, 12, 20, 21, 22, 29], "Wrong rows to read"
+    for matrix_file in [matrix, np.load(tmp_path / "mat.npy", mmap_mode='r')]:
+        for (nodes_within, nodes_between), r_flat in zip(node_sets,
+            s_fp._apply_edge_plan(matrix_file, plan)):
+            if nodes_between:
+                expected = matrix[nodes_within][:, nodes_between].flatten()
+            else:
+                submatrix = matrix[nodes_within][:, nodes_within]
+                expected = submatrix[np.triu_indices(len(submatrix), k=1)]
+            assert np.array_equal(r_flat, expected), "Edges don't match the sliced sub-matrix"
+
+def test_extract_features(monkeypatch):
+    """ Testing that the _extract_features method imports every matrix only once.
+    """
+    id_ls = ["01a", "02a", "03a", "04a", "05a", "06a", "07a", "08a", "09a", "10a"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls,
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+
+    fp_object.sub_final = ["01a", "03a", "04a", "05a"]
+    fp_object.final_m1 = ['mat_01a.txt', 'mat_03a.txt', 'mat_04a.txt', 'mat_05a.txt']
+    fp_object.final_m2 = ['mat_01a.txt', 'mat_03a.txt', 'mat_04a.txt', 'mat_05a.txt']
+
+    #Count the number of times the files are imported
+    calls = []
+    load_matrix = s_fp._load_matrix
+    monkeypatch.setattr(s_fp, "_load_matrix",
+        lambda matrix_path, *args: calls.append(matrix_path) or load_matrix(matrix_path))
+
+    features = fp_object._extract_features(2, [(list(range(0, 10)), None)])[0]
+
+    assert features.shape == (4, 45), "Feature array is not the right shape (should be 4x45)"
+    assert len(calls) == len(set(calls)) == 4, "Every matrix should be imported once"
+    assert np.allclose(features[1], s_fp._norm_data(s_fp._slice_matrix(fp_object._import_matrix(2, 1),
+        list(range(0, 10))))), "Features don't match the sliced and normalized matrix"
+
+    #Parallel import gives the same features, in the same order
+    monkeypatch.undo()
+    for backend in ["threads", "processes"]:
+        features_parallel = fp_object._extract_features(2, [(list(range(0, 10)), None)],
+            n_jobs=2, backend=backend)[0]
+        assert np.array_equal(features, features_parallel), f"Features differ with {backend}"
+
+    with pytest.raises(SystemExit):
+        fp_object._extract_features(2, [(list(range(0, 10)), None)], n_jobs=2,
+            backend="not a backend")
+
+def test_similarity_matrix():
+    """ Testing that the vectorized similarity matrix matches the pairwise Pearson correlations,
+    with and without missing values.
+    """
+    rng = np.random.default_rng(42)
+    features_1 = rng.normal(size=(6, 30))
+    features_2 = features_1 + rng.normal(scale=0.5, size=(6, 30))
+
+    similar_matrix = s_fp._similarity_matrix(features_1, features_2, block_size=4)
+    expected = np.array([[stats.pearsonr(row_1, row_2)[0] for row_2 in features_2]
+        for row_1 in features_1])
+
+    assert np.allclose(similar_matrix, expected), "Similarity matrix doesn't match Scipy's Pearson"
+
+    #Missing values are dropped pair by pair
+    features_1[0, 3] = np.nan
+    features_2[2, 5] = np.nan
+    similar_matrix = s_fp._similarity_matrix(features_1, features_2)
+    keep = ~np.isnan(features_1[0]) & ~np.isnan(features_2[2])
+
+    assert similar_matrix[0, 2] == pytest.approx(stats.pearsonr(features_1[0, keep],
+        features_2[2, keep])[0]), "Missing values are not handled pairwise"
+
+    with pytest.raises(SystemExit):
+        s_fp._similarity_matrix(features_1, features_2, corr_type="Not a correlation")
+
+def test_fingerprint_mats_tiled(tmp_path):
+    """ Testing the out-of-core computation of the similarity matrix: memory-mapped features and
+    output, tiles bounded by a memory budget and single precision.
+    """
+    id_ls = ["01a", "02a", "03a", "04a", "05a", "06a", "07a", "08a", "09a", "10a"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls,
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_object.subject_selection(*fp_object.fetch_matrix_file_names(), verbose=False)
+
+    nodes_index_within = list(range(0, 100))
+    similar_matrix = fp_object.fingerprint_mats(nodes_index_within=nodes_index_within,
+        verbose=False)
+    #A budget this small forces tiles of a few participants
+    block_size = s_fp._block_size_from_memory(4950, 4, 100000)
+    similar_matrix_tiled = fp_object.fingerprint_mats(nodes_index_within=nodes_index_within,
+        verbose=False, memory_limit=100000, dtype=np.float32, memmap_dir=str(tmp_path))
+
+    assert 1 <= block_size < len(fp_object.sub_final), "Tiles should hold a few participants"
+    assert isinstance(similar_matrix_tiled, np.memmap), "Similarity matrix should be a memory-map"
+    assert similar_matrix_tiled.dtype == np.float32, "Similarity matrix should be single precision"
+    assert len(list(tmp_path.glob("features_m1_*.npy"))) == 1, "Features should be stored on \
+        the disk"
+    assert np.allclose(similar_matrix, similar_matrix_tiled, atol=1e-5), "Tiled computation \
+        doesn't match the in-memory computation"
+    assert np.array_equal(similar_matrix_tiled, similar_matrix_tiled.T), "Similarity matrix \
+        should be symmetric"
+
+    #A second run in the same directory doesn't overwrite the first one
+    first_run = np.array(similar_matrix_tiled)
+    fp_object.fingerprint_mats(nodes_index_within=list(range(50, 100)), verbose=False,
+        dtype=np.float32, memmap_dir=str(tmp_path))
+    assert np.array_equal(similar_matrix_tiled, first_run), "The first run was overwritten"
+
+def test_fingerprint_mats_batch(monkeypatch):
+    """ Testing the fingerprinting of many sets of nodes in one pass.
+    """
+    id_ls = ["01a", "02a", "03a", "04a", "05a", "06a", "07a", "08a", "09a", "10a"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls,
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_object.subject_selection(*fp_object.fetch_matrix_file_names(), verbose=False)
+
+    node_sets = {"net1": list(range(0, 50)), "net2": list(range(50, 100)),
+        "net1_net2": (list(range(0, 50)), list(range(50, 100)))}
+
+    calls = []
+    load_matrix = s_fp._load_matrix
+    monkeypatch.setattr(s_fp, "_load_matrix",
+        lambda matrix_path, *args: calls.append(matrix_path) or load_matrix(matrix_path))
+    similar_matrices, coef_data = fp_object.fingerprint_mats_batch(node_sets, verbose=False)
+    monkeypatch.undo()
+
+    assert len(calls) == 16, "Every matrix should be imported once for all the sets of nodes"
+    assert list(similar_matrices.keys()) == list(node_sets.keys()), "Missing sets of nodes"
+    assert list(coef_data["net1_net2"].columns) == ["si_net1_net2", "oi_net1_net2",
+        "fia_net1_net2", "di_net1_net2"], "Metrics are not named after the set of nodes"
+
+    for name, nodes in [("net2", (list(range(50, 100)), None)),
+        ("net1_net2", (list(range(0, 50)), list(range(50, 100))))]:
+        expected = fp_object.fingerprint_mats(*nodes, verbose=False)
+        assert np.allclose(similar_matrices[name], expected), f"{name} doesn't match \
+            fingerprint_mats"
+
+    #A within-network set can be a tuple of nodes, and malformed sets are reported
+    assert s_fp._parse_node_set("net", (0, 1, 2, 3, 4)) == ((0, 1, 2, 3, 4), None), "A tuple \
+        of nodes is a within-network set"
+    assert s_fp._parse_node_set("net", (0, 1)) == ((0, 1), None), "A tuple of two nodes is a \
+        within-network set"
+    with pytest.raises(SystemExit, match="net"):
+        fp_object.fingerprint_mats_batch({"net": ([0, 1], [2, 3], [4, 5])}, verbose=False)
+
+def test_fingerprint_update(tmp_path):
+    """ Testing that adding participants to a previous fingerprinting gives the same result
+    as fingerprinting the whole cohort.
+    """
+    id_ls = ["01a", "03a", "04a", "05a", "06a", "07a", "09a", "10a"]
+    nodes_index_within = list(range(0, 100))
+
+    fp_full = s_fp.FingerprintMats(id_ls=id_ls,
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_full.subject_selection(*fp_full.fetch_matrix_file_names(), verbose=False)
+    similar_full = fp_full.fingerprint_mats(nodes_index_within, verbose=False)
+
+    #Fingerprint part of the cohort, save it, and add the rest in a new session
+    fp_part = s_fp.FingerprintMats(id_ls=["03a", "05a", "07a", "09a"],
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_part.subject_selection(*fp_part.fetch_matrix_file_names(), verbose=False)
+    #Nodes given as a numpy index array can be saved with the state
+    fp_part.fingerprint_mats(np.arange(0, 100), verbose=False)
+    fp_part.fp_state_export(str(tmp_path / "state.npz"))
+
+    fp_new = s_fp.FingerprintMats(id_ls=[],
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_new.fp_state_import(str(tmp_path / "state.npz"))
+    similar_matrix, coef_data = fp_new.fingerprint_update(id_ls, name="test", verbose=False)
+
+    assert fp_new.sub_final == fp_full.sub_final, "Participants are not sorted like a full run"
+    assert np.allclose(similar_matrix, similar_full), "Updated similarity matrix doesn't match \
+        the full computation"
+    assert np.allclose(fp_new.features_m2, fp_full.features_m2), "Features are not updated"
+    assert coef_data.index.tolist() == fp_full.sub_final, "Metrics are not refreshed"
+
+    same_matrix, _ = fp_new.fingerprint_update(["03a", "05a"], name="test", verbose=False)
+    assert np.array_equal(same_matrix, similar_matrix), "Nothing should change without new \
+        participants"
+
+    #Nested folders and IDs contained in other IDs: the update matches the files the same way
+    ids = {"674": "01a", "6745": "03a", "12": "04a", "125": "05a"}
+    for mod in ["matrices_mod1", "matrices_mod2"]:
+        for subject, source in ids.items():
+            (tmp_path / mod / f"sub-{subject}").mkdir(parents=True)
+            matrix = np.loadtxt(f"tests/test_data/fingerprinting/{mod}/mat_{source}.txt")
+            np.savetxt(tmp_path / mod / f"sub-{subject}" / f"sub-{subject}_conn.txt", matrix)
+    selection = {"pattern": "sub-*/*_conn.txt"}
+    id_pattern = r"sub-(?P<id>\d+)_conn"
+
+    fp_full = s_fp.FingerprintMats(id_ls=list(ids), path_m1=str(tmp_path / "matrices_mod1"),
+        path_m2=str(tmp_path / "matrices_mod2"))
+    fp_full.subject_selection(*fp_full.fetch_matrix_file_names(**selection), verbose=False,
+        pattern=id_pattern)
+    similar_full = fp_full.fingerprint_mats(nodes_index_within, verbose=False)
+
+    fp_part = s_fp.FingerprintMats(id_ls=["6745", "12"], path_m1=str(tmp_path / "matrices_mod1"),
+        path_m2=str(tmp_path / "matrices_mod2"))
+    fp_part.subject_selection(*fp_part.fetch_matrix_file_names(**selection), verbose=False,
+        pattern=id_pattern)
+    fp_part.fingerprint_mats(nodes_index_within, verbose=False)
+    similar_matrix, _ = fp_part.fingerprint_update(["674", "125"], name="test", verbose=False)
+    assert fp_part.sub_final == fp_full.sub_final, "Participants are not matched like a full run"
+    assert np.allclose(similar_matrix, similar_full), "Updated similarity matrix doesn't match \
+        the full computation"
+
+def test_fingerprint_mats_sparse(tmp_path):
+    """ Testing that thresholded matrices saved as sparse files give the same fingerprinting
+    as the same matrices stored as dense text files.
+    """
+    id_ls = ["01a", "03a", "04a", "05a", "06a", "07a", "09a", "10a"]
+    nodes_index_within = list(range(0, 60))
+    nodes_index_between = list(range(60, 100))
+
+    for mod in ["matrices_mod1", "matrices_mod2"]:
+        (tmp_path / "dense" / mod).mkdir(parents=True)
+        (tmp_path / "sparse" / mod).mkdir(parents=True)
+        for filename in os.listdir(f"tests/test_data/fingerprinting/{mod}"):
+            matrix = np.loadtxt(f"tests/test_data/fingerprinting/{mod}/{filename}")
+            matrix[np.abs(matrix) < 0.3] = 0 #Thresholding leaves most of the edges at 0
+            np.savetxt(tmp_path / "dense" / mod / filename, matrix)
+            s_fp.sparse.save_npz(tmp_path / "sparse" / mod / f"{filename}.npz",
+                s_fp.sparse.csr_matrix(matrix))
+
+    for nodes_between in [None, nodes_index_between]:
+        fp_dense = s_fp.FingerprintMats(id_ls=id_ls, path_m1=str(tmp_path / "dense/matrices_mod1"),
+            path_m2=str(tmp_path / "dense/matrices_mod2"))
+        fp_dense.subject_selection(*fp_dense.fetch_matrix_file_names(), verbose=False)
+        similar_dense = fp_dense.fingerprint_mats(nodes_index_within, nodes_between,
+            verbose=False)
+
+        fp_sparse = s_fp.FingerprintMats(id_ls=id_ls, path_m1=str(tmp_path / "sparse/matrices_mod1"),
+            path_m2=str(tmp_path / "sparse/matrices_mod2"))
+        fp_sparse.subject_selection(*fp_sparse.fetch_matrix_file_names(), verbose=False)
+        similar_sparse = fp_sparse.fingerprint_mats(nodes_index_within, nodes_between,
+            verbose=False, block_size=3)
+
+        assert s_fp.sparse.issparse(fp_sparse.features_m1), "Sparse features are densified"
+        assert np.allclose(fp_sparse.features_m1.toarray(), fp_dense.features_m1), "Sparse \
+            slicing doesn't match the dense slicing"
+        assert np.allclose(similar_sparse, similar_dense), "Sparse similarity doesn't match \
+            the dense similarity"
+
+    #Dense text files can also be converted to sparse matrices at import
+    fp_convert = s_fp.FingerprintMats(id_ls=id_ls, path_m1=str(tmp_path / "dense/matrices_mod1"),
+        path_m2=str(tmp_path / "dense/matrices_mod2"), as_sparse=True)
+    fp_convert.subject_selection(*fp_convert.fetch_matrix_file_names(), verbose=False)
+    assert np.allclose(fp_convert.fingerprint_mats(nodes_index_within, nodes_index_between,
+        verbose=False, corr_type="Spearman"), fp_dense.fingerprint_mats(nodes_index_within,
+        nodes_index_between, verbose=False, corr_type="Spearman")), "Rank-based similarity of \
+        sparse features doesn't match"
+
+def test_fingerprint_multi():
+    """ Testing that fingerprinting several sessions at once gives the same results as
+    fingerprinting each pair of sessions separately.
+    """
+    participants, _, paths = datasets.pad_fp_input()
+    id_ls = participants["participant_id"].tolist()
+    nodes_index_within = list(range(0, 50))
+    sessions = {"BL00": {"rest_run1": paths["BL00"]["rest_run1"],
+        "encoding": paths["BL00"]["encoding"]}, "FU12": {"rest_run1": paths["FU12"]["rest_run1"]}}
+
+    fp_multi = s_fp.FingerprintMulti(id_ls=id_ls, paths=sessions)
+    assert list(fp_multi.paths) == ["BL00_rest_run1", "BL00_encoding", "FU12_rest_run1"], "\
+        Nested paths are not flattened"
+    fp_multi.subject_selection(verbose=False)
+    similar_matrices, coef_data = fp_multi.fingerprint_multi(nodes_index_within, verbose=False)
+
+    assert len(similar_matrices) == 3, "Every pair of sessions should be fingerprinted"
+    for (session_1, session_2), similar_matrix in similar_matrices.items():
+        fp_pair = s_fp.FingerprintMats(id_ls=id_ls, path_m1=fp_multi.paths[session_1],
+            path_m2=fp_multi.paths[session_2])
+        fp_pair.subject_selection(*fp_pair.fetch_matrix_file_names(), verbose=False)
+        similar_pair = fp_pair.fingerprint_mats(nodes_index_within, verbose=False)
+
+        assert np.allclose(similar_matrix, similar_pair), f"Similarity of {session_1} and \
+            {session_2} doesn't match FingerprintMats"
+        assert coef_data[(session_1, session_2)].index.tolist() == fp_pair.sub_final, "\
+            Participants of the pair are not the ones with both sessions"
+
+    with pytest.raises(SystemExit):
+        fp_multi.fingerprint_multi(nodes_index_within, pairs=[("BL00_rest_run1", "FU24")],
+            verbose=False)
+
+def test_fingerprint_mats_timeseries(tmp_path):
+    """ Testing that computing the connectivity from time series during the import gives the
+    same fingerprinting as importing the connectivity matrices.
+    """
+    rng = np.random.default_rng(4)
+    mixing = rng.normal(size=(20, 20)) #Shared structure so the nodes are correlated
+    id_ls = [f"{i:02d}" for i in range(1, 7)]
+    nodes_index_within = list(range(2, 12))
+    nodes_index_between = list(range(12, 20))
+
+    for kind in ["correlation", "partial correlation"]:
+        for mod in ["ts_mod1", "ts_mod2", f"{kind}_mod1", f"{kind}_mod2"]:
+            (tmp_path / mod).mkdir(exist_ok=True)
+        for subject in id_ls:
+            for mod in ["mod1", "mod2"]:
+                timeseries = rng.normal(size=(80, 20)) @ mixing
+                np.savetxt(tmp_path / f"ts_{mod}" / f"sub-{subject}.txt", timeseries)
+                conn_matrix = np.corrcoef(timeseries, rowvar=False)
+                if kind == "partial correlation":
+                    precision = np.linalg.inv(conn_matrix)
+                    conn_matrix = -precision / np.sqrt(np.outer(np.diag(precision),
+                        np.diag(precision)))
+                np.savetxt(tmp_path / f"{kind}_{mod}" / f"sub-{subject}.txt", conn_matrix)
+
+        for nodes_between in [None, nodes_index_between]:
+            fp_ts = s_fp.FingerprintMats(id_ls=id_ls, path_m1=str(tmp_path / "ts_mod1"),
+                path_m2=str(tmp_path / "ts_mod2"), connectivity=kind)
+            fp_ts.subject_selection(*fp_ts.fetch_matrix_file_names(), verbose=False)
+            fp_mat = s_fp.FingerprintMats(id_ls=id_ls, path_m1=str(tmp_path / f"{kind}_mod1"),
+                path_m2=str(tmp_path / f"{kind}_mod2"))
+            fp_mat.subject_selection(*fp_mat.fetch_matrix_file_names(), verbose=False)
+
+            assert np.allclose(fp_ts.fingerprint_mats(nodes_index_within, nodes_between,
+                verbose=False), fp_mat.fingerprint_mats(nodes_index_within, nodes_between,
+                verbose=False)), f"Fingerprinting from the time series ({kind}) doesn't match \
+                the matrices"
+
+    with pytest.raises(SystemExit):
+        s_fp._timeseries_connectivity(np.ones((10, 3)), [([0, 1], None)], "coherence")
+
+def test_similarity_matrix_metrics():
+    """ Testing the cosine similarity, the distances and a callable against Scipy, and that the
+    identification metrics use the lowest distance as the best match.
+    """
+    rng = np.random.default_rng(6)
+    features_1 = rng.normal(size=(7, 40))
+    features_2 = features_1 + rng.normal(scale=0.5, size=(7, 40))
+
+    expected = {"Cosine": 1 - cdist(features_1, features_2, "cosine"),
+        "Euclidean": cdist(features_1, features_2, "euclidean"),
+        "Manhattan": cdist(features_1, features_2, "cityblock"),
+        "Geodesic": np.arccos(np.clip(1 - cdist(features_1, features_2, "correlation"), -1, 1))}
+    for corr_type, expected_matrix in expected.items():
+        for symmetric in [False, True]:
+            similar_matrix = s_fp._similarity_matrix(features_1, features_2, corr_type=corr_type,
+                block_size=3, symmetric=symmetric)
+            if symmetric:
+                expected_matrix = np.triu(expected_matrix) + np.triu(expected_matrix, k=1).T
+            assert np.allclose(similar_matrix, expected_matrix), f"{corr_type} doesn't match Scipy"
+
+    similar_callable = s_fp._similarity_matrix(features_1, features_2, block_size=3,
+        corr_type=lambda block_1, block_2: cdist(block_1, block_2, "chebyshev"))
+    assert np.allclose(similar_callable, cdist(features_1, features_2, "chebyshev")), "Callable \
+        measure is not applied to every tile"
+
+    #A distance identifies the participant with the lowest value
+    distances = expected["Euclidean"]
+    data = pd.DataFrame(index=[f"sub-{i}" for i in range(7)])
+    fp_metrics = s_fp.tab_metrics_calc(data, distances, "test", top_k=1, greater_is_better=False)
+    assert np.array_equal(fp_metrics["fia_test"], np.argmin(distances, axis=1) == np.arange(7)), "\
+        FIA should use the lowest distance"
+    assert np.array_equal(fp_metrics["fia_test"], fp_metrics["top1_test"]), "Rank should use \
+        the lowest distance"
+    assert np.allclose(fp_metrics["di_test"], fp_metrics["oi_test"] - fp_metrics["si_test"]), "\
+        DI of a distance should be OI - SI"
+
+    _, boot_ci = s_fp.tab_metrics_calc(data, distances, "test", n_boot=20, seed=0,
+        greater_is_better=False)
+    assert np.allclose(boot_ci["observed"], fp_metrics[["fia_test", "si_test", "oi_test",
+        "di_test"]].mean().values), "Bootstrap should report the distances in their units"
+    assert (boot_ci["ci_low"] <= boot_ci["ci_high"]).all(), "Bounds are inverted"
+
+    _, p_values = s_fp.fp_permutation_test(distances, n_perm=50, seed=0, greater_is_better=False)
+    assert np.allclose(p_values["observed"], boot_ci["observed"]), "Permutation test should \
+        report the distances in their units"
+
+def test_similarity_matrix_rank(tmp_path):
+    """ Testing the rank-based correlations against Scipy, including ties.
+    """
+    rng = np.random.default_rng(2)
+    features_1 = rng.integers(0, 6, size=(5, 25)).astype(float) #Integers to create ties
+    features_2 = rng.integers(0, 6, size=(4, 25)).astype(float)
+
+    spearman = s_fp._similarity_matrix(features_1, features_2, corr_type="Spearman")
+    kendall = s_fp._similarity_matrix(features_1, features_2, corr_type="Kendall", block_size=2)
+
+    assert np.allclose(spearman, [[stats.spearmanr(row_1, row_2)[0] for row_2 in features_2]
+        for row_1 in features_1]), "Spearman correlation doesn't match Scipy"
+    assert np.allclose(kendall, [[stats.kendalltau(row_1, row_2)[0] for row_2 in features_2]
+        for row_1 in features_1]), "Kendall correlation doesn't match Scipy's tau-b"
+
+    #Above the maximum number of pairs, a subset is drawn without listing all the pairs
+    first, second = s_fp._sample_pairs(5000, 300)
+    assert len(set(zip(first, second))) == 300, "Pairs of edges should be unique"
+    assert np.all(first < second), "Pairs should be ordered (i < j)"
+
+    #Ranks keep the precision of the features and their memory-map
+    features_map = np.lib.format.open_memmap(str(tmp_path / "features_m1.npy"), mode='w+',
+        dtype=np.float32, shape=features_1.shape)
+    features_map[:] = features_1
+    ranks = s_fp._rank_features(features_map, "Spearman")
+    assert isinstance(ranks, np.memmap) and ranks.dtype == np.float32, "Ranks should be a \
+        float32 memory-map"
+    assert os.path.dirname(ranks.filename) == str(tmp_path), "Ranks should be written next to \
+        the features"
+    assert not isinstance(s_fp._rank_features(features_map[1:3], "Spearman"), np.memmap), "\
+        A slice of the features shouldn't be written to the disk"
+
+def test_similarity_matrix_symmetric(monkeypatch):
+    """ Testing that the symmetric mode only computes the upper triangle and that the
+    asymmetric mode keeps both directions.
+    """
+    rng = np.random.default_rng(1)
+    features_1 = rng.normal(size=(7, 20))
+    features_2 = features_1 + rng.normal(size=(7, 20))
+    asymmetric = s_fp._similarity_matrix(features_1, features_2, block_size=3)
+
+    #Count the tiles computed
+    tiles = []
+    zscore_rows = s_fp._zscore_rows
+    monkeypatch.setattr(s_fp, "_zscore_rows",
+        lambda features, *args: tiles.append(len(features)) or zscore_rows(features, *args))
+    symmetric = s_fp._similarity_matrix(features_1, features_2, block_size=3, symmetric=True)
+    monkeypatch.undo()
+
+    assert len(tiles) == 3 + 6, "Only the 6 tiles on or above the diagonal should be computed"
+    assert np.allclose(symmetric, np.triu(asymmetric) + np.triu(asymmetric, k=1).T), "\
+        Symmetric mode should mirror the upper triangle"
+    assert not np.allclose(asymmetric, asymmetric.T), "Asymmetric mode should keep both \
+        directions"
+
+    id_ls = ["01a", "03a", "04a", "05a"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls,
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_object.subject_selection(*fp_object.fetch_matrix_file_names(), verbose=False)
+    similar_matrix = fp_object.fingerprint_mats(list(range(0, 100)), verbose=False,
+        symmetric=False)
+    assert np.allclose(similar_matrix, s_fp._similarity_matrix(fp_object.features_m1,
+        fp_object.features_m2)), "fingerprint_mats should keep both directions"
+
+def test_mirror_upper():
+    """ Testing that the upper triangle is mirrored block by block.
+    """
+    matrix = np.arange(49, dtype=float).reshape(7, 7)
+    expected = np.triu(matrix, k=0) + np.triu(matrix, k=1).T
+
+    assert np.array_equal(s_fp._mirror_upper(matrix.copy(), block_size=3), expected), "Lower \
+        triangle is not the transpose of the upper triangle"
+
 def test_fp_metrics_calc():
     """ Testing the fp_metrics_calc method
     """
@@ -155,6 +730,229 @@ def test_fp_metrics_calc():
     assert coef_data.loc['04a', 'fia_test'] == pytest.approx(1.0), "Fingerprint identifiability is not giving the right result."
     assert coef_data.loc['05a', 'di_test'] == pytest.approx(0.998836), "Differential identifiability is not giving the right result."
 
+def test_rank_metrics():
+    """ Testing the rank-based identification metrics.
+    """
+    similar_matrix = np.array([
+        [0.9, 0.5, 0.1, 0.2],
+        [0.8, 0.7, 0.9, 0.1],
+        [0.3, 0.4, 0.6, 0.6],
+        [0.1, 0.2, 0.3, 0.4]])
+
+    assert s_fp._rank_calculator(similar_matrix, block_size=3).tolist() == [1, 3, 1, 1], "\
+        Ranks of the correct match are wrong"
+    assert np.array_equal(s_fp._fia_calculator(similar_matrix, block_size=3), [1, 0, 1, 1]), "\
+        Vectorized identification accuracy is wrong"
+
+    fp_object = s_fp.FingerprintMats(id_ls=[], path_m1="", path_m2="")
+    fp_object.sub_final = ["01a", "03a", "04a", "05a"]
+    coef_data = fp_object.fp_metrics_calc(similar_matrix, name='test', top_k=[1, 3])
+
+    assert coef_data.loc['03a', 'prank_test'] == pytest.approx(1 / 3), "Percentile rank is wrong"
+    assert coef_data['top1_test'].tolist() == coef_data['fia_test'].tolist(), "Top-1 should \
+        match the identification accuracy"
+    assert coef_data['top3_test'].mean() == 1, "Every participant should be in their top-3"
+
+def test_bootstrap_metrics():
+    """ Testing the bootstrap confidence intervals against a direct resampling of the
+    similarity matrix.
+    """
+    rng = np.random.default_rng(0)
+    similar_matrix = rng.uniform(-0.2, 0.2, size=(15, 15)) + np.eye(15) * 0.25
+
+    coef_data, boot_ci = s_fp.tab_metrics_calc(pd.DataFrame(index=range(15)), similar_matrix,
+        name="test", n_boot=300, seed=3)
+
+    assert boot_ci.loc["di_test", "observed"] == pytest.approx(coef_data["di_test"].mean()), "\
+        Observed DI doesn't match the participant-level DI"
+    assert (boot_ci["ci_low"] <= boot_ci["observed"]).all() & \
+        (boot_ci["observed"] <= boot_ci["ci_high"]).all(), "Observed values outside of the CI"
+
+    #Same draws, resampling the similarity matrix directly
+    draws = np.random.default_rng(3).multinomial(15, np.full(15, 1 / 15), size=300)
+    fia_direct = []
+    for counts in draws:
+        idx = np.repeat(np.arange(15), counts)
+        sub_matrix = similar_matrix[np.ix_(idx, idx)]
+        fia_direct.append((idx[np.argmax(sub_matrix, axis=1)] == idx).mean())
+    assert boot_ci.loc["fia_test", ["ci_low", "ci_high"]].tolist() == pytest.approx(
+        np.quantile(fia_direct, [0.025, 0.975])), "Vectorized bootstrap doesn't match resampling"
+
+def test_fp_permutation_test():
+    """ Testing the permutation-based null distributions of the fingerprint metrics.
+    """
+    rng = np.random.default_rng(0)
+    similar_matrix = rng.uniform(-0.2, 0.2, size=(20, 20)) + np.eye(20) * 0.8
+
+    null_dist, p_values = s_fp.fp_permutation_test(similar_matrix, n_perm=200, batch_size=64,
+        seed=1)
+
+    assert null_dist.shape == (200, 4), "Null distribution doesn't have one row per permutation"
+    assert p_values.loc["fia", "observed"] == pytest.approx(s_fp._fia_calculator(
+        similar_matrix).mean()), "Observed FIA is wrong"
+    assert p_values.loc["di", "p_value"] == pytest.approx(1 / 201), "Strong fingerprint should \
+        never be matched by chance"
+    assert null_dist["fia"].mean() < 0.2, "Chance identification should be close to 1/20"
+
+    #Same seed gives the same permutations when they are split across processes
+    null_parallel, _ = s_fp.fp_permutation_test(similar_matrix, n_perm=200, n_jobs=2, seed=1)
+    assert null_parallel.shape == (200, 4), "Permutations are lost across processes"
+    assert null_parallel.equals(s_fp.fp_permutation_test(similar_matrix, n_perm=200, n_jobs=2,
+        seed=1)[0]), "Permutations are not reproducible"
+
+def test_pca_identifiability():
+    """ Testing that the incremental PCA reconstruction gives the identifiability of the
+    explicitly reconstructed features.
+    """
+    rng = np.random.default_rng(7)
+    fingerprints = rng.normal(size=(12, 300))
+    #Participants have different offsets, which the centering of every fingerprint removes
+    offsets = rng.normal(scale=5, size=(12, 1))
+    features_m1 = fingerprints + offsets + rng.normal(size=(12, 300))
+    features_m2 = fingerprints + offsets + rng.normal(size=(12, 300))
+
+    di_curve, best_matrix = s_fp.pca_identifiability(features_m1, features_m2)
+    assert len(di_curve) == 24, "Every number of components should be evaluated"
+
+    #Reconstruction of Amico & Goni (2018): PCA of the edges x fingerprints matrix, which
+    # centers every fingerprint and adds its mean back
+    features = np.vstack([features_m1, features_m2])
+    row_means = features.mean(axis=1, keepdims=True)
+    left, singular, right = np.linalg.svd(features - row_means, full_matrices=False)
+    for n_comp in [1, 5, di_curve.idxmax()]:
+        reconstructed = row_means + (left[:, :n_comp] * singular[:n_comp]) @ right[:n_comp]
+        similar_matrix = s_fp._similarity_matrix(reconstructed[:12], reconstructed[12:])
+        di_expected = s_fp.tab_metrics_calc(pd.DataFrame(index=range(12)), similar_matrix,
+            "pca")["di_pca"].mean()
+        assert di_curve[n_comp] == pytest.approx(di_expected), f"DI with {n_comp} components \
+            doesn't match the reconstruction"
+    assert np.allclose(best_matrix, similar_matrix), "Best matrix is not the optimal reconstruction"
+
+    di_truncated, _ = s_fp.pca_identifiability(features_m1, features_m2, n_components=5, seed=0)
+    assert np.allclose(di_truncated, di_curve[:5], atol=1e-2), "Randomized SVD should match the \
+        first components"
+
+def test_approximate_identification():
+    """ Testing the approximate identification against the exact similarity matrix.
+    """
+    rng = np.random.default_rng(8)
+    fingerprints = rng.normal(size=(300, 500))
+    features_m1 = fingerprints + rng.normal(size=(300, 500))
+    features_m2 = fingerprints + rng.normal(size=(300, 500))
+    similar_matrix = s_fp._similarity_matrix(features_m1, features_m2)
+
+    coef_data, recall = s_fp.approximate_identification(features_m1, features_m2, top_k=2,
+        n_candidates=20, block_size=64, seed=0)
+    assert np.array_equal(coef_data["fia"], s_fp._fia_calculator(similar_matrix)), "\
+        Identification doesn't match the exact similarity"
+    assert np.allclose(coef_data["similarity_1"],
+        similar_matrix[np.arange(300), coef_data["match_1"]]), "Similarities should be exact"
+    assert 0 <= recall <= 1, "Recall should be a proportion"
+
+    #Shortlisting everyone gives the exact search
+    coef_data, recall = s_fp.approximate_identification(features_m1, features_m2, top_k=2,
+        n_candidates=300, seed=0)
+    assert recall == 1, "Recall should be perfect when every participant is shortlisted"
+    assert np.array_equal(coef_data["match_2"], np.argsort(-similar_matrix, axis=1,
+        kind='stable')[:, 1]), "Second best match is wrong"
+
+    fp_object = s_fp.FingerprintMats(id_ls=["01a", "03a", "04a", "05a", "06a"],
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_object.subject_selection(*fp_object.fetch_matrix_file_names(), verbose=False)
+    coef_data, _ = fp_object.fingerprint_approx(list(range(0, 100)), verbose=False, seed=0)
+    assert coef_data["match_1"].tolist() == fp_object.sub_final, "Best matches should be \
+        given as IDs"
+
+    #The state of the object follows the approximate run, not the previous fingerprinting
+    fp_object.fingerprint_mats(list(range(0, 12)), verbose=False)
+    fp_object.fingerprint_approx(list(range(0, 5)), verbose=False, seed=0)
+    assert len(fp_object.fp_edgewise_calc()) == 10, "Edges should be the ones of the last run"
+    with pytest.raises(SystemExit):
+        fp_object.fingerprint_update(["02a"], "test", verbose=False)
+
+def test_fingerprint_stream(monkeypatch, tmp_path):
+    """ Testing the streaming metrics against the metrics of the full similarity matrix.
+    """
+    fp_object = s_fp.FingerprintMats(id_ls=["01a", "02a", "03a", "04a", "05a", "06a", "07a"],
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_object.subject_selection(*fp_object.fetch_matrix_file_names(), verbose=False)
+
+    for corr_type, symmetric in [("Pearson", True), ("Pearson", False), ("Manhattan", True)]:
+        similar_matrix = fp_object.fingerprint_mats(list(range(0, 100)), corr_type=corr_type,
+            verbose=False, symmetric=symmetric)
+        coef_full = fp_object.fp_metrics_calc(similar_matrix, "test", top_k=[1, 3])
+        coef_stream, top_data = fp_object.fingerprint_stream("test", list(range(0, 100)),
+            corr_type=corr_type, top_k=[1, 3], keep_top=2, block_size=2, verbose=False,
+            symmetric=symmetric)
+        assert list(coef_stream.columns) == list(coef_full.columns), "Columns should be the \
+            same as fp_metrics_calc"
+        assert np.allclose(coef_stream, coef_full), f"Streaming metrics differ ({corr_type}, \
+            symmetric={symmetric})"
+
+        sign = 1 if corr_type == "Pearson" else -1
+        best = np.argsort(-sign * similar_matrix, axis=1, kind='stable')[:, :2]
+        assert np.array_equal(top_data["match_2"], np.asarray(fp_object.sub_final)[best[:, 1]]), "\
+            Second best match is wrong"
+        assert np.allclose(top_data["similarity_1"], similar_matrix[np.arange(6), best[:, 0]]), "\
+            Similarity of the best match is wrong"
+
+    assert fp_object.similar_matrix is None, "No similarity matrix should be kept"
+
+    #The state can be saved without a similarity matrix
+    fp_object.fp_state_export(str(tmp_path / "state.npz"))
+    assert fp_object.fp_state_import(str(tmp_path / "state.npz")) is None, "No similarity \
+        matrix should be restored"
+    assert fp_object.features_m1.shape[0] == 6, "Features should be restored"
+
+    #Ranks are computed once per participant, not once per tile
+    rng = np.random.default_rng(3)
+    features = rng.normal(size=(8, 30))
+    ranked_rows = []
+    rank_features = s_fp._rank_features
+    def count_ranks(features, *args):
+        ranked_rows.append(np.shape(features)[0])
+        return rank_features(features, *args)
+    monkeypatch.setattr(s_fp, "_rank_features", count_ranks)
+    features_2 = features + rng.normal(size=(8, 30))
+    reductions = s_fp._stream_reductions(features, features_2, corr_type="Spearman",
+        block_size=2)
+    assert sum(ranked_rows) == 16, "Every row should be ranked once per modality"
+    similar_matrix = s_fp._similarity_matrix(features, features_2, corr_type="Spearman",
+        symmetric=True)
+    assert np.allclose(reductions["row_sums"], similar_matrix.sum(axis=1)), "Streaming \
+        Spearman doesn't match the similarity matrix"
+    assert np.array_equal(reductions["rank"], s_fp._rank_calculator(similar_matrix)), "Ranks \
+        don't match the similarity matrix"
+    with pytest.raises(SystemExit):
+        fp_object.fingerprint_update(["08a"], "test", verbose=False)
+
+def test_edgewise_identifiability():
+    """ Testing the edgewise ICC and contributions to the differential identifiability.
+    """
+    id_ls = ["01a", "03a", "04a", "05a", "06a"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls,
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_object.subject_selection(*fp_object.fetch_matrix_file_names(), verbose=False)
+    similar_matrix = fp_object.fingerprint_mats(list(range(0, 10)), list(range(10, 15)),
+        verbose=False, symmetric=False)
+
+    edges = fp_object.fp_edgewise_calc(chunk_size=7)
+
+    assert len(edges) == 50, "There should be one row per edge (10x5)"
+    assert edges.index[7] == (1, 12), "Edges are not labeled with the right nodes"
+    assert edges["di_contribution"].sum() == pytest.approx(fp_object.fp_metrics_calc(
+        similar_matrix, "test")["di_test"].mean()), "Contributions should sum to the group DI"
+
+    #ICC(1,1) of one edge, computed the usual way
+    data = np.column_stack([fp_object.features_m1[:, 3], fp_object.features_m2[:, 3]])
+    ms_between = 2 * np.var(data.mean(axis=1), ddof=1)
+    ms_within = ((data - data.mean(axis=1, keepdims=True)) ** 2).sum() / len(data)
+    assert edges["icc"].iloc[3] == pytest.approx((ms_between - ms_within) / (ms_between +
+        ms_within)), "ICC is not computed properly"
+
 def test_integration_fp_mats():
     """ Testing the integration of functions and methods to run
     the fingerprint analysis.
@@ -199,6 +997,36 @@ def test_integration_fp_mats():
     assert os.path.exists("tests/test_data/fingerprinting/output/test/similarity_matrices"), "Export function didn't create a folder for similarity matrices."
     assert os.path.exists("tests/test_data/fingerprinting/output/test/subject_list"), "Export function didn't create a folder for subject lists."
 
+def test_similarity_matrix_binary_export(tmp_path):
+    """ Testing that the binary export of the similarity matrix is lossless and that the
+    metrics can be computed on the memory-mapped matrix.
+    """
+    id_ls = ["01a", "03a", "04a", "05a", "06a", "07a", "09a", "10a"]
+    fp_object = s_fp.FingerprintMats(id_ls=id_ls,
+        path_m1="tests/test_data/fingerprinting/matrices_mod1",
+        path_m2="tests/test_data/fingerprinting/matrices_mod2")
+    fp_object.subject_selection(*fp_object.fetch_matrix_file_names(), verbose=False)
+    similar_matrix = fp_object.fingerprint_mats(list(range(0, 100)), verbose=False,
+        symmetric=False)
+    fp_coefs = fp_object.fp_metrics_calc(similar_matrix, name="test", top_k=2)
+
+    for out_format in ["npy", "npz"]:
+        fp_object.fp_mat_export(output_path=str(tmp_path / out_format), coef_data=fp_coefs,
+            similar_matrix=similar_matrix, name="test", dir_struct=False, out_format=out_format)
+        similar_lazy, ids = s_fp.import_similarity_matrix(
+            str(tmp_path / out_format / "test" / f"similarity_matrix_test.{out_format}"))
+
+        assert isinstance(similar_lazy, np.memmap), "Matrix should be memory-mapped"
+        assert np.array_equal(similar_lazy, similar_matrix), "Binary export is not lossless"
+        pd.testing.assert_frame_equal(fp_object.fp_metrics_calc(similar_lazy, name="test",
+            top_k=2), fp_coefs)
+        if out_format == "npz":
+            assert ids == fp_object.sub_final, "IDs are not stored with the matrix"
+
+    with pytest.raises(SystemExit):
+        fp_object.fp_mat_export(output_path=str(tmp_path), coef_data=fp_coefs,
+            similar_matrix=similar_matrix, name="test", out_format="parquet")
+
 @pytest.fixture
 def data_fp_tab_import():
     """ Creates the data use for tests